@@ -1,43 +1,58 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory, send_file, flash, redirect, url_for
-from g4f.client import Client
-from sarvamai import SarvamAI
+from flask import Flask, render_template, request, jsonify, send_from_directory, send_file, flash, redirect, url_for, Response, stream_with_context, make_response
 import requests
 import json
 import os
 from dotenv import load_dotenv
-import cloudinary
-import cloudinary.uploader
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import LimitedStream
+from flask import Request
+import tempfile
+import shutil
+from urllib.parse import unquote
 import base64  # Ensure this import is present
-from groq import Groq
-from transcription import transcribe_file, clean_marathi_text
-from googleapiclient.discovery import build
+from transcription import transcribe_stream, upload_for_transcription, soniox_session
+from ocr import ocr_images, iter_document, iter_ocr
+from tts import (
+    AudioCache, TTS_DEFAULTS, TTS_CHUNK_CHARS, tts_cache_key, synthesize, synthesize_long,
+    stream_long, pending_requests,
+)
+from youtube import search_videos, start_refresher, RANDOM_TOPICS
 import random
+import time
 from flask import Flask, render_template, request, jsonify, session, redirect, url_for
 from datetime import timedelta
 from mongodb import register_user, login_user, logout_user, current_user
+from conversations import create_conversation, append_message, build_context
+from transcription_jobs import submit_job, get_job, get_job_result
+from image_gen import generate_image, submit_image_job, get_image_job, ImageQueueFull
+from profile_images import submit_profile_upload, read_profile_image
 from functools import wraps
+import providers
+import rag
+import metrics
+import limits
 
 # Load environment variables
 load_dotenv()
 
-# Cloudinary configuration: prefer single CLOUDINARY_URL or individual vars
-cloudinary_url = os.getenv("CLOUDINARY_URL")
-if cloudinary_url:
-    cloudinary.config(cloudinary_url=cloudinary_url)
-else:
-    cloudinary.config(
-        cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-        api_key=os.getenv("CLOUDINARY_API_KEY"),
-        api_secret=os.getenv("CLOUDINARY_API_SECRET"),
-    )
+# Provider clients (Groq, Sarvam, YouTube, Cloudinary) are created lazily on first
+# use, see providers.py
+
+
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(4 * 1024 * 1024)))
+# Raw-body transcription uploads bypass MAX_CONTENT_LENGTH and use this limit instead
+TRANSCRIBE_MAX_UPLOAD = int(os.getenv("TRANSCRIBE_MAX_UPLOAD", str(500 * 1024 * 1024)))
+
 
-# YouTube API setup
-API_KEY = os.getenv("YOUTUBE_API_KEY")
-YOUTUBE = build("youtube", "v3", developerKey=API_KEY)
+class SpoolingRequest(Request):
+    """Keep uploads under UPLOAD_SPOOL_BYTES in memory; larger ones spill to an anonymous temp file."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES, mode="rb+")
 
 
 app = Flask(__name__)
+app.request_class = SpoolingRequest
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.secret_key = os.getenv("SECRET_KEY", "supersecretkey")
@@ -45,18 +60,85 @@ app.permanent_session_lifetime = timedelta(days=1)
 
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-sarvam_client = SarvamAI(api_subscription_key=os.getenv("SARVAM_API_KEY"))
-client = Groq(default_headers={"Groq-Model-Version": "latest"}, api_key=os.getenv("GROQ_API_KEY"))
+tts_cache = AudioCache(app.config['UPLOAD_FOLDER'])
+metrics.register_cache("tts_audio", tts_cache)
+
+# Per-route latency/status/bytes for /metrics; measured around the whole WSGI response
+app.wsgi_app = metrics.MetricsMiddleware(app.wsgi_app)
+
+
+@app.before_request
+def _label_route():
+    # Label by route template (/image/jobs/<job_id>), not raw path, to keep cardinality bounded
+    request.environ["metrics.route"] = request.url_rule.rule if request.url_rule else "unmatched"
+
+
+# Token bucket (see limits.RATE_LIMITS) charged per request; other routes use "default"
+RATE_LIMITED_ROUTES = {
+    ("POST", "chat"): "chat",
+    ("POST", "chat_stream"): "chat",
+    ("POST", "image"): "image",
+    ("POST", "ocr"): "ocr",
+    ("POST", "ocr_batch"): "ocr",
+    ("POST", "tts"): "tts",
+}
+# Upstream providers a request calls while it is served; one slot of each is held until
+# the response is closed (streamed bodies call the provider while they are sent)
+PROVIDER_ROUTES = {
+    ("POST", "chat"): ("groq",),
+    ("POST", "chat_stream"): ("groq",),
+    ("POST", "tts"): ("sarvam",),
+    ("GET", "tts_stream"): ("sarvam",),
+    ("POST", "transcribe"): ("soniox",),
+    ("POST", "transcribe_job_create"): ("soniox",),
+    ("POST", "upload_doc"): ("rag",),
+    ("POST", "ask_doc"): ("rag",),
+    ("GET", "youtube_search"): ("youtube",),
+    ("GET", "youtube_random"): ("youtube",),
+}
+# Routes that fan out or queue provider calls take a slot per call (limits.slot) where the
+# call is made; here they are only shed up front when the provider is saturated or down
+PROVIDER_CHECKED_ROUTES = {
+    ("POST", "image"): ("image",),
+    ("POST", "ocr"): ("openrouter",),
+    ("POST", "ocr_batch"): ("openrouter",),
+}
+
+
+def _shed(message, status, retry_after):
+    response = jsonify({"error": message, "retry_after": limits.retry_after_header(retry_after)})
+    response.status_code = status
+    response.headers["Retry-After"] = limits.retry_after_header(retry_after)
+    return response
 
 
 def login_required(f):
-    """Decorator to protect routes that require login"""
+    """Decorator to protect routes that require login (also applies rate and provider limits)"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not current_user():
+        user = current_user()
+        if not user:
             flash("Please login to access this feature.", "warning")
             return redirect(url_for('login'))
-        return f(*args, **kwargs)
+
+        route = (request.method, request.endpoint)
+        retry_after = limits.check_rate(user.get("id"), RATE_LIMITED_ROUTES.get(route, "default"))
+        if retry_after:
+            return _shed("Too many requests, please slow down.", 429, retry_after)
+        retry_after = limits.check(PROVIDER_CHECKED_ROUTES.get(route, ()))
+        if not retry_after:
+            held, retry_after = limits.acquire(PROVIDER_ROUTES.get(route, ()))
+        if retry_after:
+            return _shed("Service is busy, please retry shortly.", 503, retry_after)
+        if not held:
+            return f(*args, **kwargs)
+        try:
+            response = make_response(f(*args, **kwargs))
+        except BaseException:
+            limits.release(held)
+            raise
+        response.call_on_close(lambda: limits.release(held))
+        return response
     return decorated_function
 
 
@@ -91,27 +173,24 @@ def register():
             flash("All fields are required", "error")
             return render_template("register.html", user=user)
 
-        # optional profile image file upload -> Cloudinary
-        profile_url = None
+        # Create the account right away; the optional profile image is uploaded to
+        # Cloudinary (with thumbnails) in the background and written back to the user
         profile_file = request.files.get("profile_image")
+        profile_data = None
         if profile_file and profile_file.filename:
-            try:
-                upload_res = cloudinary.uploader.upload(
-                    profile_file,
-                    folder="multimodal_profiles",
-                    use_filename=True,
-                    unique_filename=False,
-                    overwrite=False,
-                )
-                profile_url = upload_res.get("secure_url")
-            except Exception as e:
-                print("Cloudinary upload failed:", e)
-                flash("Profile image upload failed; continuing without image.", "warning")
+            profile_data, error = read_profile_image(profile_file.stream)
+            if error:
+                flash(error, "error")
+                return render_template("register.html", user=user)
 
-        result = register_user(name, email, password, profile_image=profile_url)
+        result = register_user(name, email, password)
 
         if result.get("status") == "success":
-            flash("Successfully registered! Please login.", "success")
+            if profile_data:
+                submit_profile_upload(result["user"]["_id"], profile_data)
+                flash("Successfully registered! Your profile image is being processed. Please login.", "success")
+            else:
+                flash("Successfully registered! Please login.", "success")
             return redirect(url_for('login'))
         else:
             flash(result.get("message", "Registration failed"), "error")
@@ -152,6 +231,11 @@ def login():
             if not session.get("user"):
                 session["user"] = result.get("user")
             flash("Successfully logged in!", "success")
+            status = result.get("user", {}).get("profile_image_status")
+            if status == "error":
+                flash("Your profile image could not be uploaded, so the default avatar is shown.", "warning")
+            elif status == "pending":
+                flash("Your profile image is still being processed; it will appear on your next login.", "info")
             return redirect(url_for('index'))
         else:
             flash(result.get("message", "Login failed"), "error")
@@ -174,6 +258,18 @@ def get_user():
     return jsonify({"logged_in": False})
 
 
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Prometheus scrape endpoint (this worker's counters, see metrics.py)."""
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/metrics/auth", methods=["GET"])
+def auth_metrics():
+    """Login/register latency for this worker (hash/verify time is the process-pool share)."""
+    return jsonify(metrics.snapshot("auth."))
+
+
 # make current_user() available in all templates as `user`
 @app.context_processor
 def inject_user():
@@ -186,7 +282,59 @@ def index():
     # show landing page for everyone; logged-in users will see profile pic / flash messages
     return render_template('index.html', user=user)
 
-# Chatbot endpoint (now handles full conversation history)
+# Chatbot endpoint (conversation history is stored server-side, see conversations.py)
+CHAT_MODEL = "groq/compound-mini"   # or try "mixtral-8x7b-32768" for larger model
+CHAT_PARAMS = {"temperature": 1, "max_completion_tokens": 1024, "top_p": 1}
+# Summarize turns that fall out of the token budget instead of just dropping them
+CHAT_ROLLING_SUMMARY = os.getenv("CHAT_ROLLING_SUMMARY", "1") == "1"
+
+
+def _summarize_turns(summary, turns):
+    """Fold turns that no longer fit the context window into the rolling summary."""
+    transcript = "\n".join(f"{t['role']}: {t['content']}" for t in turns)
+    try:
+        # Runs on the background summary pool, so it takes its own Groq slot
+        with limits.slot("groq"), metrics.upstream("groq"):
+            completion = providers.get("groq").chat.completions.create(
+                model=CHAT_MODEL,
+                messages=[
+                    {"role": "system", "content": "Condense the conversation into a short summary that keeps the facts, names and decisions needed to continue it."},
+                    {"role": "user", "content": f"Existing summary:\n{summary}\n\nNew turns:\n{transcript}"},
+                ],
+                temperature=0,
+                max_completion_tokens=256,
+            )
+        return completion.choices[0].message.content.strip()
+    except Exception as e:
+        print(f"Conversation summary failed, truncating instead: {str(e)}")
+        return summary
+
+
+def _chat_messages(data):
+    """
+    Resolve the upstream message list for a /chat request.
+    Clients send only the new `message` (plus `conversation_id` after the first turn);
+    history lives server-side. A full `messages` list is still accepted for old clients.
+    Returns (messages, conversation_id); conversation_id is None for full-history requests.
+    """
+    if data.get('messages'):
+        return data['messages'], None
+
+    message = data.get('message')
+    if not message:
+        return None, None
+
+    user_id = current_user().get('id')
+    conv_id = data.get('conversation_id')
+    conv = append_message(conv_id, user_id, 'user', message) if conv_id else None
+    if conv is None:
+        conv_id = create_conversation(user_id)
+        conv = append_message(conv_id, user_id, 'user', message)
+
+    summarize = _summarize_turns if CHAT_ROLLING_SUMMARY else None
+    return build_context(conv, summarize=summarize), conv_id
+
+
 @app.route('/chat', methods=['GET', 'POST'])
 @login_required
 def chat():
@@ -200,27 +348,25 @@ def chat():
             if data is None:
                 data = request.form.to_dict()
 
-            messages = data.get('messages')
-            if not messages and data.get('message'):
-                messages = [{"role": "user", "content": data['message']}]
-
+            messages, conv_id = _chat_messages(data)
             if not messages:
                 return jsonify({'error': 'No message content provided'}), 400
 
             # ✅ Groq API call (no compound_custom)
-            completion = client.chat.completions.create(
-                model="groq/compound-mini",   # or try "mixtral-8x7b-32768" for larger model
-                messages=messages,
-                temperature=1,
-                max_completion_tokens=1024,
-                top_p=1,
-                stream=False  # You can enable streaming later
-            )
+            with metrics.upstream("groq"):
+                completion = providers.get("groq").chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=messages,
+                    stream=False,
+                    **CHAT_PARAMS
+                )
 
             # ✅ Extract assistant’s reply
             if completion and completion.choices:
                 bot_response = completion.choices[0].message.content
-                return jsonify({'response': bot_response})
+                if conv_id:
+                    append_message(conv_id, current_user().get('id'), 'assistant', bot_response)
+                return jsonify({'response': bot_response, 'conversation_id': conv_id})
             else:
                 return jsonify({'error': 'No response generated'}), 500
 
@@ -229,12 +375,81 @@ def chat():
             return jsonify({'error': f'Chat processing error: {str(e)}'}), 500
 
 
+def _sse(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+@app.route('/chat/stream', methods=['POST'])
+@login_required
+def chat_stream():
+    """Stream the assistant reply token by token as Server-Sent Events."""
+    data = request.get_json(silent=True)
+    if data is None:
+        data = request.form.to_dict()
+
+    try:
+        messages, conv_id = _chat_messages(data)
+    except Exception as e:
+        print(f"Error in chat stream endpoint: {str(e)}")
+        return jsonify({'error': f'Chat processing error: {str(e)}'}), 500
+    if not messages:
+        return jsonify({'error': 'No message content provided'}), 400
+
+    user_id = current_user().get('id')
+    started = time.perf_counter()
+    try:
+        with metrics.upstream("groq"):
+            stream = providers.get("groq").chat.completions.create(
+                model=CHAT_MODEL,
+                messages=messages,
+                stream=True,
+                **CHAT_PARAMS
+            )
+    except Exception as e:
+        print(f"Error in chat stream endpoint: {str(e)}")
+        return jsonify({'error': f'Chat processing error: {str(e)}'}), 500
+
+    def generate():
+        ttft = None
+        reply = []
+        try:
+            if conv_id:
+                yield _sse({'conversation_id': conv_id})
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content
+                if not token:
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                reply.append(token)
+                yield _sse({'token': token})
+            if conv_id and reply:
+                append_message(conv_id, user_id, 'assistant', "".join(reply))
+            yield _sse({'done': True, 'ttft_ms': round(ttft * 1000) if ttft is not None else None})
+        except Exception as e:
+            print(f"Error in chat stream endpoint: {str(e)}")
+            yield _sse({'error': f'Chat processing error: {str(e)}'})
+        finally:
+            # Also runs on GeneratorExit when the client disconnects, so the upstream
+            # Groq connection is released instead of generating tokens nobody reads.
+            stream.close()
+            if ttft is not None:
+                metrics.llm_ttft.observe(ttft, "groq")
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
 # Image generation endpoint
 @app.route('/image', methods=['GET', 'POST'])
 @login_required
 def image():
     user = current_user()
-    client = Client()
     if request.method == 'GET':
         return render_template('image.html', user=user)
     
@@ -242,17 +457,40 @@ def image():
         prompt = request.form.get('prompt')
         if not prompt:
             return jsonify({'error': 'No prompt provided'}), 400
-        
+
+        # async=1: return a job id right away and let the page poll for the URL
+        if request.form.get('async') in ('1', 'true'):
+            try:
+                job_id = submit_image_job(user.get('id'), prompt)
+            except ImageQueueFull as e:
+                return _shed(str(e), 503, 5)
+            except Exception as e:
+                return jsonify({'error': str(e)}), 500
+            return jsonify({
+                'job_id': job_id,
+                'status': 'queued',
+                'status_url': url_for('image_job_status', job_id=job_id),
+            }), 202
+
         try:
-            response = client.images.generate(
-                model="flux",
-                prompt=prompt,
-                response_format="url"
-            )
-            image_url = response.data[0].url
+            image_url = generate_image(prompt)
             return jsonify({'image_url': image_url})
         except Exception as e:
             return jsonify({'error': str(e)}), 500
+
+
+@app.route('/image/jobs/<job_id>', methods=['GET'])
+@login_required
+def image_job_status(job_id):
+    job = get_image_job(job_id, current_user().get('id'))
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({
+        'job_id': job['_id'],
+        'status': job['status'],
+        'image_url': job.get('image_url'),
+        'error': job.get('error'),
+    })
         
 
 @app.route('/ocr', methods=['GET', 'POST'])
@@ -270,72 +508,60 @@ def ocr():
         if not files:
             return jsonify({'error': 'No selected files'}), 400
         
-        results = []
-        for file in files:
-            if file:
-                filename = secure_filename(file.filename)
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-
-                try:
-                    with open(filepath, 'rb') as img_file:
-                        img_base64 = base64.b64encode(img_file.read()).decode('utf-8')
-                    
-                    response = requests.post(
-                        url="https://openrouter.ai/api/v1/chat/completions",
-                        headers={
-                            "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
-                            "Content-Type": "application/json",
-                            "HTTP-Referer": os.getenv('SITE_URL'),
-                            "X-Title": os.getenv('SITE_NAME'),
-                        },
-                        json={
-                            "model": "mistralai/mistral-small-3.2-24b-instruct:free",
-                            "messages": [
-                                {
-                                    "role": "user",
-                                    "content": [
-                                        {
-                                            "type": "text",
-                                            "text": "Extract all visible text clearly from this image and return plain text only."
-                                        },
-                                        {
-                                            "type": "image_url",
-                                            "image_url": {
-                                                "url": f"data:image/jpeg;base64,{img_base64}"
-                                            }
-                                        }
-                                    ]
-                                }
-                            ]
-                        }
-                    )
-                    print(response) 
-                    result = response.json()
-
-                    # ✅ Handle both success and error cases properly
-                    if response.status_code != 200:
-                        error_msg = result.get("error", {}).get("message", "API request failed.")
-                        results.append({'filename': filename, 'text': f"❌ Error: {error_msg}"})
-                    elif "choices" in result and result["choices"]:
-                        extracted_text = result["choices"][0]["message"]["content"].strip()
-                        results.append({'filename': filename, 'text': extracted_text})
-                    else:
-                        results.append({'filename': filename, 'text': "❌ No text extracted or empty response."})
-
-                except Exception as e:
-                    results.append({'filename': filename, 'text': f"❌ Exception: {str(e)}"})
-
-                finally:
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
+        images = [(secure_filename(file.filename), file.read()) for file in files if file]
+        results = ocr_images(images)
 
         return jsonify({'results': results})
-    
+
+
+OCR_BATCH_RAW_TYPES = ("application/pdf", "application/zip", "application/x-zip-compressed")
+OCR_BATCH_MAX_UPLOAD = int(os.getenv("OCR_BATCH_MAX_UPLOAD", str(200 * 1024 * 1024)))
+
+
+@app.route('/ocr/batch', methods=['POST'])
+@login_required
+def ocr_batch():
+    """
+    OCR a multi-page PDF or a zip of images. Pages are split and OCR'd a few at a time,
+    and each result is streamed as an NDJSON line ({"index", "filename", "text"}) as soon
+    as it is done, followed by {"done": true, "pages": n}.
+    """
+    source, error = _upload_source(raw_types=OCR_BATCH_RAW_TYPES, max_size=OCR_BATCH_MAX_UPLOAD)
+    if error:
+        return error
+    stream, filename, _, _ = source
+    if isinstance(stream, LimitedStream):
+        # PDF and zip readers need to seek; spool the raw body like a multipart upload
+        spooled = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES, mode="rb+")
+        shutil.copyfileobj(stream, spooled, 1024 * 1024)
+        spooled.seek(0)
+        stream = spooled
+
+    def generate():
+        pages = 0
+        try:
+            for result in iter_ocr(iter_document(stream, filename)):
+                pages += 1
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        except Exception as e:
+            print(f"OCR batch error: {e}")
+            yield json.dumps({"error": f"Could not read {filename}: {e}"}) + "\n"
+        yield json.dumps({"done": True, "pages": pages}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # Serve uploaded files (including TTS audio)
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    """Serve generated audio files."""
+    """Serve generated audio files (conditional requests and HTTP Range are supported)."""
+    if tts_cache.is_cached_name(filename):
+        # Content-addressed: the hash is a strong ETag and the file never changes
+        key = filename[len(tts_cache.prefix):-len(tts_cache.suffix)]
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename,
+                                       etag=key, max_age=365 * 24 * 3600)
+        response.cache_control.immutable = True
+        return response
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
 
@@ -352,53 +578,61 @@ def tts():
         speaker = data.get("voice", "anushka")
         language = data.get("language", "hi-IN")
 
-        if not text:
+        # Whitespace-only text has no sentences to synthesize
+        if not isinstance(text, str) or not text.strip():
             return jsonify({"error": "No text provided"}), 400
 
-        # Clean up old .wav files
-        for f in os.listdir(app.config['UPLOAD_FOLDER']):
-            if f.endswith(".wav"):
-                os.remove(os.path.join(app.config['UPLOAD_FOLDER'], f))
-
-        filename = f"tts_output_{speaker}.wav"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-
-        # Generate audio
-        response = sarvam_client.text_to_speech.convert(
-            text=text,
-            target_language_code=language,
-            speaker=speaker,
-            pitch=0,
-            pace=1,
-            loudness=1,
-            speech_sample_rate=22050,
-            enable_preprocessing=True,
-            model="bulbul:v2"
-        )
-
-        # Decode and save the first audio file
-        if hasattr(response, 'audios') and response.audios:
-            audio_base64 = response.audios[0]
-            # Fix: ensure we handle bytes properly
-            if isinstance(audio_base64, str):
-                audio_bytes = base64.b64decode(audio_base64)
+        params = dict(TTS_DEFAULTS, pitch=data.get("pitch", TTS_DEFAULTS["pitch"]),
+                      pace=data.get("pace", TTS_DEFAULTS["pace"]))
+        key = tts_cache_key(text, speaker, language, params)
+
+        # Repeated prompts are served from the audio cache without calling Sarvam
+        filename = tts_cache.get(key)
+        if filename is None:
+            if len(text) > TTS_CHUNK_CHARS and data.get("stream"):
+                # Long text: hand back a URL that plays while the chunks are synthesized
+                pending_requests.set(key, {"text": text, "speaker": speaker, "language": language, "params": params})
+                stream_url = url_for('tts_stream', key=key)
+                return jsonify({"audio_url": stream_url, "download_url": stream_url, "streaming": True})
+            if len(text) > TTS_CHUNK_CHARS:
+                audio_bytes = synthesize_long(providers.get("sarvam"), text, speaker, language, params)
             else:
-                audio_bytes = audio_base64
+                audio_bytes = synthesize(providers.get("sarvam"), text, speaker, language, params)
+            if not audio_bytes:
+                return jsonify({"error": "No audio generated"}), 500
+            filename = tts_cache.put(key, audio_bytes)
 
-            with open(filepath, 'wb') as f:
-                f.write(audio_bytes)
-
-            audio_url = f"/uploads/{filename}"
-            return jsonify({
-                "audio_url": audio_url,
-                "download_url": audio_url
-            })
-        else:
-            return jsonify({"error": "No audio generated"}), 500
+        audio_url = url_for('uploaded_file', filename=filename)
+        return jsonify({
+            "audio_url": audio_url,
+            "download_url": audio_url
+        })
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/tts/stream/<key>', methods=['GET'])
+@login_required
+def tts_stream(key):
+    """Stream a long-form TTS request as one WAV, starting as soon as the first chunk is ready."""
+    filename = tts_cache.get(key)
+    if filename is not None:
+        return redirect(url_for('uploaded_file', filename=filename))
+
+    pending = pending_requests.get(key)
+    if pending is None:
+        return jsonify({"error": "Unknown or expired TTS request"}), 404
+
+    def on_complete(audio_bytes):
+        tts_cache.put(key, audio_bytes)
+        pending_requests.delete(key)
+
+    audio = stream_long(providers.get("sarvam"), pending["text"], pending["speaker"], pending["language"],
+                        pending["params"], on_complete=on_complete, key=key)
+    return Response(stream_with_context(audio), mimetype='audio/wav',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route("/transcribe", methods=["GET", "POST"])
 @login_required
 def transcribe():
@@ -414,18 +648,111 @@ def transcribe():
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
 
-    filename = secure_filename(file.filename)
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(filepath)
-
     try:
-        transcript = clean_marathi_text(transcribe_file(filepath))
+        # Forward the spooled upload directly; nothing is written under uploads/
+        transcript = transcribe_stream(
+            file.stream, secure_filename(file.filename), file.mimetype, _stream_size(file.stream),
+            use_cache=not _cache_bypassed(),
+        )
         return jsonify({"transcribed_text": transcript})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        if os.path.exists(filepath):
-            os.remove(filepath)
+
+
+def _cache_bypassed():
+    """True when the client asked for a fresh result (?nocache=1 or Cache-Control: no-cache)."""
+    return (request.args.get("nocache") in ("1", "true")
+            or "no-cache" in request.headers.get("Cache-Control", ""))
+
+
+def _stream_size(stream):
+    """Size of a seekable upload stream, or None."""
+    try:
+        size = stream.seek(0, os.SEEK_END)
+        stream.seek(0)
+        return size
+    except (AttributeError, OSError):
+        return None
+
+
+def _upload_source(raw_types=("audio/", "video/"), max_size=TRANSCRIBE_MAX_UPLOAD):
+    """
+    Resolve the uploaded file stream for a request.
+    A raw body (Content-Type matching raw_types or application/octet-stream, name in
+    X-Filename) is read straight from wsgi.input in chunks, so it is never buffered and
+    may exceed MAX_CONTENT_LENGTH up to max_size. Multipart `file` uploads are spooled
+    by SpoolingRequest as usual.
+    Returns (stream, filename, content_type, size) or an error response tuple.
+    """
+    mimetype = request.mimetype or ""
+    if mimetype.startswith(raw_types) or mimetype == "application/octet-stream":
+        size = request.content_length
+        if size is None:
+            return None, (jsonify({"error": "Content-Length required"}), 411)
+        if size > max_size:
+            return None, (jsonify({"error": "File too large"}), 413)
+        filename = secure_filename(unquote(request.headers.get("X-Filename", ""))) or "upload"
+        stream = LimitedStream(request.environ["wsgi.input"], size)
+        return (stream, filename, mimetype, size), None
+
+    file = request.files.get('file')
+    if not file:
+        return None, (jsonify({"error": "No file provided"}), 400)
+    if file.filename == '':
+        return None, (jsonify({"error": "No selected file"}), 400)
+    return (file.stream, secure_filename(file.filename), file.mimetype, _stream_size(file.stream)), None
+
+
+def _job_payload(job):
+    return {
+        "job_id": job["_id"],
+        "status": job["status"],
+        "upstream_status": job.get("upstream_status"),
+        "error": job.get("error"),
+        "status_url": url_for('transcribe_job_status', job_id=job["_id"]),
+        "result_url": url_for('transcribe_job_result', job_id=job["_id"]),
+    }
+
+
+@app.route("/transcribe/jobs", methods=["POST"])
+@login_required
+def transcribe_job_create():
+    """Stream the upload to Soniox, queue the transcription and return a job id (202)."""
+    source, error = _upload_source()
+    if error:
+        return error
+
+    try:
+        cache_key, cached, file_id = upload_for_transcription(
+            soniox_session(), *source, use_cache=not _cache_bypassed()
+        )
+        job_id = submit_job(current_user().get('id'), file_id, cache_key=cache_key, cached_text=cached)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    job = get_job(job_id, current_user().get('id'))
+    return jsonify(_job_payload(job)), 202
+
+
+@app.route("/transcribe/jobs/<job_id>", methods=["GET"])
+@login_required
+def transcribe_job_status(job_id):
+    job = get_job(job_id, current_user().get('id'))
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(_job_payload(job))
+
+
+@app.route("/transcribe/jobs/<job_id>/result", methods=["GET"])
+@login_required
+def transcribe_job_result(job_id):
+    job = get_job_result(job_id, current_user().get('id'))
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] == "completed":
+        return jsonify({"transcribed_text": job["text"]})
+    if job["status"] == "error":
+        return jsonify({"error": job.get("error") or "Transcription failed"}), 500
+    return jsonify({"status": job["status"]}), 202
 
 
 @app.route('/chatdoc', methods=['GET'])
@@ -434,29 +761,28 @@ def chatdoc_page():
     user = current_user()
     return render_template('chatdoc.html', user=user)
 
+
+# Document bodies that /upload_doc accepts raw (besides multipart `file`)
+RAG_RAW_TYPES = ("application/pdf", "application/msword", "application/vnd.openxmlformats", "text/plain")
+RAG_MAX_UPLOAD = int(os.getenv("RAG_MAX_UPLOAD", str(100 * 1024 * 1024)))
+
 @app.route('/upload_doc', methods=['POST'])
 @login_required
 def upload_doc():
-    file = request.files.get("file")
-    if not file:
-        return jsonify({"error": "No file uploaded"}), 400
+    """Stream the document to the RAG service (raw body or multipart `file`)."""
+    source, error = _upload_source(raw_types=RAG_RAW_TYPES, max_size=RAG_MAX_UPLOAD)
+    if error:
+        return error
+    stream, filename, content_type, size = source
 
-    # Forward to rag_chat FastAPI
-    RAG_API_URL = os.getenv("RAG_API_URL")
     try:
-        file_bytes = file.read()
-        files = {
-            "file": (secure_filename(file.filename), file_bytes, file.content_type or "application/pdf")
-        }
-        resp = requests.post(f"{RAG_API_URL}/upload_doc", files=files, timeout=30)
-        try:
-            payload = resp.json()
-        except Exception:
-            payload = {"status_code": resp.status_code, "text": resp.text}
-        if resp.status_code // 100 == 2:
-            return jsonify(payload)
-        else:
-            return jsonify({"error": "RAG service error", "detail": payload}), resp.status_code
+        payload, doc_version = rag.upload_document(stream, filename, content_type, size,
+                                                      user_id=current_user().get('id'))
+        # Answers are cached per document version, see rag.ask
+        session["rag_doc"] = doc_version
+        return jsonify(payload)
+    except rag.RAGError as e:
+        return jsonify({"error": "RAG service error", "detail": e.detail}), e.status_code
     except requests.exceptions.RequestException as e:
         return jsonify({"error": "Failed to contact RAG service", "detail": str(e)}), 502
     except Exception as e:
@@ -471,36 +797,8 @@ def ask_doc():
     if not question:
         return jsonify({"error": "No question provided"}), 400
 
-    RAG_API_URL = os.getenv("RAG_API_URL")
     try:
-        # Send request to the FastAPI backend
-        resp = requests.post(
-            f"{RAG_API_URL}/ask",
-            data={"question": question},
-            headers={"Accept": "application/json"},
-            timeout=30
-        )
-
-        # Try to parse JSON response
-        try:
-            payload = resp.json()
-        except Exception:
-            payload = {"text": resp.text}
-
-
-        # ✅ FIX: Standardize payload structure for frontend
-        answer = payload.get("answer")
-        print("Answer from RAG:", answer)
-        source = payload.get("source")
-
-        # ✅ Ensure the data is clean before sending back
-        if not answer:
-            answer = "No answer returned from RAG service."
-
-        return jsonify({
-            "answer": answer.strip(),
-            "source": source
-        })
+        return jsonify(rag.ask(question, session.get("rag_doc"), current_user().get('id')))
 
     except requests.exceptions.RequestException as e:
         return jsonify({
@@ -529,18 +827,11 @@ def youtube_page():
 def youtube_search():
     """Search videos by query"""
     query = request.args.get('q', 'AI')
+    start_refresher(providers.get("youtube"))
 
     try:
-        request_api = YOUTUBE.search().list(
-            q=query,
-            part="snippet",
-            maxResults=10,
-            type="video"
-        )
-        response = request_api.execute()
-
         videos = []
-        for item in response.get("items", []):
+        for item in search_videos(providers.get("youtube"), query):
             videos.append({
                 "title": item["snippet"]["title"],
                 "channel": item["snippet"]["channelTitle"],
@@ -558,21 +849,13 @@ def youtube_search():
 @app.route('/youtube/random', methods=['GET'])
 @login_required
 def youtube_random():
-    """Fetch random videos"""
-    random_topics = ["music", "tech", "sports", "news", "funny", "gaming", "AI", "education", "space"]
-    random_query = random.choice(random_topics)
+    """Fetch random videos (served from the prefetched topic cache)"""
+    random_query = random.choice(RANDOM_TOPICS)
+    start_refresher(providers.get("youtube"))
 
     try:
-        request_api = YOUTUBE.search().list(
-            q=random_query,
-            part="snippet",
-            maxResults=10,
-            type="video"
-        )
-        response = request_api.execute()
-
         videos = []
-        for item in response.get("items", []):
+        for item in search_videos(providers.get("youtube"), random_query):
             videos.append({
                 "topic": random_query,
                 "title": item["snippet"]["title"],
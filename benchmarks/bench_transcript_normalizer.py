@@ -0,0 +1,97 @@
+"""
+Benchmark: single-pass normalize_tokens() vs the old multi-pass transcript cleanup.
+
+Builds synthetic Soniox token streams of mixed Devanagari/Latin text (with glued
+punctuation, dot runs and stray whitespace), checks both pipelines produce identical
+output, and reports timings.
+
+    python benchmarks/bench_transcript_normalizer.py --sizes 1 4 16 --repeat 5
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transcription import normalize_tokens, clean_marathi_text  # noqa: E402
+
+DEVANAGARI_WORDS = ["नमस्कार", "आज", "आपण", "बैठक", "सुरू", "करूया", "प्रकल्प", "माहिती", "धन्यवाद", "काय", "झाले"]
+LATIN_WORDS = ["meeting", "project", "deadline", "okay", "so", "the", "update", "AI", "model", "team", "next"]
+PUNCTUATION = [".", ",", "?", "!", "...", "..", '"', "“", "”"]
+SPACING = [" ", " ", " ", " ", "  ", "\n", "\t", ""]
+
+
+def _legacy_clean(text):
+    """clean_marathi_text as it was before the single-pass normalizer."""
+    text = re.sub(r'\.{2,}', '.', text)
+    text = re.sub(r'([.!?,"“”])([^\s])', r'\1 \2', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+
+def legacy_pipeline(tokens):
+    """Old path: join, clean in get_transcript, whitespace re.sub, clean again in the route."""
+    text = "".join(token["text"] for token in tokens)
+    text = _legacy_clean(text)
+    text = re.sub(r'\s+', ' ', text).strip()
+    return _legacy_clean(text)
+
+
+def new_pipeline(tokens):
+    return normalize_tokens(tokens)
+
+
+def make_tokens(target_bytes, seed=0):
+    """Soniox-style sub-word tokens totalling roughly target_bytes of UTF-8."""
+    rng = random.Random(seed)
+    tokens = []
+    size = 0
+    while size < target_bytes:
+        word = rng.choice(DEVANAGARI_WORDS if rng.random() < 0.6 else LATIN_WORDS)
+        if rng.random() < 0.15:
+            word += rng.choice(PUNCTUATION)
+        word += rng.choice(SPACING)
+        # Soniox splits words into several tokens
+        cut = rng.randint(1, max(1, len(word) - 1))
+        for piece in (word[:cut], word[cut:]):
+            if piece:
+                tokens.append({"text": piece})
+                size += len(piece.encode("utf-8"))
+    return tokens
+
+
+def best_of(fn, arg, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(arg)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 8], help="transcript sizes in MB")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'size':>8} {'tokens':>10} {'legacy (s)':>12} {'single-pass (s)':>16} {'speedup':>8}")
+    for size_mb in args.sizes:
+        tokens = make_tokens(int(size_mb * 1024 * 1024), seed=args.seed)
+        legacy_time, legacy_out = best_of(legacy_pipeline, tokens, args.repeat)
+        new_time, new_out = best_of(new_pipeline, tokens, args.repeat)
+        if legacy_out != new_out:
+            sys.exit(f"Output mismatch at {size_mb} MB")
+        # The normalizer must also agree with a one-shot clean and be idempotent
+        assert clean_marathi_text("".join(t["text"] for t in tokens)) == new_out
+        assert clean_marathi_text(new_out) == new_out
+        print(f"{size_mb:>6.1f}MB {len(tokens):>10} {legacy_time:>12.4f} {new_time:>16.4f} {legacy_time / new_time:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,522 @@
+"""
+Offline load test: runs app.py against local fake providers and measures it under load.
+
+One fake server stands in for Groq, OpenRouter, Sarvam, Soniox, YouTube and the RAG
+service (configurable latency, error rate and payload size). The app is started in a
+subprocess pointed at it, logged in as a throwaway user (mongomock by default), and
+each endpoint is driven at the given concurrency levels. Reports p50/p95/p99 latency,
+requests per second, errors and peak RSS of the app's process tree, and saves the run
+as JSON under benchmarks/results/ for later comparison.
+
+    python benchmarks/load_test.py --endpoints chat ocr tts --concurrency 1 8 32
+    python benchmarks/load_test.py --latency 800 --provider-latency soniox=50 --error-rate 0.02
+    python benchmarks/load_test.py --repeat-inputs          # measure cache hits instead of misses
+    python benchmarks/load_test.py --compare benchmarks/results/load-20250101-120000.json
+
+Needs the app's requirements installed (plus mongomock, unless --mongo-uri is given).
+"""
+import io
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import base64
+import random
+import socket
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+ENDPOINTS = ["chat", "ocr", "tts", "transcribe", "ask_doc", "youtube"]
+PROVIDERS = ["groq", "openrouter", "sarvam", "soniox", "youtube", "rag"]
+
+
+# -------------------- fake providers --------------------
+
+def _wav(nbytes: int) -> bytes:
+    """A silent 16-bit mono WAV with nbytes of PCM data."""
+    nbytes -= nbytes % 2
+    fmt = (1).to_bytes(2, "little") + (1).to_bytes(2, "little") + (22050).to_bytes(4, "little") \
+        + (44100).to_bytes(4, "little") + (2).to_bytes(2, "little") + (16).to_bytes(2, "little")
+    return b"".join([b"RIFF", (36 + nbytes).to_bytes(4, "little"), b"WAVE",
+                     b"fmt ", len(fmt).to_bytes(4, "little"), fmt,
+                     b"data", nbytes.to_bytes(4, "little"), bytes(nbytes)])
+
+
+def _text(nbytes: int) -> str:
+    words = ["नमस्कार", "meeting", "project", "आज", "update", "model", "धन्यवाद", "team"]
+    out, size = [], 0
+    while size < nbytes:
+        word = random.choice(words)
+        out.append(word)
+        size += len(word.encode("utf-8")) + 1
+    return " ".join(out)
+
+
+class FakeProviders(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency_ms: dict, error_rate: float, payload_bytes: int):
+        super().__init__(("127.0.0.1", 0), _FakeHandler)
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.payload_bytes = payload_bytes
+        self.calls = {name: 0 for name in PROVIDERS}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, provider: str):
+        with self._lock:
+            self.calls[provider] += 1
+
+
+class _FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            data = bytearray()
+            while True:
+                size = int(self.rfile.readline().strip() or b"0", 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return bytes(data)
+                data += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _send(self, status: int, payload, content_type="application/json"):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _provider(self, path: str) -> str:
+        if path.endswith("/chat/completions"):
+            return "openrouter" if path.startswith("/api/") else "groq"
+        if "text-to-speech" in path:
+            return "sarvam"
+        if path.startswith("/v1/"):
+            return "soniox"
+        if path.endswith("/search"):
+            return "youtube"
+        return "rag"
+
+    def _handle(self):
+        path = self.path.split("?", 1)[0]
+        body = self._body() if self.command in ("POST", "PUT") else b""
+        provider = self._provider(path)
+        server = self.server
+        server.count(provider)
+        time.sleep(server.latency_ms.get(provider, server.latency_ms["default"]) / 1000)
+        if random.random() < server.error_rate:
+            return self._send(500, {"error": {"message": "injected failure"}})
+        n = server.payload_bytes
+
+        if provider in ("groq", "openrouter"):
+            request_json = json.loads(body or b"{}")
+            content = _text(n)
+            if request_json.get("stream"):
+                return self._stream_completion(content)
+            return self._send(200, {
+                "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()),
+                "model": request_json.get("model", "bench"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20},
+            })
+        if provider == "sarvam":
+            return self._send(200, {"request_id": "bench", "audios": [base64.b64encode(_wav(n)).decode("ascii")]})
+        if provider == "soniox":
+            if self.command == "DELETE":
+                return self._send(200, {})
+            if path == "/v1/files" or path == "/v1/transcriptions":
+                return self._send(200, {"id": uuid.uuid4().hex})
+            if path.endswith("/transcript"):
+                return self._send(200, {"tokens": [{"text": word + " "} for word in _text(n).split()]})
+            return self._send(200, {"status": "completed"})
+        if provider == "youtube":
+            items = [{
+                "id": {"videoId": f"vid{i}"},
+                "snippet": {"title": f"Video {i}", "channelTitle": "Bench",
+                            "thumbnails": {"high": {"url": "http://x/h.jpg"}, "medium": {"url": "http://x/m.jpg"}}},
+            } for i in range(10)]
+            return self._send(200, {"items": items})
+        if path.endswith("/upload_doc"):
+            return self._send(200, {"message": "Document processed"})
+        return self._send(200, {"answer": _text(n), "source": "bench.pdf"})
+
+    def _stream_completion(self, content: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for word in content.split(" "):
+            chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": "bench", "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+
+    do_GET = do_POST = do_DELETE = _handle
+
+
+# -------------------- app process --------------------
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_app(args, fake_url: str, workdir: str):
+    port = _free_port()
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+        "SECRET_KEY": "bench",
+        "MONGO_URI": args.mongo_uri,
+        "GROQ_API_KEY": "bench", "GROQ_BASE_URL": fake_url,
+        "OPENROUTER_API_KEY": "bench", "OPENROUTER_API_URL": f"{fake_url}/api/v1/chat/completions",
+        "SARVAM_API_KEY": "bench", "SARVAM_BASE_URL": fake_url,
+        "SONIOX_API_KEY": "bench", "SONIOX_API_BASE_URL": fake_url,
+        "YOUTUBE_API_KEY": "bench", "YOUTUBE_API_ENDPOINT": fake_url,
+        "RAG_API_URL": fake_url,
+        "TRANSCRIBE_POLL_INITIAL": "0.05",
+        "CHAT_ROLLING_SUMMARY": "0",
+        # Every simulated client is the same logged-in user; lift the per-user buckets so
+        # the run measures serving, not 429s (provider limiters stay on)
+        **{f"RATE_LIMIT_{bucket}": "100000/100000" for bucket in ("CHAT", "IMAGE", "OCR", "TTS", "DEFAULT")},
+        # Caches live in the throwaway working directory
+        "TRANSCRIPT_CACHE_DIR": os.path.join(workdir, "cache", "transcripts"),
+        "TTS_PENDING_DIR": os.path.join(workdir, "cache", "tts_requests"),
+        "RAG_ANSWER_CACHE_DIR": os.path.join(workdir, "cache", "rag_answers"),
+        "WEB_CONCURRENCY": str(args.workers),
+        "GUNICORN_BIND": f"127.0.0.1:{port}",
+        "GUNICORN_ACCESS_LOG": "",
+    })
+    if args.worker_class:
+        env["GUNICORN_WORKER_CLASS"] = args.worker_class
+    if args.server == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT, "gunicorn.conf.py"), "app:app"]
+    else:
+        cmd = [sys.executable, "-c",
+               f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True, debug=False)"]
+    log = open(os.path.join(workdir, "app.log"), "wb")
+    proc = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            break
+        try:
+            requests.get(f"{base}/user", timeout=1)
+            return proc, base
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.kill()
+    log.close()
+    with open(os.path.join(workdir, "app.log"), "rb") as f:
+        tail = f.read()[-4000:].decode("utf-8", "replace")
+    sys.exit(f"App did not start:\n{tail}")
+
+
+def _children(pid: int) -> list:
+    kids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            if int(fields[1]) == pid:
+                kids.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return kids
+
+
+def tree_rss(pid: int) -> int:
+    """Resident set size in bytes of pid and all its descendants (Linux /proc)."""
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                match = re.search(r"VmRSS:\s+(\d+) kB", f.read())
+            if match:
+                total += int(match.group(1)) * 1024
+        except OSError:
+            continue
+        stack.extend(_children(current))
+    return total
+
+
+class RSSSampler(threading.Thread):
+    def __init__(self, pid: int, interval: float = 0.1):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.peak = max(self.peak, tree_rss(self.pid))
+            self._stop_event.wait(self.interval)
+
+    def reset(self) -> int:
+        peak, self.peak = self.peak, 0
+        return peak
+
+    def stop(self):
+        self._stop_event.set()
+
+
+# -------------------- load driver --------------------
+
+class Client:
+    """Builds one request per endpoint; inputs are unique unless repeat_inputs is set."""
+
+    def __init__(self, base: str, cookies, args):
+        self.base = base
+        self.cookies = cookies
+        self.args = args
+        self._local = threading.local()
+
+    def session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.cookies.update(self.cookies)
+        return session
+
+    def _token(self) -> str:
+        return "bench" if self.args.repeat_inputs else uuid.uuid4().hex
+
+    def _blob(self, nbytes: int) -> bytes:
+        token = self._token().encode("ascii")
+        return token + bytes(max(0, nbytes - len(token)))
+
+    def call(self, endpoint: str) -> requests.Response:
+        s, base, token = self.session(), self.base, self._token()
+        if endpoint == "chat":
+            return s.post(f"{base}/chat", json={"message": f"hello {token}"})
+        if endpoint == "ocr":
+            files = [("images", (f"img{i}.jpg", io.BytesIO(self._blob(self.args.upload_bytes)), "image/jpeg"))
+                     for i in range(self.args.ocr_images)]
+            return s.post(f"{base}/ocr", files=files)
+        if endpoint == "tts":
+            return s.post(f"{base}/tts", json={"text": f"नमस्ते {token}", "voice": "anushka", "language": "hi-IN"})
+        if endpoint == "transcribe":
+            files = {"file": ("audio.wav", io.BytesIO(self._blob(self.args.upload_bytes)), "audio/wav")}
+            return s.post(f"{base}/transcribe", files=files)
+        if endpoint == "ask_doc":
+            return s.post(f"{base}/ask_doc", json={"question": f"What is {token}?"})
+        if endpoint == "youtube":
+            return s.get(f"{base}/youtube/search", params={"q": f"music {token}"})
+        raise ValueError(endpoint)
+
+
+def _expect_ok(resp: requests.Response, what: str) -> requests.Response:
+    """Setup calls must succeed, or the run would only measure error responses."""
+    if resp.status_code // 100 != 2:
+        sys.exit(f"{what} failed with HTTP {resp.status_code}: {resp.text[:1000]}")
+    return resp
+
+
+def login(base: str) -> requests.cookies.RequestsCookieJar:
+    s = requests.Session()
+    email = f"bench-{uuid.uuid4().hex[:8]}@example.com"
+    _expect_ok(s.post(f"{base}/register", json={"name": "Bench", "email": email, "password": "bench-password"}),
+               "Register")
+    result = _expect_ok(s.post(f"{base}/login", json={"email": email, "password": "bench-password"}), "Login").json()
+    if result.get("status") != "success":
+        sys.exit(f"Login failed: {result}")
+    # Sets the document version in the session, so /ask_doc answers are cacheable
+    _expect_ok(s.post(f"{base}/upload_doc", data=b"benchmark document", headers={
+        "Content-Type": "text/plain", "X-Filename": "bench.txt"}), "Document upload")
+    return s.cookies
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+
+def run_level(client: Client, endpoint: str, concurrency: int, total: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        try:
+            client.call(endpoint)
+        except requests.RequestException:
+            pass
+
+    latencies, errors, statuses = [], 0, {}
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            resp = client.call(endpoint)
+            status = resp.status_code
+            ok = status < 400 and "error" not in (resp.json() if "json" in resp.headers.get("Content-Type", "") else {})
+        except (requests.RequestException, ValueError):
+            status, ok = "exception", False
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "statuses": statuses,
+        "rps": round(total / wall, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+    }
+
+
+def compare(results: list, previous_path: str):
+    with open(previous_path, "r", encoding="utf-8") as f:
+        previous = {(r["endpoint"], r["concurrency"]): r for r in json.load(f)["results"]}
+    print(f"\nvs {previous_path}")
+    print(f"{'endpoint':<12} {'conc':>5} {'p95 Δ%':>8} {'p99 Δ%':>8} {'rps Δ%':>8} {'rss Δ%':>8}")
+
+    def delta(new, old):
+        return f"{(new - old) / old * 100:+.1f}" if old else "n/a"
+
+    for r in results:
+        old = previous.get((r["endpoint"], r["concurrency"]))
+        if old:
+            print(f"{r['endpoint']:<12} {r['concurrency']:>5} {delta(r['p95_ms'], old['p95_ms']):>8} "
+                  f"{delta(r['p99_ms'], old['p99_ms']):>8} {delta(r['rps'], old['rps']):>8} "
+                  f"{delta(r['peak_rss_mb'], old.get('peak_rss_mb', 0)):>8}")
+
+
+def _provider_latency(values: list, default: float) -> dict:
+    latency = {"default": default}
+    for item in values:
+        name, _, ms = item.partition("=")
+        if name not in PROVIDERS:
+            sys.exit(f"Unknown provider {name!r}; choose from {', '.join(PROVIDERS)}")
+        latency[name] = float(ms)
+    return latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=100, help="requests per endpoint and concurrency level")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=300, help="fake provider latency in ms")
+    parser.add_argument("--provider-latency", action="append", default=[], metavar="NAME=MS",
+                        help="per-provider latency override, e.g. groq=800 (repeatable)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of provider calls answered with 500")
+    parser.add_argument("--payload-bytes", type=int, default=2048, help="size of fake provider responses")
+    parser.add_argument("--upload-bytes", type=int, default=256 * 1024, help="size of uploaded images/audio")
+    parser.add_argument("--ocr-images", type=int, default=2, help="images per /ocr request")
+    parser.add_argument("--repeat-inputs", action="store_true", help="send identical inputs (exercises the caches)")
+    parser.add_argument("--server", choices=["gunicorn", "flask"], default="gunicorn")
+    parser.add_argument("--worker-class", help="override GUNICORN_WORKER_CLASS (gevent, gthread)")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers (mongomock needs 1)")
+    parser.add_argument("--mongo-uri", default="mongomock://localhost/bench")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--output", help="results file (default benchmarks/results/load-<timestamp>.json)")
+    parser.add_argument("--compare", help="previous results file to diff against")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+
+    fake = FakeProviders(_provider_latency(args.provider_latency, args.latency), args.error_rate, args.payload_bytes)
+    threading.Thread(target=fake.serve_forever, daemon=True).start()
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    proc, base = start_app(args, fake.url, workdir)
+    sampler = RSSSampler(proc.pid)
+    sampler.start()
+    results = []
+    try:
+        # No injected failures during setup; it isn't part of the measurement
+        fake.error_rate = 0.0
+        cookies = login(base)
+        fake.error_rate = args.error_rate
+        client = Client(base, cookies, args)
+        print(f"{'endpoint':<12} {'conc':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7} {'peak MB':>8}")
+        for endpoint in args.endpoints:
+            for concurrency in args.concurrency:
+                sampler.reset()
+                result = run_level(client, endpoint, concurrency, args.requests, args.warmup)
+                result["peak_rss_mb"] = round(max(sampler.reset(), tree_rss(proc.pid)) / 2 ** 20, 1)
+                results.append(result)
+                print(f"{endpoint:<12} {concurrency:>5} {result['rps']:>8} {result['p50_ms']:>9} {result['p95_ms']:>9} "
+                      f"{result['p99_ms']:>9} {result['errors']:>7} {result['peak_rss_mb']:>8}")
+    finally:
+        sampler.stop()
+        proc.terminate()
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        fake.shutdown()
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    run = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git": subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "keep_workdir")},
+        "provider_calls": fake.calls,
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(run, f, indent=2)
+    print(f"\nSaved {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+    # A level where every request failed measured nothing but the error path
+    broken = sorted({r["endpoint"] for r in results if r["requests"] and r["errors"] == r["requests"]})
+    if broken:
+        sys.exit(f"\nFAILED: every request errored for {', '.join(broken)} (see statuses in {output})")
+
+
+if __name__ == "__main__":
+    main()
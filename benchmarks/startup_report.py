@@ -0,0 +1,76 @@
+"""
+Startup timing report: per-module import cost of app.py, from `python -X importtime`.
+
+    python benchmarks/startup_report.py --top 25
+    python benchmarks/startup_report.py --providers   # also time lazy provider creation
+
+Top-level imports are listed with their cumulative cost (including everything they pull
+in), followed by the heaviest packages overall by self time.
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import subprocess
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_LINE_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def run_importtime(module: str):
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - started
+    if proc.returncode != 0:
+        sys.exit(proc.stderr.strip().splitlines()[-1] if proc.stderr else f"import {module} failed")
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _LINE_RE.match(line)
+        if m:
+            self_us, cumulative_us, indent, name = m.groups()
+            rows.append((name, len(indent) // 2, int(self_us), int(cumulative_us)))
+    return wall, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--providers", action="store_true", help="also time providers.get() for every provider")
+    args = parser.parse_args()
+
+    wall, rows = run_importtime(args.module)
+    baseline, _ = run_importtime("sys")
+    print(f"import {args.module}: {wall - baseline:.3f}s (interpreter start excluded)\n")
+
+    print(f"{'cumulative (ms)':>16}  top-level import")
+    top_level = sorted((r for r in rows if r[1] == 0), key=lambda r: r[3], reverse=True)
+    for name, _, _, cumulative in top_level[:args.top]:
+        print(f"{cumulative / 1000:>16.1f}  {name}")
+
+    by_package = defaultdict(int)
+    for name, _, self_us, _ in rows:
+        by_package[name.split(".")[0]] += self_us
+    print(f"\n{'self (ms)':>16}  package")
+    for package, self_us in sorted(by_package.items(), key=lambda kv: kv[1], reverse=True)[:args.top]:
+        print(f"{self_us / 1000:>16.1f}  {package}")
+
+    if args.providers:
+        sys.path.insert(0, ROOT)
+        import providers
+        print(f"\n{'init (ms)':>16}  provider")
+        for name in providers.names():
+            try:
+                providers.get(name)
+                print(f"{providers.init_times[name] * 1000:>16.1f}  {name}")
+            except Exception as e:
+                print(f"{'failed':>16}  {name}: {e}")
+
+
+if __name__ == "__main__":
+    main()
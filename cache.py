@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Optional
+
+# Per-directory bound for DiskCache; the oldest entries are removed first
+DISK_CACHE_MAX_BYTES = int(os.getenv("DISK_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# How often (seconds) a process sweeps a cache directory for expired and excess entries
+DISK_CACHE_SWEEP_INTERVAL = float(os.getenv("DISK_CACHE_SWEEP_INTERVAL", "300"))
+
+
+def content_key(*parts) -> str:
+    """Build a stable SHA-256 key from bytes/str parts (e.g. file bytes + model + prompt)."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        elif not isinstance(part, (bytes, bytearray, memoryview)):
+            part = json.dumps(part, sort_keys=True, default=str).encode("utf-8")
+        # Length prefix so ("ab", "c") and ("a", "bc") never collide
+        h.update(len(part).to_bytes(8, "big"))
+        h.update(part)
+    return h.hexdigest()
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU with an item limit and optional TTL (seconds)."""
+
+    def __init__(self, max_items: int = 1024, ttl: Optional[float] = None):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / total) if total else 0.0,
+            "size": len(self._data),
+        }
+
+
+class DiskCache:
+    """
+    JSON values stored one file per key under a directory, so entries survive restarts.
+    Writes go through a temp file + os.replace, which keeps concurrent workers safe.
+    Writes also trigger a background sweep (at most every DISK_CACHE_SWEEP_INTERVAL)
+    that deletes expired files and the oldest ones beyond max_bytes.
+    """
+
+    def __init__(self, directory: str, ttl: Optional[float] = None, max_bytes: int = DISK_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._last_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        path = self._path(key)
+        try:
+            if self.ttl and os.path.getmtime(path) + self.ttl < time.time():
+                os.remove(path)
+                return default
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return default
+
+    def set(self, key: str, value: Any):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._maybe_sweep()
+
+    def _maybe_sweep(self):
+        now = time.monotonic()
+        if now - self._last_sweep < DISK_CACHE_SWEEP_INTERVAL or not self._sweep_lock.acquire(blocking=False):
+            return
+        self._last_sweep = now
+        threading.Thread(target=self._sweep_and_unlock, name="cache-sweep", daemon=True).start()
+
+    def _sweep_and_unlock(self):
+        try:
+            self.sweep()
+        except Exception as e:
+            print("Cache sweep failed:", e)
+        finally:
+            self._sweep_lock.release()
+
+    def sweep(self):
+        """Delete expired entries, then the oldest ones until the directory fits max_bytes."""
+        now = time.time()
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                # Leftover temp files of interrupted writes expire after an hour
+                stale_tmp = name.endswith(".tmp") and st.st_mtime + 3600 < now
+                if stale_tmp or (self.ttl and name.endswith(".json") and st.st_mtime + self.ttl < now):
+                    self._remove(path)
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        if self.max_bytes and total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+class TieredCache:
+    """In-memory LRU in front of an optional on-disk tier, with hit/miss counters."""
+
+    def __init__(self, max_items: int = 1024, directory: Optional[str] = None,
+                 ttl: Optional[float] = None, max_bytes: int = DISK_CACHE_MAX_BYTES):
+        self.memory = LRUCache(max_items=max_items, ttl=ttl)
+        self.disk = DiskCache(directory, ttl=ttl, max_bytes=max_bytes) if directory else None
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.set(key, value)
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value)
+            except OSError as e:
+                print("Cache disk write failed:", e)
+
+    def delete(self, key: str):
+        self.memory.delete(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_ratio": (self.hits / total) if total else 0.0,
+            "size": len(self.memory),
+        }
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one execution whose result all callers share."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn, *args, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
@@ -0,0 +1,182 @@
+import os
+import uuid
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import ReturnDocument
+from mongodb import db
+
+conversations = db['conversations']
+
+DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant."
+# Upper bound on the prompt we send upstream, in (estimated) tokens
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "6000"))
+# Most recent messages read per turn; the rest stay in Mongo (folded into the summary)
+CHAT_HISTORY_TAIL = int(os.getenv("CHAT_HISTORY_TAIL", "100"))
+CHAT_SUMMARY_WORKERS = int(os.getenv("CHAT_SUMMARY_WORKERS", "2"))
+
+# Fields build_context reads, returned by append_message alongside the message tail
+_CONTEXT_FIELDS = ("system", "summary", "summarized_upto", "message_count", "first_index")
+
+# Rolling summaries are written in the background, never on the request path
+_summary_executor = ThreadPoolExecutor(max_workers=CHAT_SUMMARY_WORKERS, thread_name_prefix="chat-summary")
+_folding = set()
+_folding_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 chars per token plus per-message overhead); no tokenizer needed."""
+    return len(text or "") // 4 + 4
+
+
+def create_conversation(user_id: str, system_prompt: str = DEFAULT_SYSTEM_PROMPT) -> str:
+    """Create an empty conversation for a user and return its id."""
+    now = datetime.now(timezone.utc)
+    conv_id = uuid.uuid4().hex
+    conversations.insert_one({
+        "_id": conv_id,
+        "user_id": user_id,
+        "system": system_prompt,
+        "messages": [],
+        "message_count": 0,
+        # Position of messages[0]; summarized messages are trimmed from the front
+        "first_index": 0,
+        "summary": "",
+        "summarized_upto": 0,
+        "created_at": now,
+        "updated_at": now,
+    })
+    return conv_id
+
+
+def get_conversation(conv_id: str, user_id: str):
+    """Fetch a conversation owned by user_id, or None."""
+    return conversations.find_one({"_id": conv_id, "user_id": user_id})
+
+
+def append_message(conv_id: str, user_id: str, role: str, content: str):
+    """
+    Append one turn and return the updated conversation with only its last
+    CHAT_HISTORY_TAIL messages (None if it doesn't exist for this user).
+    """
+    conv = _append(conv_id, user_id, role, content)
+    if conv is None and _count_messages(conv_id, user_id):
+        conv = _append(conv_id, user_id, role, content)
+    return conv
+
+
+def _append(conv_id: str, user_id: str, role: str, content: str):
+    return conversations.find_one_and_update(
+        {"_id": conv_id, "user_id": user_id, "message_count": {"$exists": True}},
+        {
+            "$push": {"messages": {"role": role, "content": content}},
+            "$inc": {"message_count": 1},
+            "$set": {"updated_at": datetime.now(timezone.utc)},
+        },
+        # Listed explicitly: a $slice-only projection means "all fields" to MongoDB but
+        # "only messages" to mongomock
+        projection={"messages": {"$slice": -CHAT_HISTORY_TAIL}, **{field: 1 for field in _CONTEXT_FIELDS}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def _count_messages(conv_id: str, user_id: str) -> bool:
+    """One-off for conversations created before message_count existed; False if there is none."""
+    conv = conversations.find_one({"_id": conv_id, "user_id": user_id, "message_count": {"$exists": False}},
+                                  {"messages": 1})
+    if conv is None:
+        return False
+    conversations.update_one({"_id": conv_id, "message_count": {"$exists": False}},
+                             {"$set": {"message_count": len(conv.get("messages", []))}})
+    return True
+
+
+def _fit(tail: list, offset: int, start: int, budget: int) -> int:
+    """Index (in the whole conversation) of the oldest tail message that fits budget; never before start."""
+    used = 0
+    i = len(tail)
+    while i > 0 and offset + i > start:
+        cost = estimate_tokens(tail[i - 1]["content"])
+        # Always keep the newest turn, even if it alone exceeds the budget
+        if i < len(tail) and used + cost > budget:
+            break
+        used += cost
+        i -= 1
+    return offset + i
+
+
+def build_context(conv: dict, budget: int = CHAT_CONTEXT_TOKENS, summarize=None) -> list:
+    """
+    Build the upstream message list for a conversation under a token budget.
+    Keeps the system prompt, the rolling summary and as many recent turns as fit.
+    Turns that fall out of the window are folded into the summary in the background
+    when a `summarize(summary, turns) -> str` callable is given (until then they are
+    left out). A fold takes everything older than half the budget, so it runs again
+    only after that much new conversation, not on every turn.
+    """
+    system = conv.get("system") or DEFAULT_SYSTEM_PROMPT
+    summary = conv.get("summary") or ""
+    tail = conv.get("messages", [])
+    # conv holds only the last messages (see append_message); offset is tail[0]'s position
+    offset = conv.get("message_count", len(tail)) - len(tail)
+    start = conv.get("summarized_upto", 0)
+
+    available = budget - estimate_tokens(system) - (estimate_tokens(summary) if summary else 0)
+    kept_from = _fit(tail, offset, start, available)
+    if kept_from > start and summarize is not None:
+        _fold_later(conv["_id"], start, _fit(tail, offset, start, available // 2), summarize)
+
+    messages = [{"role": "system", "content": system}]
+    if summary:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+    messages.extend({"role": m["role"], "content": m["content"]} for m in tail[kept_from - offset:])
+    return messages
+
+
+def _trim(conv_id: str, upto: int):
+    """
+    Drop messages before `upto` so the document stays far below Mongo's 16 MB limit.
+    Conditional on message_count; if a turn was appended meanwhile, the next fold trims.
+    """
+    conv = conversations.find_one({"_id": conv_id}, {"message_count": 1, "first_index": 1})
+    if conv is None or "message_count" not in conv:
+        return
+    count = conv["message_count"]
+    first = conv["first_index"] if "first_index" in conv else {"$exists": False}
+    conversations.update_one(
+        {"_id": conv_id, "message_count": count, "first_index": first},
+        {"$push": {"messages": {"$each": [], "$slice": -(count - upto)}}, "$set": {"first_index": upto}},
+    )
+
+
+def _fold_later(conv_id: str, start: int, end: int, summarize):
+    with _folding_lock:
+        if conv_id in _folding:
+            return
+        _folding.add(conv_id)
+    _summary_executor.submit(_fold, conv_id, start, end, summarize)
+
+
+def _fold(conv_id: str, start: int, end: int, summarize):
+    """Fold messages [start, end) into the summary, then drop them from the document."""
+    try:
+        first = (conversations.find_one({"_id": conv_id}, {"first_index": 1}) or {}).get("first_index", 0)
+        conv = conversations.find_one(
+            {"_id": conv_id, "summarized_upto": start},
+            {"summary": 1, "messages": {"$slice": [start - first, end - start]}},
+        )
+        if conv is None:
+            return
+        summary = summarize(conv.get("summary") or "", conv["messages"])
+        # Conditional on the summary we read, so a concurrent fold can't be rolled back
+        result = conversations.update_one(
+            {"_id": conv_id, "summarized_upto": start},
+            {"$set": {"summary": summary, "summarized_upto": end}},
+        )
+        if result.modified_count:
+            _trim(conv_id, end)
+    except Exception as e:
+        print(f"Conversation summary for {conv_id} failed: {str(e)}")
+    finally:
+        with _folding_lock:
+            _folding.discard(conv_id)
@@ -0,0 +1,24 @@
+# Under gevent workers every greenlet shares one OS thread, so CPU-heavy work (image
+# decode/resize, PDF rendering, numpy) would stall all other requests of the worker.
+# run_cpu() moves such calls onto gevent's pool of native threads; the libraries
+# involved release the GIL while they compute. Under gthread it is a plain call.
+
+
+def gevent_threadpool():
+    """gevent's pool of real OS threads when running under a gevent worker, else None."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return None
+    if not monkey.is_module_patched("threading"):
+        return None
+    import gevent
+    return gevent.get_hub().threadpool
+
+
+def run_cpu(fn, *args, **kwargs):
+    """Call fn off the event loop under gevent (blocking only the calling greenlet)."""
+    threadpool = gevent_threadpool()
+    if threadpool is None:
+        return fn(*args, **kwargs)
+    return threadpool.apply(fn, args, kwargs)
@@ -0,0 +1,64 @@
+# gunicorn.conf.py — picked up automatically by `gunicorn app:app` from this directory.
+#
+# Nearly all request time is spent waiting on upstream AI providers, so the default is
+# the gevent worker: it patches sockets, so every blocking call made by requests, httpx
+# (Groq SDK), pymongo and httplib2 yields to the worker's event loop, and one process
+# holds hundreds of in-flight requests instead of one per thread. Per-provider
+# semaphores (OCR, TTS, image, transcription workers) still cap upstream concurrency.
+# CPU-heavy steps (image preprocessing, PDF rendering, local RAG indexing and search,
+# password hashing) are moved off the event loop onto gevent's native threadpool
+# (cpu.run_cpu); set GUNICORN_WORKER_CLASS=gthread to use plain threads instead.
+import os
+import shutil
+import tempfile
+import multiprocessing
+
+
+def _has_gevent():
+    try:
+        import gevent  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '5000')}")
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent" if _has_gevent() else "gthread")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+
+# gevent: concurrent connections per worker; gthread: OS threads per worker
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+
+# Long synchronous routes (/transcribe, long TTS) may legitimately run for minutes
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "180"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+# Recycle workers now and then so slow leaks in provider SDKs can't accumulate
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "5000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "500"))
+
+# gevent must patch before the app (and its SDKs) are imported, so no preloading there
+preload_app = worker_class != "gevent" and os.getenv("GUNICORN_PRELOAD", "0") == "1"
+# An empty GUNICORN_ACCESS_LOG turns the access log off
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-") or None
+
+# Workers share their metrics through this directory so any worker's /metrics shows
+# deployment-wide totals (see metrics.py). Without METRICS_DIR a temporary one is made per
+# server start and removed on exit; the marker lives in the environment so a config
+# reload (SIGHUP) neither makes another directory nor forgets to remove this one.
+if not os.environ.get("METRICS_DIR"):
+    os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="app_metrics_")
+    os.environ["METRICS_DIR_TEMPORARY"] = "1"
+
+
+def on_exit(server):
+    if os.environ.get("METRICS_DIR_TEMPORARY") == "1":
+        shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
+
+
+if worker_class == "gevent":
+    # Hundreds of concurrent requests per worker need matching connection pools
+    # (read by upstream.py and mongodb.py at import, in each worker)
+    os.environ.setdefault("UPSTREAM_POOL_SIZE", str(min(worker_connections, 200)))
+    os.environ.setdefault("MONGO_MAX_POOL_SIZE", str(min(worker_connections, 200)))
@@ -0,0 +1,127 @@
+import os
+import time
+import uuid
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from cache import SingleFlight
+from mongodb import db
+import providers
+import metrics
+import limits
+
+image_jobs = db['image_jobs']
+
+IMAGE_MODEL = "flux"
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "4"))
+# A job not finished by its deadline is reported as failed, also when the worker that
+# owned it restarted or crashed (status polls expire it)
+IMAGE_JOB_DEADLINE = int(os.getenv("IMAGE_JOB_DEADLINE", "300"))
+# Jobs waiting for a worker in this process; beyond that submissions are refused
+IMAGE_QUEUE_MAX = int(os.getenv("IMAGE_QUEUE_MAX", str(IMAGE_WORKERS * 16)))
+
+ACTIVE_STATES = ("queued", "running")
+
+_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+_inflight = SingleFlight()
+_queued = 0
+_queued_lock = threading.Lock()
+
+
+class ImageQueueFull(Exception):
+    """Too many image jobs are waiting in this process."""
+
+
+def _generate(prompt: str) -> str:
+    with limits.slot("image"), metrics.upstream("image"):
+        response = providers.get("image").images.generate(
+            model=IMAGE_MODEL,
+            prompt=prompt,
+            response_format="url"
+        )
+    return response.data[0].url
+
+
+def generate_image(prompt: str) -> str:
+    """Generate an image and return its URL; identical prompts already in flight share one call."""
+    key = " ".join(prompt.split())
+    return _inflight.do(key, _generate, key)
+
+
+def submit_image_job(user_id: str, prompt: str) -> str:
+    """Queue a generation in the background and return the job id (ImageQueueFull when saturated)."""
+    global _queued
+    with _queued_lock:
+        if _queued >= IMAGE_QUEUE_MAX:
+            raise ImageQueueFull("Too many image jobs queued, please retry shortly.")
+        _queued += 1
+    job_id = uuid.uuid4().hex
+    try:
+        _insert_job(job_id, user_id, prompt)
+        _executor.submit(_run_job, job_id, prompt)
+    except Exception:
+        _release_queue_slot()
+        raise
+    return job_id
+
+
+def _release_queue_slot():
+    global _queued
+    with _queued_lock:
+        _queued -= 1
+
+
+def _insert_job(job_id: str, user_id: str, prompt: str):
+    image_jobs.insert_one({
+        "_id": job_id,
+        "user_id": user_id,
+        "prompt": prompt,
+        "status": "queued",
+        "image_url": None,
+        "error": None,
+        "deadline": time.time() + IMAGE_JOB_DEADLINE,
+        "created_at": datetime.now(timezone.utc),
+    })
+
+
+def get_image_job(job_id: str, user_id: str):
+    """Return a user's job; an active job past its deadline is marked as timed out first."""
+    job = image_jobs.find_one({"_id": job_id, "user_id": user_id}, {"prompt": 0})
+    if job and job["status"] in ACTIVE_STATES and _deadline(job) < time.time():
+        _expire(job_id)
+        job = image_jobs.find_one({"_id": job_id, "user_id": user_id}, {"prompt": 0})
+    return job
+
+
+def _deadline(job: dict) -> float:
+    if "deadline" in job:
+        return job["deadline"]
+    # Jobs queued before deadlines were recorded (Mongo returns naive UTC datetimes)
+    return job["created_at"].replace(tzinfo=timezone.utc).timestamp() + IMAGE_JOB_DEADLINE
+
+
+def _expire(job_id: str):
+    image_jobs.update_one(
+        {"_id": job_id, "status": {"$in": ACTIVE_STATES}},
+        {"$set": {"status": "error", "error": "Image generation timed out."}},
+    )
+
+
+def _run_job(job_id: str, prompt: str):
+    _release_queue_slot()
+    # Conditional: a job that expired while queued is not started
+    started = image_jobs.update_one(
+        {"_id": job_id, "status": "queued", "deadline": {"$gt": time.time()}},
+        {"$set": {"status": "running"}},
+    )
+    if not started.modified_count:
+        _expire(job_id)
+        return
+    try:
+        image_url = generate_image(prompt)
+        image_jobs.update_one({"_id": job_id, "status": "running"},
+                              {"$set": {"status": "completed", "image_url": image_url}})
+    except Exception as e:
+        print(f"Image job {job_id} failed: {str(e)}")
+        image_jobs.update_one({"_id": job_id, "status": "running"},
+                              {"$set": {"status": "error", "error": str(e)}})
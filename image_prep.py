@@ -0,0 +1,96 @@
+import io
+import os
+from typing import List, Optional, Tuple
+
+# Images are scaled so their width fits OCR_MAX_WIDTH, then cut into overlapping
+# horizontal bands of OCR_TILE_HEIGHT so tall scans and receipts keep readable text.
+OCR_MAX_WIDTH = int(os.getenv("OCR_MAX_WIDTH", "2048"))
+OCR_TILE_HEIGHT = int(os.getenv("OCR_TILE_HEIGHT", "2048"))
+OCR_TILE_OVERLAP = int(os.getenv("OCR_TILE_OVERLAP", "96"))
+OCR_MAX_TILES = int(os.getenv("OCR_MAX_TILES", "6"))
+OCR_JPEG_QUALITY = int(os.getenv("OCR_JPEG_QUALITY", "85"))
+OCR_GRAYSCALE = os.getenv("OCR_GRAYSCALE", "0") == "1"
+
+# Part of the OCR cache key, so changing these settings doesn't serve stale text
+PREP_SETTINGS = (OCR_MAX_WIDTH, OCR_TILE_HEIGHT, OCR_TILE_OVERLAP, OCR_MAX_TILES, OCR_JPEG_QUALITY, OCR_GRAYSCALE)
+
+# Formats vision models accept as-is when no resizing is needed
+_PASSTHROUGH = {"image/jpeg", "image/png", "image/webp"}
+
+
+def detect_mime(data: bytes) -> Optional[str]:
+    """Image MIME type from magic bytes (the upload's filename and Content-Type are not trusted)."""
+    head = data[:16]
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[:2] == b"BM":
+        return "image/bmp"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "image/tiff"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"mif1", b"msf1", b"avif"):
+        return "image/heic" if head[8:12] != b"avif" else "image/avif"
+    return None
+
+
+def _encode(img) -> bytes:
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=OCR_JPEG_QUALITY, optimize=True)
+    return out.getvalue()
+
+
+def prepare_image(data: bytes) -> List[Tuple[str, bytes]]:
+    """
+    Turn an upload into one or more (mime, bytes) images ready for the vision model:
+    orientation fixed, scaled to OCR_MAX_WIDTH, re-encoded as JPEG, tall images tiled.
+    Small JPEG/PNG/WebP files pass through untouched. Without Pillow the original bytes
+    are sent with their detected type.
+    """
+    mime = detect_mime(data) or "image/jpeg"
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return [(mime, data)]
+
+    try:
+        img = Image.open(io.BytesIO(data))
+        orientation = img.getexif().get(0x0112, 1)
+    except Exception:
+        # Not something Pillow can read (e.g. HEIC without a plugin): let the model try
+        return [(mime, data)]
+    raw_width, raw_height = img.size
+    rotated = orientation in (5, 6, 7, 8)
+    width, height = (raw_height, raw_width) if rotated else (raw_width, raw_height)
+    if (mime in _PASSTHROUGH and orientation == 1 and width <= OCR_MAX_WIDTH
+            and height <= OCR_TILE_HEIGHT and len(data) <= 1024 * 1024):
+        return [(mime, data)]
+
+    # Pick the final scale first: the width limit, shrunk further if the bands would exceed OCR_MAX_TILES
+    step = OCR_TILE_HEIGHT - OCR_TILE_OVERLAP
+    max_height = OCR_TILE_HEIGHT + step * (OCR_MAX_TILES - 1)
+    scale = min(1.0, OCR_MAX_WIDTH / width, max_height / height)
+    target = (max(1, round(width * scale)), max(1, round(height * scale)))
+
+    mode = "L" if OCR_GRAYSCALE else "RGB"
+    # JPEG can decode straight at a reduced size (DCT scaling), far cheaper than full decode + resize
+    img.draft(mode, (target[1], target[0]) if rotated else target)
+    img = ImageOps.exif_transpose(img).convert(mode)
+    if img.size != target:
+        img = img.resize(target, Image.LANCZOS, reducing_gap=2.0)
+
+    width, height = img.size
+    if height <= OCR_TILE_HEIGHT:
+        return [("image/jpeg", _encode(img))]
+    tiles = []
+    top = 0
+    while True:
+        bottom = min(top + OCR_TILE_HEIGHT, height)
+        tiles.append(("image/jpeg", _encode(img.crop((0, top, width, bottom)))))
+        if bottom >= height:
+            return tiles
+        top += step
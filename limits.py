@@ -0,0 +1,258 @@
+import os
+import time
+import math
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Iterable, Optional, Tuple
+from cache import LRUCache
+import metrics
+
+# Per-user token buckets: "<rate per second>/<burst>". Buckets live in each worker, so
+# with several gunicorn workers a user can get up to WEB_CONCURRENCY times these rates.
+RATE_LIMITS = {
+    "chat": os.getenv("RATE_LIMIT_CHAT", "1/10"),
+    "image": os.getenv("RATE_LIMIT_IMAGE", "0.2/3"),
+    "ocr": os.getenv("RATE_LIMIT_OCR", "0.5/5"),
+    "tts": os.getenv("RATE_LIMIT_TTS", "1/10"),
+    "default": os.getenv("RATE_LIMIT_DEFAULT", "10/50"),
+}
+
+# Adaptive per-provider concurrency (AIMD between min and max) and circuit breaker
+PROVIDER_LIMIT_INITIAL = int(os.getenv("PROVIDER_LIMIT_INITIAL", "16"))
+PROVIDER_LIMIT_MIN = int(os.getenv("PROVIDER_LIMIT_MIN", "2"))
+PROVIDER_LIMIT_MAX = int(os.getenv("PROVIDER_LIMIT_MAX", "256"))
+# Calls slower than this count as congestion and shrink the limit
+PROVIDER_LATENCY_TARGET = float(os.getenv("PROVIDER_LATENCY_TARGET", "20"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+# How long queued or fanned-out work (OCR pages, image jobs) waits for a provider slot
+PROVIDER_SLOT_WAIT = float(os.getenv("PROVIDER_SLOT_WAIT", "30"))
+
+_buckets = LRUCache(max_items=100_000)
+_buckets_lock = threading.Lock()
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> float:
+        """Take one token; returns 0 on success, else seconds until one is available."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+
+def _parse_limit(spec: str) -> Tuple[float, float]:
+    rate, _, burst = spec.partition("/")
+    return float(rate), float(burst or rate)
+
+
+def check_rate(user_id: str, bucket: str = "default") -> float:
+    """Charge one request to the user's bucket; returns 0 if allowed, else Retry-After seconds."""
+    key = f"{user_id}:{bucket}"
+    limiter = _buckets.get(key)
+    if limiter is None:
+        with _buckets_lock:
+            limiter = _buckets.get(key)
+            if limiter is None:
+                limiter = TokenBucket(*_parse_limit(RATE_LIMITS.get(bucket, RATE_LIMITS["default"])))
+                _buckets.set(key, limiter)
+    return limiter.take()
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit for one provider that adapts to how the provider behaves:
+    +1/limit per fast success, x0.7 on a failure or a slow call (AIMD). After
+    BREAKER_FAILURES consecutive failures the circuit opens and every request is shed
+    for BREAKER_COOLDOWN seconds; then one probe request is let through (half-open).
+
+    Acquiring returns (retry_after, probe): probe is a token when the slot is the
+    half-open probe, and must be passed back to release().
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.limit = float(PROVIDER_LIMIT_INITIAL)
+        self.in_flight = 0
+        self.failures = 0
+        self.opened_at = None
+        # Token of the request currently probing a half-open circuit
+        self.probe = None
+        self._probe_tokens = itertools.count(1)
+        # A condition, so slot() callers can wait for a release
+        self._lock = threading.Condition()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= BREAKER_COOLDOWN else "open"
+
+    def check(self) -> float:
+        """Retry-After seconds if a request would be shed right now, else 0 (takes nothing)."""
+        with self._lock:
+            if self.opened_at is not None:
+                remaining = self.opened_at + BREAKER_COOLDOWN - time.monotonic()
+                if remaining > 0:
+                    return remaining
+                return 1.0 if self.probe is not None else 0.0
+            return 1.0 if self.in_flight >= int(self.limit) else 0.0
+
+    def try_acquire(self) -> Tuple[float, Optional[int]]:
+        """Take a slot; returns (0, probe) on success, else (Retry-After seconds, None)."""
+        with self._lock:
+            return self._try_acquire()
+
+    def acquire(self, timeout: float) -> Tuple[float, Optional[int]]:
+        """Wait up to timeout for a slot; same result as try_acquire()."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                retry_after, probe = self._try_acquire()
+                remaining = deadline - time.monotonic()
+                if not retry_after or remaining <= 0:
+                    return retry_after, probe
+                self._lock.wait(min(remaining, retry_after))
+
+    def _try_acquire(self) -> Tuple[float, Optional[int]]:
+        """Caller holds the lock."""
+        probe = None
+        if self.opened_at is not None:
+            remaining = self.opened_at + BREAKER_COOLDOWN - time.monotonic()
+            if remaining > 0:
+                return remaining, None
+            if self.probe is not None:
+                return 1.0, None
+            probe = self.probe = next(self._probe_tokens)
+        elif self.in_flight >= int(self.limit):
+            return 1.0, None
+        self.in_flight += 1
+        return 0.0, probe
+
+    def release(self, probe: Optional[int] = None):
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            # A probe that never reached the provider (e.g. a cache hit) frees the probe
+            # slot; releases of other requests leave it alone
+            if probe is not None and self.probe == probe:
+                self.probe = None
+            self._lock.notify()
+
+    def on_result(self, ok: bool, seconds: float):
+        with self._lock:
+            if ok:
+                self.failures = 0
+                if self.opened_at is not None:
+                    self.opened_at = None
+                    self.probe = None
+                if seconds <= PROVIDER_LATENCY_TARGET:
+                    self.limit = min(PROVIDER_LIMIT_MAX, self.limit + 1 / self.limit)
+                    self._lock.notify()
+                else:
+                    self.limit = max(PROVIDER_LIMIT_MIN, self.limit * 0.7)
+                return
+            self.failures += 1
+            self.limit = max(PROVIDER_LIMIT_MIN, self.limit * 0.7)
+            if self.opened_at is not None or self.failures >= BREAKER_FAILURES:
+                # Open (or re-open after a failed probe)
+                self.opened_at = time.monotonic()
+                self.probe = None
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter(provider: str) -> AdaptiveLimiter:
+    instance = _limiters.get(provider)
+    if instance is None:
+        with _limiters_lock:
+            instance = _limiters.setdefault(provider, AdaptiveLimiter(provider))
+    return instance
+
+
+def acquire(providers: Iterable[str]) -> Tuple[list, Optional[float]]:
+    """Take a slot from each provider's limiter; on rejection returns ([], retry_after)."""
+    held = []
+    for provider in providers:
+        instance = limiter(provider)
+        retry_after, probe = instance.try_acquire()
+        if retry_after:
+            release(held)
+            return [], retry_after
+        held.append((instance, probe))
+    return held, None
+
+
+def release(held: list):
+    for instance, probe in held:
+        instance.release(probe)
+
+
+def check(providers: Iterable[str]) -> Optional[float]:
+    """Admission check for routes that queue or fan out work: Retry-After if any provider would shed."""
+    for provider in providers:
+        retry_after = limiter(provider).check()
+        if retry_after:
+            return retry_after
+    return None
+
+
+class ProviderBusy(Exception):
+    """No provider slot became free within the wait (or the circuit is open)."""
+
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(f"{provider} is busy, retry in {retry_after_header(retry_after)}s")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+@contextmanager
+def slot(provider: str, timeout: float = PROVIDER_SLOT_WAIT):
+    """Hold one of the provider's slots around a call, waiting up to timeout for one."""
+    instance = limiter(provider)
+    retry_after, probe = instance.acquire(timeout)
+    if retry_after:
+        raise ProviderBusy(provider, retry_after)
+    try:
+        yield
+    finally:
+        instance.release(probe)
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
+
+
+def _observe(provider: str, seconds: float, ok: bool):
+    limiter(provider).on_result(ok, seconds)
+
+
+def _render_limiters() -> list:
+    lines = ["# HELP provider_concurrency_limit Adaptive concurrency limit per provider.",
+             "# TYPE provider_concurrency_limit gauge"]
+    states = {"closed": 0, "half_open": 1, "open": 2}
+    items = list(_limiters.items())
+    lines += [f'provider_concurrency_limit{{provider="{name}"}} {int(lim.limit)}' for name, lim in items]
+    lines += ["# HELP provider_circuit_state 0 closed, 1 half-open, 2 open.", "# TYPE provider_circuit_state gauge"]
+    lines += [f'provider_circuit_state{{provider="{name}"}} {states[lim.state]}' for name, lim in items]
+    return lines
+
+
+# Every upstream outcome recorded in metrics also feeds the provider's limiter
+metrics.add_upstream_listener(_observe)
+metrics.add_collector(_render_limiters)
@@ -0,0 +1,246 @@
+import io
+import os
+import re
+import json
+import time
+import shutil
+import zlib
+import tempfile
+from typing import List, Optional
+import numpy as np
+from cache import LRUCache
+import providers
+import metrics
+from cpu import run_cpu
+
+# In-process retrieval backend for /upload_doc and /ask_doc (RAG_BACKEND=local).
+# Documents are chunked and embedded as signed hashed TF-IDF vectors. A chunk has a few
+# hundred non-zero features out of RAG_DIM, so each document's matrix is built and stored
+# sparse (row, column, value arrays) and memory-mapped for top-k search.
+RAG_INDEX_DIR = os.getenv("RAG_INDEX_DIR", os.path.join("cache", "rag_index"))
+RAG_DIM = int(os.getenv("RAG_DIM", "4096"))
+RAG_CHUNK_CHARS = int(os.getenv("RAG_CHUNK_CHARS", "800"))
+RAG_CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "150"))
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "4"))
+# Indexed documents kept per user, least recently used dropped first
+RAG_MAX_DOCS = int(os.getenv("RAG_MAX_DOCS", "5"))
+RAG_LOCAL_MODEL = os.getenv("RAG_LOCAL_MODEL", "llama-3.3-70b-versatile")
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_PARAGRAPH_RE = re.compile(r'\n\s*\n')
+# Open memmaps, so repeated questions don't re-open the index files
+_indexes = LRUCache(max_items=64)
+
+
+class LocalRAGError(Exception):
+    """Raised when a document can't be read or indexed."""
+
+
+def extract_text(data: bytes, filename: str, content_type: Optional[str] = None) -> str:
+    """Plain text of a PDF, DOCX or text document."""
+    name = filename.lower()
+    if name.endswith(".pdf") or content_type == "application/pdf":
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            raise LocalRAGError("PDF support needs the pypdf package")
+        reader = PdfReader(io.BytesIO(data))
+        return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+    if name.endswith(".docx") or (content_type or "").startswith("application/vnd.openxmlformats"):
+        try:
+            import docx
+        except ImportError:
+            raise LocalRAGError("DOCX support needs the python-docx package")
+        return "\n\n".join(p.text for p in docx.Document(io.BytesIO(data)).paragraphs)
+    if name.endswith(".doc") or content_type == "application/msword":
+        raise LocalRAGError("Legacy .doc files are not supported; please upload a .docx or PDF")
+    return data.decode("utf-8", errors="replace")
+
+
+def chunk_text(text: str, max_chars: int = RAG_CHUNK_CHARS, overlap: int = RAG_CHUNK_OVERLAP) -> List[str]:
+    """Pack paragraphs into chunks of about max_chars; long paragraphs are windowed with overlap."""
+    chunks = []
+    current = ""
+    for para in _PARAGRAPH_RE.split(text):
+        para = " ".join(para.split())
+        if not para:
+            continue
+        if current and len(current) + 1 + len(para) > max_chars:
+            chunks.append(current)
+            current = ""
+        while len(para) > max_chars:
+            cut = para.rfind(" ", 0, max_chars)
+            if cut <= overlap:
+                cut = max_chars
+            chunks.append(para[:cut])
+            para = para[max(cut - overlap, 1):].lstrip()
+        current = f"{current} {para}" if current else para
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _features(text: str):
+    """Hashed unigram + bigram features: (bucket indices, signs)."""
+    tokens = _TOKEN_RE.findall(text.lower())
+    terms = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    hashes = np.fromiter((zlib.crc32(t.encode("utf-8")) for t in terms), dtype=np.uint32, count=len(terms))
+    # Low bits pick the bucket, the top bit the sign, so collisions tend to cancel out
+    return (hashes % RAG_DIM).astype(np.int64), np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+
+
+def _term_counts(text: str):
+    """Non-zero hashed feature counts of one text: (sorted bucket indices, float32 counts)."""
+    buckets, signs = _features(text)
+    columns, inverse = np.unique(buckets, return_inverse=True)
+    counts = np.bincount(inverse, weights=signs, minlength=len(columns)).astype(np.float32)
+    nonzero = counts != 0
+    return columns[nonzero], counts[nonzero]
+
+
+def _weigh(columns: np.ndarray, counts: np.ndarray, idf: np.ndarray) -> np.ndarray:
+    """Sublinear TF times IDF for one row, L2-normalized (in place) so a dot product is cosine similarity."""
+    weights = np.log1p(np.abs(counts))
+    weights *= np.sign(counts)
+    weights *= idf[columns]
+    norm = np.linalg.norm(weights)
+    if norm:
+        weights /= norm
+    return weights
+
+
+def _query_vector(question: str, idf: np.ndarray) -> np.ndarray:
+    columns, counts = _term_counts(question)
+    query = np.zeros(len(idf), dtype=np.float32)
+    query[columns] = _weigh(columns, counts, idf)
+    return query
+
+
+def _user_dir(user_id: str) -> str:
+    return os.path.join(RAG_INDEX_DIR, re.sub(r'[^A-Za-z0-9_-]', '_', str(user_id)))
+
+
+def build_index(user_id: str, doc_version: str, data: bytes, filename: str,
+                content_type: Optional[str] = None) -> dict:
+    """Chunk, embed and store a document for user_id; returns the index metadata."""
+    directory = os.path.join(_user_dir(user_id), doc_version)
+    meta_path = os.path.join(directory, "meta.json")
+    if os.path.exists(meta_path):
+        os.utime(directory)
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    chunks = chunk_text(extract_text(data, filename, content_type))
+    if not chunks:
+        raise LocalRAGError("No text found in document")
+    rows = [_term_counts(chunk) for chunk in chunks]
+    df = np.zeros(RAG_DIM, dtype=np.int64)
+    for columns, _ in rows:
+        df[columns] += 1
+    idf = (np.log((1 + len(chunks)) / (1 + df)) + 1).astype(np.float32)
+    row_ids = np.repeat(np.arange(len(rows), dtype=np.int32), [len(columns) for columns, _ in rows])
+    column_ids = np.concatenate([columns for columns, _ in rows]).astype(np.int32)
+    values = np.concatenate([_weigh(columns, counts, idf) for columns, counts in rows])
+    del rows
+
+    meta = {"filename": filename, "chunks": len(chunks), "dim": RAG_DIM, "nnz": len(values),
+            "format": "coo", "created": time.time()}
+    os.makedirs(_user_dir(user_id), exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=_user_dir(user_id), prefix=".tmp_")
+    try:
+        row_ids.tofile(os.path.join(tmp, "rows.i32"))
+        column_ids.tofile(os.path.join(tmp, "columns.i32"))
+        values.tofile(os.path.join(tmp, "values.f32"))
+        np.save(os.path.join(tmp, "idf.npy"), idf)
+        with open(os.path.join(tmp, "chunks.json"), "w", encoding="utf-8") as f:
+            json.dump(chunks, f, ensure_ascii=False)
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, directory)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        # Another worker indexed the same document first
+        if not os.path.exists(meta_path):
+            raise
+    _prune(user_id)
+    return meta
+
+
+def _prune(user_id: str):
+    """Keep the RAG_MAX_DOCS most recently used indexes of a user."""
+    base = _user_dir(user_id)
+    entries = []
+    with os.scandir(base) as it:
+        for entry in it:
+            if entry.is_dir() and not entry.name.startswith("."):
+                entries.append((entry.stat().st_mtime, entry.path))
+    entries.sort(reverse=True)
+    for _, path in entries[RAG_MAX_DOCS:]:
+        _indexes.delete(path)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _load(user_id: str, doc_version: str):
+    directory = os.path.join(_user_dir(user_id), doc_version)
+    index = _indexes.get(directory)
+    if index is None:
+        try:
+            with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(os.path.join(directory, "chunks.json"), "r", encoding="utf-8") as f:
+                chunks = json.load(f)
+            if meta.get("format") != "coo":
+                # Dense index from an older version: the document has to be uploaded again
+                return None
+            idf = np.load(os.path.join(directory, "idf.npy"))
+            vectors = tuple(
+                np.memmap(os.path.join(directory, name), dtype=dtype, mode="r", shape=(meta["nnz"],))
+                if meta["nnz"] else np.zeros(0, dtype=dtype)
+                for name, dtype in (("rows.i32", np.int32), ("columns.i32", np.int32), ("values.f32", np.float32))
+            )
+        except (OSError, ValueError, KeyError):
+            return None
+        index = (meta, chunks, idf, vectors)
+        _indexes.set(directory, index)
+    return index
+
+
+def search(user_id: str, doc_version: str, question: str, k: int = RAG_TOP_K):
+    """Top-k (score, chunk index, text) for question, best first; None if the index is gone."""
+    index = _load(user_id, doc_version)
+    if index is None:
+        return None
+    meta, chunks, idf, (row_ids, column_ids, values) = index
+    query = _query_vector(question, idf)
+    # Sparse matrix-vector product: each stored value times the query weight of its column, summed per row
+    scores = np.bincount(row_ids, weights=values * query[column_ids], minlength=meta["chunks"])
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(float(scores[i]), int(i), chunks[i]) for i in top if scores[i] > 0]
+
+
+def ask(user_id: str, doc_version: str, question: str) -> dict:
+    """Answer from the top-k chunks with Groq: {"answer", "source"}."""
+    hits = run_cpu(search, user_id, doc_version, question)
+    if hits is None:
+        return {"answer": "Please upload your document again.", "source": None}
+    if not hits:
+        return {"answer": "The document doesn't seem to cover that.", "source": None}
+
+    meta = _load(user_id, doc_version)[0]
+    context = "\n\n".join(f"[{i + 1}] {text}" for _, i, text in hits)
+    with metrics.upstream("groq"):
+        completion = providers.get("groq").chat.completions.create(
+            model=RAG_LOCAL_MODEL,
+            messages=[
+                {"role": "system", "content": "Answer using only the numbered document excerpts. "
+                                              "If they don't contain the answer, say so. Cite excerpts like [2]."},
+                {"role": "user", "content": f"Excerpts:\n{context}\n\nQuestion: {question}"},
+            ],
+            temperature=0.2,
+            max_completion_tokens=512,
+        )
+    answer = completion.choices[0].message.content.strip()
+    chunk_ids = ", ".join(str(i + 1) for _, i, _ in sorted(hits, key=lambda hit: hit[1]))
+    return {"answer": answer, "source": f"{meta['filename']} (excerpts {chunk_ids})"}
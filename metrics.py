@@ -0,0 +1,513 @@
+import os
+import json
+import time
+import bisect
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# Recent samples kept per timer for percentiles; counts and totals cover all time
+METRICS_WINDOW = 2048
+# Directory shared by all gunicorn workers (set by gunicorn.conf.py): each worker writes its
+# series there every METRICS_FLUSH_INTERVAL seconds and a scrape of any worker sums them all.
+# Unset (single process), /metrics shows this process only.
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+# Histogram buckets (seconds) wide enough for both fast routes and minute-long AI calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class LatencyStats:
+    """Thread-safe latency recorder: all-time count/total/max plus percentiles over a recent window."""
+
+    def __init__(self, window: int = METRICS_WINDOW):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+            self._recent.append(seconds)
+
+    def summary(self) -> dict:
+        with self._lock:
+            recent = sorted(self._recent)
+            count, total, peak = self.count, self.total, self.max
+
+        def pct(p):
+            if not recent:
+                return 0.0
+            return recent[min(len(recent) - 1, int(p * len(recent)))]
+
+        return {
+            "count": count,
+            "avg_ms": round(total / count * 1000, 2) if count else 0.0,
+            "p50_ms": round(pct(0.50) * 1000, 2),
+            "p95_ms": round(pct(0.95) * 1000, 2),
+            "p99_ms": round(pct(0.99) * 1000, 2),
+            "max_ms": round(peak * 1000, 2),
+        }
+
+
+_timers = {}
+_timers_lock = threading.Lock()
+
+
+def latency(name: str) -> LatencyStats:
+    """Return the process-wide recorder for name, creating it on first use."""
+    stats = _timers.get(name)
+    if stats is None:
+        with _timers_lock:
+            stats = _timers.setdefault(name, LatencyStats())
+    return stats
+
+
+@contextmanager
+def timed(name: str):
+    """Record the duration of the with-block under name (also when it raises)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        latency(name).observe(elapsed)
+        operation_seconds.observe(elapsed, name)
+
+
+def snapshot(prefix: str = "") -> dict:
+    """Summaries of every recorder whose name starts with prefix."""
+    with _timers_lock:
+        names = [name for name in _timers if name.startswith(prefix)]
+    return {name: _timers[name].summary() for name in sorted(names)}
+
+
+# -------------------- Prometheus exposition --------------------
+# Metrics are kept per process in plain dicts keyed by label values; recording is a
+# dict lookup and a few additions under a lock, rendering happens only on scrape.
+
+_registry = []
+_caches = {}
+_collectors = []
+_upstream_listeners = []
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _label_text(self, values, extra=None) -> str:
+        pairs = list(zip(self.labels, values))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {values: self._copy(value) for values, value in self._values.items()}
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    @staticmethod
+    def _merge(a, b):
+        return a + b
+
+    def render(self, values=None) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        if values is None:
+            values = self.snapshot()
+        for labels, value in values.items():
+            lines.extend(self._samples(labels, value))
+        return lines
+
+    def _samples(self, values, value) -> list:
+        return [f"{self.name}{self._label_text(values)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *values, amount: float = 1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, *values, amount: float = 1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def dec(self, *values, amount: float = 1):
+        self.inc(*values, amount=-amount)
+
+    def set(self, *values, value: float):
+        with self._lock:
+            self._values[values] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, amount: float, *values):
+        index = bisect.bisect_left(self.buckets, amount)
+        with self._lock:
+            entry = self._values.get(values)
+            if entry is None:
+                entry = self._values[values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += amount
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1]]
+
+    @staticmethod
+    def _merge(a, b):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1]]
+
+    def _samples(self, values, value) -> list:
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{self._label_text(values, ('le', bound))} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text(values)} {total}")
+        lines.append(f"{self.name}_count{self._label_text(values)} {cumulative}")
+        return lines
+
+
+http_requests = Counter("http_requests_total", "HTTP requests by route, method and status.",
+                        ("route", "method", "status"))
+http_latency = Histogram("http_request_duration_seconds",
+                         "Time from request start until the response body is fully sent.", ("route", "method"))
+http_bytes = Counter("http_response_bytes_total", "Response body bytes sent.", ("route",))
+http_in_flight = Gauge("http_requests_in_flight", "Requests currently being served.")
+
+upstream_requests = Counter("upstream_requests_total", "Upstream provider calls by outcome.",
+                            ("provider", "status"))
+upstream_latency = Histogram("upstream_request_duration_seconds",
+                             "Upstream provider call latency (until response headers for HTTP calls).",
+                             ("provider",))
+upstream_bytes = Counter("upstream_response_bytes_total", "Upstream response bytes (when Content-Length is known).",
+                         ("provider",))
+llm_ttft = Histogram("llm_time_to_first_token_seconds", "Time until the first streamed token.", ("provider",))
+upstream_in_flight = Gauge("upstream_requests_in_flight", "Upstream provider calls in progress.", ("provider",))
+
+operation_seconds = Histogram("app_operation_duration_seconds", "Durations recorded with metrics.timed().",
+                              ("operation",))
+
+
+@contextmanager
+def upstream(provider: str):
+    """
+    Time an SDK call to a provider: latency, in-flight and ok/error counts.
+    (HTTP calls through upstream.get_session are recorded automatically.)
+    """
+    upstream_in_flight.inc(provider)
+    started = time.perf_counter()
+    status = "error"
+    try:
+        yield
+        status = "ok"
+    except Exception as e:
+        if not is_provider_failure(e):
+            status = "client_error"
+        raise
+    finally:
+        upstream_in_flight.dec(provider)
+        elapsed = time.perf_counter() - started
+        upstream_latency.observe(elapsed, provider)
+        upstream_requests.inc(provider, status)
+        _notify(provider, elapsed, status != "error")
+
+
+def is_provider_failure(exc: Exception) -> bool:
+    """
+    Whether an SDK exception means the provider is struggling (429, 5xx, timeout,
+    connection error) rather than a bad request from our side (4xx, invalid input).
+    """
+    status = getattr(exc, "status_code", None) or getattr(exc, "http_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status >= 500 or status == 429
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    # SDK-specific classes, e.g. APITimeoutError, APIConnectionError, ReadTimeout
+    name = type(exc).__name__.lower()
+    return "timeout" in name or "connection" in name
+
+
+def record_upstream_response(provider: str, seconds: float, status, nbytes=None):
+    upstream_latency.observe(seconds, provider)
+    upstream_requests.inc(provider, str(status))
+    if nbytes:
+        upstream_bytes.inc(provider, amount=nbytes)
+    # Throttling and server errors count as failures; client errors are the caller's fault
+    ok = isinstance(status, int) and status < 500 and status != 429
+    _notify(provider, seconds, ok)
+
+
+def add_upstream_listener(callback):
+    """Call callback(provider, seconds, ok) after every recorded upstream call."""
+    _upstream_listeners.append(callback)
+
+
+def _notify(provider: str, seconds: float, ok: bool):
+    for callback in _upstream_listeners:
+        callback(provider, seconds, ok)
+
+
+def add_collector(render):
+    """Add a function returning extra exposition lines, called on every scrape."""
+    _collectors.append(render)
+
+
+def register_cache(name: str, cache):
+    """Expose a cache's stats() (hits, misses, hit_ratio, size) on /metrics."""
+    _caches[name] = cache
+
+
+def _cache_lines() -> list:
+    fields = (("hits", "counter", "cache_hits_total", "Cache hits."),
+              ("misses", "counter", "cache_misses_total", "Cache misses."),
+              ("hit_ratio", "gauge", "cache_hit_ratio", "Hits / lookups since process start."),
+              ("size", "gauge", "cache_entries", "Entries held in memory."))
+    stats = {name: cache.stats() for name, cache in list(_caches.items())}
+    lines = []
+    for field, kind, metric, doc in fields:
+        lines += [f"# HELP {metric} {doc}", f"# TYPE {metric} {kind}"]
+        lines += [f'{metric}{{cache="{name}"}} {s[field]}' for name, s in stats.items() if field in s]
+    return lines
+
+
+# -------------------- multi-worker aggregation --------------------
+# Modelled on prometheus_client's multiprocess mode, with JSON files instead of mmaps.
+# Counters and histograms of workers that exited are folded into _dead.json so totals
+# never go backwards; gauges (in-flight) only count live workers.
+
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _state() -> dict:
+    return {metric.name: [[list(labels), value] for labels, value in metric.snapshot().items()]
+            for metric in _registry}
+
+
+def _write_json(path: str, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read_json(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def flush():
+    """Write this worker's series to METRICS_DIR."""
+    if METRICS_DIR:
+        _write_json(os.path.join(METRICS_DIR, f"{os.getpid()}.json"), _state())
+
+
+def _flush_forever():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            print("Metrics flush failed:", e)
+
+
+def _ensure_flusher():
+    """Start the flush thread in this process (threads don't survive gunicorn's fork)."""
+    global _flusher_pid
+    if not METRICS_DIR or _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_forever, name="metrics-flush", daemon=True).start()
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _add_state(total: dict, state: dict, gauges: bool = True):
+    by_name = {metric.name: metric for metric in _registry}
+    for name, series in state.items():
+        metric = by_name.get(name)
+        if metric is None or (metric.kind == "gauge" and not gauges):
+            continue
+        values = total.setdefault(name, {})
+        for labels, value in series:
+            labels = tuple(labels)
+            values[labels] = metric._merge(values[labels], value) if labels in values else value
+
+
+def _fold_dead_workers():
+    """Move the counters and histograms of exited workers into _dead.json (under a file lock)."""
+    import fcntl
+    dead_path = os.path.join(METRICS_DIR, "_dead.json")
+    with open(os.path.join(METRICS_DIR, "_lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dead = {}
+        for entry in os.listdir(METRICS_DIR):
+            pid = entry[:-5]
+            if not entry.endswith(".json") or not pid.isdigit() or _alive(int(pid)):
+                continue
+            if not dead:
+                _add_state(dead, _read_json(dead_path))
+            _add_state(dead, _read_json(os.path.join(METRICS_DIR, entry)), gauges=False)
+            os.remove(os.path.join(METRICS_DIR, entry))
+        if dead:
+            _write_json(dead_path, {name: [[list(k), v] for k, v in values.items()]
+                                    for name, values in dead.items()})
+
+
+def _aggregate() -> dict:
+    """Series summed over this process (live values), other workers' files and exited workers."""
+    _fold_dead_workers()
+    total = {metric.name: metric.snapshot() for metric in _registry}
+    own = f"{os.getpid()}.json"
+    for entry in os.listdir(METRICS_DIR):
+        if entry.endswith(".json") and entry != own:
+            _add_state(total, _read_json(os.path.join(METRICS_DIR, entry)))
+    return total
+
+
+def _with_pid(line: str) -> str:
+    """Add this worker's pid label to a per-worker sample line."""
+    if line.startswith("#"):
+        return line
+    pid = f'pid="{os.getpid()}"'
+    if "{" in line:
+        return line.replace("{", "{" + pid + ",", 1)
+    name, _, value = line.partition(" ")
+    return f"{name}{{{pid}}} {value}"
+
+
+def render_prometheus() -> str:
+    """
+    Metrics in the Prometheus text format, summed over all workers when METRICS_DIR is set.
+    Cache and limiter series are per-worker state and carry a pid label.
+    """
+    lines = ["# HELP process_info The worker that served this scrape.", "# TYPE process_info gauge",
+             f'process_info{{pid="{os.getpid()}"}} 1']
+    values = _aggregate() if METRICS_DIR else {}
+    for metric in list(_registry):
+        lines.extend(metric.render(values.get(metric.name)))
+    local = _cache_lines()
+    for render in _collectors:
+        local.extend(render())
+    lines.extend(_with_pid(line) for line in local)
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    WSGI middleware recording per-route latency, status, bytes and in-flight requests.
+    Timing stops when the server closes the response, so streamed bodies (SSE, WAV)
+    are measured in full. The route template is taken from environ["metrics.route"].
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        _ensure_flusher()
+        started = time.perf_counter()
+        status = ["500", 0]
+
+        def _start_response(status_line, headers, exc_info=None):
+            status[0] = status_line.split(" ", 1)[0]
+            for name, value in headers:
+                if name.lower() == "content-length" and value.isdigit():
+                    status[1] = int(value)
+            return start_response(status_line, headers, exc_info)
+
+        http_in_flight.inc()
+        try:
+            body = self.app(environ, _start_response)
+        except Exception:
+            self._finish(environ, started, status[0], 0)
+            raise
+        file_wrapper = environ.get("wsgi.file_wrapper")
+        if isinstance(file_wrapper, type) and isinstance(body, file_wrapper):
+            # Leave file responses unwrapped so the server can still use sendfile()
+            self._finish(environ, started, status[0], status[1])
+            return body
+        return _MeteredBody(body, lambda sent: self._finish(environ, started, status[0], sent))
+
+    @staticmethod
+    def _finish(environ, started, status, sent):
+        http_in_flight.dec()
+        route = environ.get("metrics.route", "unmatched")
+        method = environ.get("REQUEST_METHOD", "")
+        http_latency.observe(time.perf_counter() - started, route, method)
+        http_requests.inc(route, method, status)
+        if sent:
+            http_bytes.inc(route, amount=sent)
+
+
+class _MeteredBody:
+    """Response iterable that counts bytes and reports once when closed."""
+
+    def __init__(self, body, on_close):
+        self._body = body
+        self._on_close = on_close
+        self._sent = 0
+        self._closed = False
+
+    def __iter__(self):
+        for chunk in self._body:
+            self._sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            close = getattr(self._body, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._on_close(self._sent)
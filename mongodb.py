@@ -1,14 +1,42 @@
 # mongodb.py
 from pymongo import MongoClient
-from werkzeug.security import generate_password_hash, check_password_hash
+from pymongo.errors import DuplicateKeyError, OperationFailure
 from flask import session
 import os
+import time
+import threading
 from dotenv import load_dotenv
 from bson.objectid import ObjectId
+from passwords import hash_password, verify_password
+from metrics import timed
 
 load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI") or os.getenv("MONGO_URL")
-client = MongoClient(MONGO_URI) if MONGO_URI else MongoClient()
+
+# Pool and timeout tuning (pymongo defaults are 100 connections and 30s server selection)
+MONGO_OPTIONS = {
+    "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+    "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+    "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+    "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "10000")),
+}
+
+
+def _make_client(uri):
+    """
+    Build the Mongo client. A "mongomock://" URI selects the in-memory mongomock
+    stand-in (optional dependency) for tests and local runs without a server.
+    """
+    if uri and uri.startswith("mongomock://"):
+        import mongomock
+        return mongomock.MongoClient(uri.replace("mongomock://", "mongodb://", 1))
+    # connect=False: no connection or monitor threads until the first query, so importing
+    # this module is instant and safe before gunicorn forks workers
+    return MongoClient(uri, connect=False, **MONGO_OPTIONS)
+
+
+client = _make_client(MONGO_URI)
 # get default db or fallback to 'multimodal_db'
 try:
     db = client.get_default_database() or client['multimodal_db']
@@ -16,18 +44,63 @@ except Exception:
     db = client['multimodal_db']
 users = db['users']
 
+# Only the fields each read needs; the password hash never leaves login_user
+LOGIN_PROJECTION = {"password": 1, "name": 1, "email": 1, "profile_image": 1, "profile_thumbs": 1,
+                    "profile_image_status": 1}
+
+_indexes_ready = False
+_indexes_failed_at = 0.0
+_indexes_lock = threading.Lock()
+# After a failed attempt, wait this long before trying to create the index again
+INDEX_RETRY_SECONDS = 60
+
+
+def ensure_indexes() -> bool:
+    """
+    Create the unique email index once per process (on first use, not at import).
+    Returns False while the index is missing, e.g. because existing duplicate emails block it.
+    """
+    global _indexes_ready, _indexes_failed_at
+    if _indexes_ready:
+        return True
+    with _indexes_lock:
+        if _indexes_ready:
+            return True
+        if time.monotonic() - _indexes_failed_at < INDEX_RETRY_SECONDS:
+            return False
+        try:
+            users.create_index("email", unique=True, name="email_unique")
+        except OperationFailure as e:
+            print("Could not create unique email index (duplicate emails are checked by query):", e)
+            _indexes_failed_at = time.monotonic()
+            return False
+        _indexes_ready = True
+        return True
+
+
 def register_user(name, email, password, profile_image=None):
     """Registers a new user"""
-    if users.find_one({"email": email}):
+    with timed("auth.register"):
+        return _register_user(name, email, password, profile_image)
+
+
+def _register_user(name, email, password, profile_image):
+    # Without the unique index, fall back to checking first (not atomic, but no silent duplicates)
+    if not ensure_indexes() and users.find_one({"email": email}, {"_id": 1}):
         return {"status": "error", "message": "Email already registered"}
-    hashed = generate_password_hash(password)
+    with timed("auth.hash"):
+        hashed = hash_password(password)
     user_doc = {
         "name": name,
         "email": email,
         "password": hashed,
         "profile_image": profile_image,
     }
-    res = users.insert_one(user_doc)
+    # Single round trip: the unique index rejects duplicates atomically
+    try:
+        res = users.insert_one(user_doc)
+    except DuplicateKeyError:
+        return {"status": "error", "message": "Email already registered"}
     user_doc["_id"] = str(res.inserted_id)
     user_doc.pop("password", None)
     return {"status": "success", "user": user_doc}
@@ -35,19 +108,44 @@ def register_user(name, email, password, profile_image=None):
 
 def login_user(email, password):
     """Verifies login credentials"""
-    user = users.find_one({"email": email})
-    if not user or not check_password_hash(user.get("password", ""), password):
+    with timed("auth.login"):
+        return _login_user(email, password)
+
+
+def _login_user(email, password):
+    ensure_indexes()
+    user = users.find_one({"email": email}, LOGIN_PROJECTION)
+    if not user:
+        return {"status": "error", "message": "Invalid credentials"}
+    with timed("auth.verify"):
+        ok, new_hash = verify_password(user.get("password", ""), password)
+    if not ok:
         return {"status": "error", "message": "Invalid credentials"}
+    if new_hash:
+        # Upgrade to the current work factor; conditional so a concurrent change isn't overwritten
+        users.update_one({"_id": user["_id"], "password": user["password"]}, {"$set": {"password": new_hash}})
     user_slim = {
         "id": str(user.get("_id")),
         "name": user.get("name"),
         "email": user.get("email"),
         "profile_image": user.get("profile_image"),
+        "profile_thumb": _smallest_thumb(user),
+        # "pending" / "error" while a background upload (profile_images) is unfinished or failed
+        "profile_image_status": user.get("profile_image_status"),
     }
     session["user"] = user_slim
     return {"status": "success", "user": user_slim}
 
 
+def _smallest_thumb(user):
+    """Smallest avatar variant (see profile_images), falling back to the original image."""
+    thumbs = user.get("profile_thumbs") or {}
+    for size in sorted(thumbs, key=int):
+        if thumbs[size]:
+            return thumbs[size]
+    return user.get("profile_image")
+
+
 def logout_user():
     """Logs out current user"""
     session.pop("user", None)
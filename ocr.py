@@ -0,0 +1,346 @@
+import os
+import time
+import json
+import base64
+import threading
+import io
+import zipfile
+import difflib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterable, Iterator, List, Tuple
+from dotenv import load_dotenv
+from cache import TieredCache, content_key
+import metrics
+import limits
+from cpu import run_cpu
+from upstream import get_session, UPSTREAM_CONNECT_TIMEOUT
+from image_prep import prepare_image, detect_mime, PREP_SETTINGS
+
+load_dotenv()
+
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+OCR_MODEL = "mistralai/mistral-small-3.2-24b-instruct:free"
+OCR_PROMPT = "Extract all visible text clearly from this image and return plain text only."
+
+# Worker threads shared by every /ocr request in this process
+OCR_MAX_WORKERS = int(os.getenv("OCR_MAX_WORKERS", "16"))
+# Max simultaneous calls to a single provider across all requests
+OCR_PROVIDER_CONCURRENCY = int(os.getenv("OCR_PROVIDER_CONCURRENCY", "4"))
+# Per-file budget in seconds (queueing + upstream call)
+OCR_FILE_TIMEOUT = float(os.getenv("OCR_FILE_TIMEOUT", "60"))
+
+# Result cache: LRU in memory, plus an on-disk tier when OCR_CACHE_DIR is set
+OCR_CACHE_SIZE = int(os.getenv("OCR_CACHE_SIZE", "512"))
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR")
+
+# Batch mode (/ocr/batch): pages rendered and in flight per request, so memory and
+# time-to-first-result don't grow with the document
+OCR_BATCH_WINDOW = int(os.getenv("OCR_BATCH_WINDOW", "8"))
+OCR_BATCH_MAX_PAGES = int(os.getenv("OCR_BATCH_MAX_PAGES", "500"))
+OCR_PDF_DPI = int(os.getenv("OCR_PDF_DPI", "200"))
+# Uncompressed size limit per archive member (guards against zip bombs)
+OCR_ZIP_MAX_MEMBER = int(os.getenv("OCR_ZIP_MAX_MEMBER", str(32 * 1024 * 1024)))
+
+ocr_cache = TieredCache(max_items=OCR_CACHE_SIZE, directory=OCR_CACHE_DIR)
+metrics.register_cache("ocr", ocr_cache)
+
+_executor = ThreadPoolExecutor(max_workers=OCR_MAX_WORKERS, thread_name_prefix="ocr")
+# Tiles of one image run here, so a file waiting on its tiles can't starve them of workers
+_tile_executor = ThreadPoolExecutor(max_workers=OCR_MAX_WORKERS, thread_name_prefix="ocr-tile")
+_provider_slots = {
+    "openrouter": threading.BoundedSemaphore(OCR_PROVIDER_CONCURRENCY),
+}
+
+
+class OCRError(Exception):
+    """Raised when the vision model does not return usable text."""
+
+
+def _openrouter_headers() -> dict:
+    return {
+        "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": os.getenv('SITE_URL'),
+        "X-Title": os.getenv('SITE_NAME'),
+    }
+
+
+def _request_body(image_bytes: bytes, mime: str) -> bytes:
+    """
+    The chat-completions JSON with the image inlined as a data URL. The base64 text is
+    written into the body directly (base64 output never needs JSON escaping), instead of
+    going through str -> f-string -> json.dumps -> encode, which copied it four times.
+    """
+    head, tail = json.dumps({
+        "model": OCR_MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": OCR_PROMPT},
+                    {"type": "image_url", "image_url": {"url": "\0"}},
+                ]
+            }
+        ]
+    }).split('"\\u0000"')
+    return b"".join([
+        head.encode("utf-8"), b'"data:', mime.encode("ascii"), b";base64,",
+        base64.b64encode(image_bytes), b'"', tail.encode("utf-8"),
+    ])
+
+
+def extract_text(image_bytes: bytes, timeout: float = OCR_FILE_TIMEOUT, mime: str = "image/jpeg") -> str:
+    """
+    Send one image to OpenRouter and return the extracted plain text.
+    `timeout` bounds the whole call: requests' own timeout only limits each socket
+    wait, so the body is streamed and the deadline checked between chunks. A call can
+    overrun by at most one socket wait, which is itself capped at the time left.
+    """
+    deadline = time.monotonic() + timeout
+    response = get_session("openrouter").post(
+        url=OPENROUTER_API_URL,
+        headers=_openrouter_headers(),
+        data=_request_body(image_bytes, mime),
+        timeout=(min(UPSTREAM_CONNECT_TIMEOUT, timeout), timeout),
+        stream=True,
+    )
+    with response:
+        body = bytearray()
+        # urllib3 2's read1 returns whatever has arrived instead of waiting for a full buffer
+        read = getattr(response.raw, "read1", response.raw.read)
+        while True:
+            chunk = read(64 * 1024, decode_content=True)
+            if not chunk:
+                break
+            body += chunk
+            if time.monotonic() > deadline:
+                raise OCRError("Exception: OCR timed out.")
+    try:
+        result = json.loads(body)
+    except ValueError:
+        raise OCRError(f"Error: invalid response from OCR provider (HTTP {response.status_code}).")
+
+    if response.status_code != 200:
+        raise OCRError(f"Error: {result.get('error', {}).get('message', 'API request failed.')}")
+    if "choices" in result and result["choices"]:
+        return result["choices"][0]["message"]["content"].strip()
+    raise OCRError("No text extracted or empty response.")
+
+
+def _ocr_tile(mime: str, data: bytes, deadline: float, provider: str) -> str:
+    """One vision call within the provider's concurrency cap and the file's deadline."""
+    slot = _provider_slots[provider]
+    remaining = deadline - time.monotonic()
+    if remaining <= 0 or not slot.acquire(timeout=remaining):
+        raise OCRError("Exception: Timed out waiting for OCR capacity.")
+    try:
+        # Each page/tile is one provider call, so each takes its own adaptive-limiter slot
+        with limits.slot(provider, timeout=max(deadline - time.monotonic(), 0)):
+            return extract_text(data, timeout=max(deadline - time.monotonic(), 1.0), mime=mime)
+    except limits.ProviderBusy:
+        raise OCRError("Exception: Timed out waiting for OCR capacity.")
+    finally:
+        slot.release()
+
+
+# Lines compared at the end of one tile and the start of the next; covers OCR_TILE_OVERLAP
+# (96 px at 2048 px wide is a few lines of text) with plenty of room for OCR noise
+_OVERLAP_LINES = 12
+
+
+def _normalize_line(line: str) -> str:
+    return " ".join(line.lower().split())
+
+
+def _join_tiles(texts: List[str]) -> str:
+    """
+    Join the texts of vertically overlapping tiles, dropping the lines read twice: the
+    longest common run of lines between the tail of one tile and the head of the next
+    is kept once (lines cut in half at the tile edges around it are dropped too).
+    """
+    lines = texts[0].splitlines() if texts else []
+    for text in texts[1:]:
+        following = text.splitlines()
+        tail = [_normalize_line(line) for line in lines[-_OVERLAP_LINES:]]
+        head = [_normalize_line(line) for line in following[:_OVERLAP_LINES]]
+        match = difflib.SequenceMatcher(None, tail, head, autojunk=False).find_longest_match(
+            0, len(tail), 0, len(head))
+        # Ignore coincidental matches of blank or very short lines
+        if match.size and sum(len(line) for line in tail[match.a:match.a + match.size]) >= 8:
+            cut = len(lines) - len(tail) + match.a + match.size
+            lines = lines[:cut] + following[match.b + match.size:]
+        else:
+            lines += following
+    return "\n".join(lines)
+
+
+def _ocr_one(filename: str, image_bytes: bytes, deadline: float, provider: str) -> dict:
+    """OCR one upload: preprocess it, read its tiles in parallel and join their text in order."""
+    key = content_key(image_bytes, OCR_MODEL, OCR_PROMPT, PREP_SETTINGS)
+    cached = ocr_cache.get(key)
+    if cached is not None:
+        return {'filename': filename, 'text': cached}
+
+    try:
+        tiles = run_cpu(prepare_image, image_bytes)
+        if len(tiles) == 1:
+            text = _ocr_tile(*tiles[0], deadline, provider)
+        else:
+            futures = [_tile_executor.submit(_ocr_tile, mime, data, deadline, provider) for mime, data in tiles]
+            text = _join_tiles([future.result() for future in futures])
+        ocr_cache.set(key, text)
+        return {'filename': filename, 'text': text}
+    except OCRError as e:
+        return {'filename': filename, 'text': f"❌ {e}"}
+    except Exception as e:
+        return {'filename': filename, 'text': f"❌ Exception: {str(e)}"}
+
+
+def ocr_images(images: List[Tuple[str, bytes]], provider: str = "openrouter",
+               timeout: float = OCR_FILE_TIMEOUT) -> List[dict]:
+    """
+    OCR a batch of (filename, bytes) pairs concurrently.
+    Results are returned in input order; a slow or failing image only affects its own entry.
+    An image still running at the deadline is reported as timed out; its call stops on
+    its own shortly after (extract_text enforces the same deadline) and frees its slot.
+    """
+    deadline = time.monotonic() + timeout
+    futures = [_executor.submit(_ocr_one, name, data, deadline, provider) for name, data in images]
+    # Small grace period so a call that hits its own timeout can still report its error
+    wait(futures, timeout=timeout + 1)
+
+    results = []
+    for (name, _), future in zip(images, futures):
+        if future.done():
+            results.append(future.result())
+        else:
+            future.cancel()
+            results.append({'filename': name, 'text': "❌ Exception: OCR timed out."})
+    return results
+
+
+# PDFium is not thread-safe: every call into it (open, render, close) is serialized
+_pdfium_lock = threading.Lock()
+
+
+def _render_pdf_page(pdf, number: int, max_width: int) -> bytes:
+    with _pdfium_lock:
+        page = pdf[number]
+        try:
+            scale = min(OCR_PDF_DPI / 72, max_width / max(page.get_width(), 1))
+            # convert() copies the pixels out of pdfium's bitmap before it is freed
+            image = page.render(scale=scale).to_pil().convert("RGB")
+        finally:
+            page.close()
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+def _pdf_pages(fileobj, prefix: str = "page") -> Iterator[Tuple[str, bytes]]:
+    """
+    Render PDF pages one at a time with pypdfium2 (JPEG, about OCR_PDF_DPI and no wider
+    than needed). Without it, fall back to the images embedded in each page via pypdf,
+    which covers scanned PDFs.
+    """
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        pdfium = None
+
+    if pdfium is not None:
+        from image_prep import OCR_MAX_WIDTH
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(fileobj)
+            count = len(pdf)
+        try:
+            for number in range(count):
+                yield f"{prefix}-{number + 1}", run_cpu(_render_pdf_page, pdf, number, OCR_MAX_WIDTH)
+        finally:
+            with _pdfium_lock:
+                pdf.close()
+        return
+
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise OCRError("PDF support needs pypdfium2 or pypdf")
+    for number, page in enumerate(PdfReader(fileobj).pages):
+        images = page.images
+        for index, image in enumerate(images):
+            suffix = f"-{index + 1}" if len(images) > 1 else ""
+            yield f"{prefix}-{number + 1}{suffix}", image.data
+
+
+def _zip_images(fileobj) -> Iterator[Tuple[str, bytes]]:
+    """Images (and PDF pages) inside a zip archive in name order, read one member at a time."""
+    with zipfile.ZipFile(fileobj) as archive:
+        members = sorted(archive.infolist(), key=lambda info: info.filename)
+        for info in members:
+            base = os.path.basename(info.filename)
+            if info.is_dir() or info.filename.startswith("__MACOSX/") or base.startswith("."):
+                continue
+            if info.file_size > OCR_ZIP_MAX_MEMBER:
+                continue
+            data = run_cpu(archive.read, info)
+            if data.startswith(b"%PDF"):
+                yield from _pdf_pages(io.BytesIO(data), prefix=info.filename)
+            elif detect_mime(data):
+                yield info.filename, data
+
+
+def iter_document(fileobj, filename: str) -> Iterator[Tuple[str, bytes]]:
+    """Split a PDF, zip archive or single image (seekable file object) into (name, bytes) images."""
+    head = fileobj.read(8)
+    fileobj.seek(0)
+    if head.startswith(b"%PDF"):
+        pages = _pdf_pages(fileobj)
+    elif head.startswith(b"PK\x03\x04"):
+        pages = _zip_images(fileobj)
+    else:
+        pages = iter([(filename, fileobj.read())])
+    for count, page in enumerate(pages):
+        if count >= OCR_BATCH_MAX_PAGES:
+            return
+        yield page
+
+
+def iter_ocr(images: Iterable[Tuple[str, bytes]], provider: str = "openrouter",
+             timeout: float = OCR_FILE_TIMEOUT, window: int = OCR_BATCH_WINDOW) -> Iterator[dict]:
+    """
+    OCR (name, bytes) pairs from a lazy iterable, yielding each result as soon as it is
+    done (with its input `index`). Only `window` images are pulled and in flight at once,
+    so a long document is split as it is read. A page still running a second past its
+    deadline is reported as timed out. Pending work is cancelled if the consumer stops.
+    """
+    images = iter(images)
+    pending = {}
+    index = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < window:
+                try:
+                    name, data = next(images)
+                except StopIteration:
+                    exhausted = True
+                    break
+                deadline = time.monotonic() + timeout
+                pending[_executor.submit(_ocr_one, name, data, deadline, provider)] = (index, name, deadline)
+                index += 1
+            if not pending:
+                return
+            # Same grace period as ocr_images past the earliest deadline
+            earliest = min(deadline for _, _, deadline in pending.values())
+            done, _ = wait(pending, timeout=max(earliest + 1 - time.monotonic(), 0),
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                yield dict(future.result(), index=pending.pop(future)[0])
+            now = time.monotonic()
+            for future in [f for f, (_, _, deadline) in pending.items() if deadline + 1 <= now]:
+                future.cancel()
+                page, name, _ = pending.pop(future)
+                yield {'filename': name, 'text': "❌ Exception: OCR timed out.", 'index': page}
+    finally:
+        for future in pending:
+            future.cancel()
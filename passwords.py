@@ -0,0 +1,80 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+from cpu import gevent_threadpool
+
+# Werkzeug method string; the work factor lives in it, e.g. "scrypt:32768:8:1" or
+# "pbkdf2:sha256:600000". Hashes made with a different method are upgraded on login.
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Hashing requests allowed to wait for a worker; beyond that callers block, so an auth
+# burst queues here instead of piling unbounded work onto the pool
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", str(PASSWORD_HASH_WORKERS * 8)))
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "30"))
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+# Per-process cache; computing a prefix costs one hash
+_method_prefixes = {}
+
+
+def _executor() -> ProcessPoolExecutor:
+    """Start the pool on first use. "spawn" avoids forking a process that already runs Mongo/HTTP threads."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=PASSWORD_HASH_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _pool
+
+
+def _run(fn, *args):
+    with _slots:
+        threadpool = gevent_threadpool()
+        if threadpool is not None:
+            # Under gevent the hashlib KDFs run on native threads (they release the GIL),
+            # which keeps the event loop free without multiprocessing under monkey-patching
+            return threadpool.spawn(fn, *args).get(timeout=PASSWORD_HASH_TIMEOUT)
+        return _executor().submit(fn, *args).result(timeout=PASSWORD_HASH_TIMEOUT)
+
+
+def _hash(password: str, method: str) -> str:
+    return generate_password_hash(password, method=method)
+
+
+def _verify(pwhash: str, password: str, method: str):
+    """Check password; also return a fresh hash when pwhash used an outdated method."""
+    if not check_password_hash(pwhash, password):
+        return False, None
+    if pwhash.split("$", 1)[0] == method_prefix(method):
+        return True, None
+    return True, generate_password_hash(password, method=method)
+
+
+def method_prefix(method: str = PASSWORD_HASH_METHOD) -> str:
+    """The part before the first "$" that werkzeug writes for method, default parameters filled in."""
+    prefix = _method_prefixes.get(method)
+    if prefix is None:
+        prefix = _method_prefixes[method] = generate_password_hash("", method=method).split("$", 1)[0]
+    return prefix
+
+
+def hash_password(password: str) -> str:
+    """Hash password with PASSWORD_HASH_METHOD in the process pool."""
+    return _run(_hash, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(pwhash: str, password: str):
+    """
+    Verify password against pwhash in the process pool.
+    Returns (ok, new_hash); new_hash is set when the stored hash should be replaced.
+    """
+    if not pwhash:
+        return False, None
+    return _run(_verify, pwhash, password, PASSWORD_HASH_METHOD)
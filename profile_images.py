@@ -0,0 +1,70 @@
+import io
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from bson.objectid import ObjectId
+from mongodb import users
+from image_prep import detect_mime
+import providers
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FOLDER = "multimodal_profiles"
+PROFILE_UPLOAD_WORKERS = int(os.getenv("PROFILE_UPLOAD_WORKERS", "2"))
+PROFILE_MAX_BYTES = int(os.getenv("PROFILE_MAX_BYTES", str(8 * 1024 * 1024)))
+# Square avatar variants (px) generated by Cloudinary at upload time; the navbar shows
+# a 36px avatar, so the smallest covers 2x screens
+PROFILE_THUMB_SIZES = tuple(int(s) for s in os.getenv("PROFILE_THUMB_SIZES", "72,256").split(","))
+
+_executor = ThreadPoolExecutor(max_workers=PROFILE_UPLOAD_WORKERS, thread_name_prefix="profile")
+
+
+def _eager_transformations():
+    return [
+        {"width": size, "height": size, "crop": "thumb", "gravity": "face",
+         "quality": "auto", "fetch_format": "auto"}
+        for size in PROFILE_THUMB_SIZES
+    ]
+
+
+def read_profile_image(stream):
+    """Read an uploaded profile image; returns (bytes, None) or (None, error message)."""
+    data = stream.read(PROFILE_MAX_BYTES + 1)
+    if len(data) > PROFILE_MAX_BYTES:
+        return None, f"Profile image must be at most {PROFILE_MAX_BYTES // (1024 * 1024)} MB."
+    if not detect_mime(data):
+        return None, "Profile image must be a JPEG, PNG, WebP, GIF, BMP, TIFF, HEIC or AVIF file."
+    return data, None
+
+
+def submit_profile_upload(user_id: str, data: bytes):
+    """Upload a new user's profile image in the background; the user document is updated when done."""
+    users.update_one({"_id": ObjectId(user_id)}, {"$set": {"profile_image_status": "pending"}})
+    _executor.submit(_upload, user_id, data)
+
+
+def _upload(user_id: str, data: bytes):
+    try:
+        with metrics.upstream("cloudinary"):
+            result = providers.get("cloudinary").upload(
+                io.BytesIO(data),
+                folder=PROFILE_FOLDER,
+                public_id=f"user_{user_id}",
+                overwrite=True,
+                eager=_eager_transformations(),
+            )
+    except Exception:
+        logger.exception("Profile image upload for user %s failed", user_id)
+        users.update_one({"_id": ObjectId(user_id)}, {"$set": {"profile_image_status": "error"}})
+        return
+
+    # Eager results come back in the order requested
+    thumbs = {str(size): variant.get("secure_url")
+              for size, variant in zip(PROFILE_THUMB_SIZES, result.get("eager") or [])}
+    users.update_one({"_id": ObjectId(user_id)}, {"$set": {
+        "profile_image": result.get("secure_url"),
+        "profile_thumbs": thumbs,
+        "profile_image_status": "ready",
+    }})
+
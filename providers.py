@@ -0,0 +1,97 @@
+import os
+import time
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Provider clients are built on first use instead of at import, so workers boot fast
+# and without network access. Heavy SDK imports live inside the factories for the same reason.
+_factories = {}
+_instances = {}
+_lock = threading.Lock()
+# Seconds each provider took to initialize, for the startup report
+init_times = {}
+
+
+def provider(name: str):
+    """Register a zero-argument factory for a provider client."""
+    def decorator(factory):
+        _factories[name] = factory
+        return factory
+    return decorator
+
+
+def get(name: str):
+    """Return the provider client, creating it on first use."""
+    instance = _instances.get(name)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(name)
+            if instance is None:
+                started = time.perf_counter()
+                instance = _factories[name]()
+                init_times[name] = time.perf_counter() - started
+                _instances[name] = instance
+    return instance
+
+
+def names():
+    return list(_factories)
+
+
+@provider("groq")
+def _groq():
+    from groq import Groq
+    # The SDK also honours GROQ_BASE_URL (used to point benchmarks at a fake server)
+    return Groq(default_headers={"Groq-Model-Version": "latest"}, api_key=os.getenv("GROQ_API_KEY"))
+
+
+@provider("sarvam")
+def _sarvam():
+    from sarvamai import SarvamAI, SarvamAIEnvironment
+    base_url = os.getenv("SARVAM_BASE_URL")
+    kwargs = {}
+    if base_url:
+        # The SDK takes no base_url; point all of its environment URLs at the given host
+        # (http -> ws, https -> wss for the streaming endpoints)
+        base_url = base_url.rstrip("/")
+        ws_url = "ws" + base_url[len("http"):] if base_url.startswith("http") else base_url
+        kwargs["environment"] = SarvamAIEnvironment(base=base_url, creative=f"{base_url}/dubbing",
+                                                    production=ws_url)
+    return SarvamAI(api_subscription_key=os.getenv("SARVAM_API_KEY"), **kwargs)
+
+
+@provider("youtube")
+def _youtube():
+    from googleapiclient.discovery import build
+    # static_discovery loads the discovery document bundled with google-api-python-client
+    # instead of fetching it over the network
+    endpoint = os.getenv("YOUTUBE_API_ENDPOINT")
+    return build("youtube", "v3", developerKey=os.getenv("YOUTUBE_API_KEY"),
+                 static_discovery=True, cache_discovery=False,
+                 client_options={"api_endpoint": endpoint} if endpoint else None)
+
+
+@provider("cloudinary")
+def _cloudinary():
+    import cloudinary
+    import cloudinary.uploader
+    # Cloudinary configuration: prefer single CLOUDINARY_URL or individual vars
+    cloudinary_url = os.getenv("CLOUDINARY_URL")
+    if cloudinary_url:
+        cloudinary.config(cloudinary_url=cloudinary_url)
+    else:
+        cloudinary.config(
+            cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
+            api_key=os.getenv("CLOUDINARY_API_KEY"),
+            api_secret=os.getenv("CLOUDINARY_API_SECRET"),
+        )
+    return cloudinary.uploader
+
+
+@provider("image")
+def _image():
+    # One long-lived g4f client reused by every request; g4f is heavy to import
+    from g4f.client import Client
+    return Client()
@@ -0,0 +1,120 @@
+import os
+import re
+import hashlib
+from typing import Optional
+from cache import TieredCache, content_key
+from upstream import get_session, UPSTREAM_CONNECT_TIMEOUT, MultipartUpload, HashingReader
+import metrics
+from cpu import run_cpu
+
+RAG_API_URL = os.getenv("RAG_API_URL")
+# "remote" forwards to the FastAPI service at RAG_API_URL; "local" indexes and answers
+# in-process (local_rag.py, needs numpy)
+RAG_BACKEND = os.getenv("RAG_BACKEND", "remote")
+RAG_UPLOAD_TIMEOUT = float(os.getenv("RAG_UPLOAD_TIMEOUT", "120"))
+RAG_ASK_TIMEOUT = float(os.getenv("RAG_ASK_TIMEOUT", "60"))
+
+# Answers keyed by (document version, normalized question); a new upload changes the version
+RAG_ANSWER_CACHE_SIZE = int(os.getenv("RAG_ANSWER_CACHE_SIZE", "2048"))
+RAG_ANSWER_CACHE_TTL = int(os.getenv("RAG_ANSWER_CACHE_TTL", str(7 * 24 * 3600)))
+RAG_ANSWER_CACHE_DIR = os.getenv("RAG_ANSWER_CACHE_DIR", os.path.join("cache", "rag_answers"))
+answer_cache = TieredCache(RAG_ANSWER_CACHE_SIZE, RAG_ANSWER_CACHE_DIR or None, RAG_ANSWER_CACHE_TTL)
+metrics.register_cache("rag_answers", answer_cache)
+
+_TRAILING_PUNCT_RE = re.compile(r'[\s?.!।]+$')
+
+
+class RAGError(Exception):
+    """The RAG service answered with a non-2xx status."""
+
+    def __init__(self, status_code: int, detail):
+        super().__init__(f"RAG service error ({status_code})")
+        self.status_code = status_code
+        self.detail = detail
+
+
+def normalize_question(question: str) -> str:
+    """Case, spacing and trailing punctuation don't change the answer."""
+    return _TRAILING_PUNCT_RE.sub("", " ".join(question.lower().split()))
+
+
+def _payload(resp) -> dict:
+    try:
+        return resp.json()
+    except ValueError:
+        return {"status_code": resp.status_code, "text": resp.text}
+
+
+def upload_document(stream, filename: str, content_type: Optional[str] = None,
+                    size: Optional[int] = None, user_id: Optional[str] = None):
+    """
+    Stream a document to the RAG service over the pooled session, hashing it on the way
+    (or index it locally for user_id with RAG_BACKEND=local).
+    Returns (service payload, document version).
+    """
+    if RAG_BACKEND == "local":
+        return _index_locally(stream, filename, content_type, user_id)
+
+    reader = HashingReader(stream)
+    body = MultipartUpload(reader, filename, content_type or "application/pdf", size)
+    resp = get_session("rag").post(
+        f"{RAG_API_URL}/upload_doc",
+        data=body if body.len is not None else iter(body),
+        headers={"Content-Type": body.content_type},
+        timeout=(UPSTREAM_CONNECT_TIMEOUT, RAG_UPLOAD_TIMEOUT),
+    )
+    payload = _payload(resp)
+    if resp.status_code // 100 != 2:
+        raise RAGError(resp.status_code, payload)
+    return payload, reader.hexdigest()
+
+
+def _index_locally(stream, filename: str, content_type: Optional[str], user_id: Optional[str]):
+    import local_rag
+    data = stream.read()
+    doc_version = hashlib.sha256(data).hexdigest()
+    try:
+        meta = run_cpu(local_rag.build_index, user_id, doc_version, data, filename, content_type)
+    except local_rag.LocalRAGError as e:
+        raise RAGError(422, str(e))
+    return {"message": f"Document indexed ({meta['chunks']} chunks)", "chunks": meta["chunks"]}, doc_version
+
+
+def ask(question: str, doc_version: Optional[str] = None, user_id: Optional[str] = None) -> dict:
+    """
+    Answer a question about the uploaded document: {"answer", "source"}.
+    With a doc_version, answers are served from and stored in answer_cache.
+    """
+    key = content_key("rag", RAG_BACKEND, doc_version, normalize_question(question)) if doc_version else None
+    if key:
+        cached = answer_cache.get(key)
+        if cached is not None:
+            return cached
+
+    if RAG_BACKEND == "local":
+        if not doc_version:
+            return {"answer": "Please upload a document first.", "source": None}
+        import local_rag
+        result = local_rag.ask(user_id, doc_version, question)
+        if result["source"]:
+            answer_cache.set(key, result)
+        return result
+
+    resp = get_session("rag").post(
+        f"{RAG_API_URL}/ask",
+        data={"question": question},
+        headers={"Accept": "application/json"},
+        timeout=(UPSTREAM_CONNECT_TIMEOUT, RAG_ASK_TIMEOUT),
+    )
+    try:
+        payload = resp.json()
+    except ValueError:
+        payload = {"text": resp.text}
+
+    answer = (payload.get("answer") or "").strip()
+    if not answer:
+        return {"answer": "No answer returned from RAG service.", "source": payload.get("source")}
+    result = {"answer": answer, "source": payload.get("source")}
+    if key and resp.status_code // 100 == 2:
+        answer_cache.set(key, result)
+    return result
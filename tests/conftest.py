@@ -0,0 +1,78 @@
+import os
+import sys
+import json
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Configure before any app module is imported: in-memory Mongo, caches in a throwaway dir
+_workdir = tempfile.mkdtemp(prefix="app_tests_")
+os.environ.update({
+    "SECRET_KEY": "test",
+    "MONGO_URI": "mongomock://localhost/app_tests",
+    "TRANSCRIPT_CACHE_DIR": os.path.join(_workdir, "transcripts"),
+    "TTS_PENDING_DIR": os.path.join(_workdir, "tts_requests"),
+    "RAG_ANSWER_CACHE_DIR": os.path.join(_workdir, "rag_answers"),
+    "RAG_INDEX_DIR": os.path.join(_workdir, "rag_index"),
+})
+
+
+@pytest.fixture
+def app():
+    pytest.importorskip("flask")
+    pytest.importorskip("mongomock")
+    from app import app
+    app.config["TESTING"] = True
+    return app
+
+
+@pytest.fixture
+def client(app):
+    """Test client with a logged-in session user."""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user"] = {"id": "0123456789abcdef01234567", "name": "Test", "email": "test@example.com"}
+    return client
+
+
+@pytest.fixture
+def fake_upstream():
+    """
+    Start a local HTTP server; `fake_upstream(handler)` returns its base URL, where
+    handler(path, headers, body) -> (status, JSON payload). Requests are kept in `.received`.
+    """
+    servers = []
+
+    def start(handler):
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                start.received.append((self.path, self.headers, body))
+                status, payload = handler(self.path, self.headers, body)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    start.received = []
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
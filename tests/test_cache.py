@@ -0,0 +1,144 @@
+import os
+import time
+import threading
+
+from cache import DiskCache, LRUCache, SingleFlight, TieredCache, content_key
+
+
+def _age(disk, key, seconds):
+    path = disk._path(key)
+    mtime = os.path.getmtime(path) - seconds
+    os.utime(path, (mtime, mtime))
+
+
+def _files(directory):
+    return sorted(name for _, _, names in os.walk(directory) for name in names)
+
+
+def test_content_key_is_unambiguous():
+    assert content_key("ab", "c") != content_key("a", "bc")
+    assert content_key(b"x", {"b": 1, "a": 2}) == content_key("x", {"a": 2, "b": 1})
+
+
+def test_lru_evicts_least_recently_used():
+    lru = LRUCache(max_items=2)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    lru.get("a")
+    lru.set("c", 3)
+    assert lru.get("b") is None
+    assert lru.get("a") == 1 and lru.get("c") == 3
+
+
+def test_lru_ttl():
+    lru = LRUCache(ttl=0.01)
+    lru.set("a", 1)
+    lru.set("b", 2, ttl=60)
+    time.sleep(0.02)
+    assert lru.get("a") is None
+    assert lru.get("b") == 2
+
+
+def test_tiered_cache_falls_back_to_disk(tmp_path):
+    first = TieredCache(max_items=10, directory=str(tmp_path))
+    first.set("k", {"answer": 42})
+    # A fresh process has an empty memory tier but shares the directory
+    second = TieredCache(max_items=10, directory=str(tmp_path))
+    assert second.get("k") == {"answer": 42}
+    assert second.disk_hits == 1
+    assert second.get("k") == {"answer": 42}
+    assert second.disk_hits == 1
+    assert second.get("missing", "default") == "default"
+    assert second.stats()["hits"] == 2 and second.stats()["misses"] == 1
+
+
+def test_tiered_cache_delete(tmp_path):
+    tiered = TieredCache(directory=str(tmp_path))
+    tiered.set("k", 1)
+    tiered.delete("k")
+    assert tiered.get("k") is None
+
+
+def test_disk_get_drops_expired_entry(tmp_path):
+    disk = DiskCache(str(tmp_path), ttl=60)
+    disk.set("ab1", "v")
+    _age(disk, "ab1", 120)
+    assert disk.get("ab1") is None
+    assert not os.path.exists(disk._path("ab1"))
+
+
+def test_sweep_removes_expired_and_stale_temp_files(tmp_path):
+    disk = DiskCache(str(tmp_path), ttl=60)
+    disk.set("aa1", "old")
+    disk.set("aa2", "new")
+    _age(disk, "aa1", 120)
+    stale = os.path.join(str(tmp_path), "aa", "stale.tmp")
+    fresh = os.path.join(str(tmp_path), "aa", "fresh.tmp")
+    for path in (stale, fresh):
+        open(path, "w").close()
+    os.utime(stale, (time.time() - 7200,) * 2)
+
+    disk.sweep()
+
+    assert _files(str(tmp_path)) == ["aa2.json", "fresh.tmp"]
+
+
+def test_sweep_bounds_size_oldest_first(tmp_path):
+    disk = DiskCache(str(tmp_path), max_bytes=0)
+    for n in range(5):
+        disk.set(f"k{n}", "x" * 100)
+        _age(disk, f"k{n}", 100 - n)
+    entry = os.path.getsize(disk._path("k0"))
+    disk.max_bytes = 2 * entry
+
+    disk.sweep()
+
+    assert _files(str(tmp_path)) == ["k3.json", "k4.json"]
+
+
+def test_writes_trigger_a_throttled_background_sweep(tmp_path, monkeypatch):
+    swept = threading.Event()
+    calls = []
+
+    def sweep():
+        calls.append(1)
+        swept.set()
+
+    disk = DiskCache(str(tmp_path))
+    monkeypatch.setattr(disk, "sweep", sweep)
+    disk.set("k1", 1)
+    assert swept.wait(2)
+    disk._sweep_lock.acquire()
+    disk._sweep_lock.release()
+    disk.set("k2", 2)
+    assert calls == [1]
+
+
+def test_tiered_cache_passes_the_size_bound(tmp_path):
+    tiered = TieredCache(directory=str(tmp_path), max_bytes=1234)
+    assert tiered.disk.max_bytes == 1234
+
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(2)
+        return "done"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("k", slow)))
+    leader.start()
+    started.wait(2)
+    follower = threading.Thread(target=lambda: results.append(flight.do("k", slow)))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join(2)
+    follower.join(2)
+    assert results == ["done", "done"] and calls == [1]
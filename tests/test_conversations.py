@@ -0,0 +1,161 @@
+import uuid
+
+import pytest
+
+pytest.importorskip("mongomock")
+import conversations  # noqa: E402
+from conversations import estimate_tokens  # noqa: E402
+
+
+class _Inline:
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+@pytest.fixture
+def user_id():
+    return uuid.uuid4().hex
+
+
+@pytest.fixture
+def inline_folds(monkeypatch):
+    monkeypatch.setattr(conversations, "_summary_executor", _Inline())
+
+
+def _turn(n, size=40):
+    return f"{n:04d} " + "x" * (size - 5)
+
+
+def _fill(conv_id, user_id, count, size=40, start=0):
+    conv = None
+    for n in range(start, start + count):
+        conv = conversations.append_message(conv_id, user_id, "user" if n % 2 == 0 else "assistant", _turn(n, size))
+    return conv
+
+
+def _contents(messages):
+    return [m["content"] for m in messages if m["role"] != "system"]
+
+
+def test_everything_fits(user_id):
+    conv_id = conversations.create_conversation(user_id)
+    conv = _fill(conv_id, user_id, 4)
+    messages = conversations.build_context(conv)
+    assert messages[0] == {"role": "system", "content": conversations.DEFAULT_SYSTEM_PROMPT}
+    assert _contents(messages) == [_turn(n) for n in range(4)]
+
+
+def test_oldest_turns_fall_out_of_the_budget(user_id):
+    conv_id = conversations.create_conversation(user_id)
+    conv = _fill(conv_id, user_id, 10)
+    system = estimate_tokens(conversations.DEFAULT_SYSTEM_PROMPT)
+    budget = system + 3 * estimate_tokens(_turn(0))
+    assert _contents(conversations.build_context(conv, budget)) == [_turn(n) for n in (7, 8, 9)]
+
+
+def test_newest_turn_kept_even_over_budget(user_id):
+    conv_id = conversations.create_conversation(user_id)
+    conv = _fill(conv_id, user_id, 3, size=4000)
+    assert _contents(conversations.build_context(conv, budget=10)) == [_turn(2, 4000)]
+
+
+def test_append_returns_only_the_tail(user_id, monkeypatch):
+    monkeypatch.setattr(conversations, "CHAT_HISTORY_TAIL", 5)
+    conv_id = conversations.create_conversation(user_id)
+    conv = _fill(conv_id, user_id, 12)
+    assert conv["message_count"] == 12
+    assert _contents(conv["messages"]) == [_turn(n) for n in range(7, 12)]
+    # The tail's offset puts each message at its position in the whole conversation
+    full = conversations.get_conversation(conv_id, user_id)
+    budget = estimate_tokens(conversations.DEFAULT_SYSTEM_PROMPT) + 3 * estimate_tokens(_turn(0))
+    assert conversations.build_context(conv, budget) == conversations.build_context(full, budget)
+
+
+def test_append_to_unknown_conversation(user_id):
+    assert conversations.append_message("missing", user_id, "user", "hi") is None
+    conv_id = conversations.create_conversation(user_id)
+    assert conversations.append_message(conv_id, "someone-else", "user", "hi") is None
+
+
+def test_legacy_conversation_gets_a_message_count(user_id):
+    conv_id = uuid.uuid4().hex
+    conversations.conversations.insert_one({
+        "_id": conv_id, "user_id": user_id, "system": "s",
+        "messages": [{"role": "user", "content": "a"}, {"role": "assistant", "content": "b"}],
+        "summary": "", "summarized_upto": 0,
+    })
+    conv = conversations.append_message(conv_id, user_id, "user", "c")
+    assert conv["message_count"] == 3
+    assert _contents(conv["messages"]) == ["a", "b", "c"]
+
+
+def test_fold_summarizes_and_trims(user_id, inline_folds):
+    conv_id = conversations.create_conversation(user_id)
+    conv = _fill(conv_id, user_id, 10)
+    seen = []
+
+    def summarize(summary, turns):
+        seen.append(_contents(turns))
+        return "summary of " + ",".join(t["content"][:4] for t in turns)
+
+    budget = estimate_tokens(conversations.DEFAULT_SYSTEM_PROMPT) + 4 * estimate_tokens(_turn(0))
+    conversations.build_context(conv, budget, summarize)
+
+    # Everything older than half the budget (2 turns) was folded in one go
+    assert seen == [[_turn(n) for n in range(8)]]
+    stored = conversations.get_conversation(conv_id, user_id)
+    assert stored["summarized_upto"] == 8
+    assert stored["first_index"] == 8
+    assert stored["message_count"] == 10
+    assert _contents(stored["messages"]) == [_turn(8), _turn(9)]
+
+    conv = conversations.append_message(conv_id, user_id, "user", _turn(10))
+    messages = conversations.build_context(conv, budget + estimate_tokens(stored["summary"]), summarize)
+    assert messages[1]["content"].endswith(stored["summary"])
+    assert _contents(messages) == [_turn(n) for n in (8, 9, 10)]
+    assert len(seen) == 1
+
+
+def test_second_fold_reads_from_the_trimmed_front(user_id, inline_folds):
+    conv_id = conversations.create_conversation(user_id)
+    conv = _fill(conv_id, user_id, 10)
+    seen = []
+
+    def summarize(summary, turns):
+        seen.append(_contents(turns))
+        return (summary + "|" if summary else "") + "s"
+
+    per_turn = estimate_tokens(_turn(0))
+    budget = estimate_tokens(conversations.DEFAULT_SYSTEM_PROMPT) + 4 * per_turn
+    conversations.build_context(conv, budget, summarize)
+    conv = _fill(conv_id, user_id, 6, start=10)
+    conversations.build_context(conv, budget + estimate_tokens("s"), summarize)
+
+    assert seen[1][0] == _turn(8)
+    stored = conversations.get_conversation(conv_id, user_id)
+    assert stored["summary"] == "s|s"
+    assert stored["first_index"] == stored["summarized_upto"]
+    assert _contents(stored["messages"]) == [_turn(n) for n in range(stored["first_index"], 16)]
+
+
+def test_trim_skipped_when_a_turn_was_appended(user_id):
+    conv_id = conversations.create_conversation(user_id)
+    _fill(conv_id, user_id, 6)
+    conversations.conversations.update_one({"_id": conv_id}, {"$set": {"summarized_upto": 4}})
+
+    collection = conversations.conversations
+    real_find_one = collection.find_one
+
+    def find_one_then_append(*args, **kwargs):
+        # A turn is appended between _trim's read and its conditional update
+        doc = real_find_one(*args, **kwargs)
+        del collection.find_one
+        conversations.append_message(conv_id, user_id, "user", "late")
+        return doc
+
+    collection.find_one = find_one_then_append
+    conversations._trim(conv_id, 4)
+
+    stored = conversations.get_conversation(conv_id, user_id)
+    assert stored["first_index"] == 0
+    assert len(stored["messages"]) == 7
@@ -0,0 +1,161 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import limits
+import metrics
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable clock for limits (the time module itself is left alone)."""
+    now = [1000.0]
+    monkeypatch.setattr(limits, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_token_bucket_burst_then_refill(clock):
+    bucket = limits.TokenBucket(rate=2, burst=3)
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    assert bucket.take() == pytest.approx(0.5)
+    clock[0] += 0.5
+    assert bucket.take() == 0
+
+
+def test_check_rate_is_per_user_and_bucket(monkeypatch):
+    monkeypatch.setitem(limits.RATE_LIMITS, "chat", "0/2")
+    assert limits.check_rate("rate-a", "chat") == 0
+    assert limits.check_rate("rate-a", "chat") == 0
+    assert limits.check_rate("rate-a", "chat") > 0
+    assert limits.check_rate("rate-b", "chat") == 0
+
+
+def test_limiter_sheds_at_limit(monkeypatch):
+    monkeypatch.setattr(limits, "PROVIDER_LIMIT_INITIAL", 2)
+    limiter = limits.AdaptiveLimiter("test")
+    assert limiter.try_acquire() == (0, None)
+    assert limiter.try_acquire() == (0, None)
+    assert limiter.check() == 1.0
+    assert limiter.try_acquire() == (1.0, None)
+    limiter.release()
+    assert limiter.try_acquire() == (0, None)
+
+
+def test_limiter_aimd(monkeypatch):
+    monkeypatch.setattr(limits, "PROVIDER_LIMIT_INITIAL", 10)
+    limiter = limits.AdaptiveLimiter("test")
+    limiter.on_result(True, 0.1)
+    assert limiter.limit == pytest.approx(10.1)
+    limiter.on_result(True, limits.PROVIDER_LATENCY_TARGET + 1)
+    assert limiter.limit == pytest.approx(10.1 * 0.7)
+    for _ in range(20):
+        limiter.on_result(True, limits.PROVIDER_LATENCY_TARGET + 1)
+    assert limiter.limit == limits.PROVIDER_LIMIT_MIN
+
+
+def test_breaker_opens_probes_and_closes(clock):
+    limiter = limits.AdaptiveLimiter("test")
+    for _ in range(limits.BREAKER_FAILURES):
+        limiter.on_result(False, 0.1)
+    assert limiter.state == "open"
+    retry_after, probe = limiter.try_acquire()
+    assert retry_after == pytest.approx(limits.BREAKER_COOLDOWN) and probe is None
+
+    clock[0] += limits.BREAKER_COOLDOWN
+    assert limiter.state == "half_open"
+    retry_after, probe = limiter.try_acquire()
+    assert retry_after == 0 and probe is not None
+    # Only one probe at a time
+    assert limiter.try_acquire() == (1.0, None)
+
+    limiter.on_result(True, 0.1)
+    limiter.release(probe)
+    assert limiter.state == "closed"
+    assert limiter.try_acquire()[0] == 0
+
+
+def test_failed_probe_reopens(clock):
+    limiter = limits.AdaptiveLimiter("test")
+    for _ in range(limits.BREAKER_FAILURES):
+        limiter.on_result(False, 0.1)
+    clock[0] += limits.BREAKER_COOLDOWN
+    _, probe = limiter.try_acquire()
+    limiter.on_result(False, 0.1)
+    limiter.release(probe)
+    assert limiter.state == "open"
+    assert limiter.check() == pytest.approx(limits.BREAKER_COOLDOWN)
+
+
+def test_unused_probe_is_freed_only_by_its_holder(clock):
+    limiter = limits.AdaptiveLimiter("test")
+    for _ in range(limits.BREAKER_FAILURES):
+        limiter.on_result(False, 0.1)
+    clock[0] += limits.BREAKER_COOLDOWN
+    _, probe = limiter.try_acquire()
+    # Another request's release leaves the probe in place
+    limiter.release(None)
+    assert limiter.try_acquire() == (1.0, None)
+    # A probe that never reached the provider hands the probe slot back
+    limiter.release(probe)
+    assert limiter.try_acquire()[1] is not None
+
+
+def test_acquire_all_or_nothing(monkeypatch):
+    monkeypatch.setattr(limits, "_limiters", {})
+    monkeypatch.setattr(limits, "PROVIDER_LIMIT_INITIAL", 1)
+    busy = limits.limiter("busy")
+    busy.try_acquire()
+    held, retry_after = limits.acquire(["free", "busy"])
+    assert held == [] and retry_after == 1.0
+    assert limits.limiter("free").in_flight == 0
+
+
+def test_slot_waits_for_release(monkeypatch):
+    monkeypatch.setattr(limits, "_limiters", {})
+    monkeypatch.setattr(limits, "PROVIDER_LIMIT_INITIAL", 1)
+    instance = limits.limiter("slow")
+    instance.try_acquire()
+    threading.Timer(0.05, instance.release).start()
+    with limits.slot("slow", timeout=2):
+        assert instance.in_flight == 1
+    assert instance.in_flight == 0
+
+
+def test_slot_raises_provider_busy(monkeypatch):
+    monkeypatch.setattr(limits, "_limiters", {})
+    monkeypatch.setattr(limits, "PROVIDER_LIMIT_INITIAL", 1)
+    limits.limiter("slow").try_acquire()
+    with pytest.raises(limits.ProviderBusy):
+        with limits.slot("slow", timeout=0.01):
+            pass
+
+
+def test_only_provider_failures_trip_the_breaker(monkeypatch):
+    monkeypatch.setattr(limits, "_limiters", {})
+
+    class ClientError(Exception):
+        status_code = 400
+
+    class ServerError(Exception):
+        status_code = 503
+
+    for _ in range(limits.BREAKER_FAILURES):
+        with pytest.raises(ClientError):
+            with metrics.upstream("flaky"):
+                raise ClientError()
+    assert limits.limiter("flaky").state == "closed"
+
+    for _ in range(limits.BREAKER_FAILURES):
+        with pytest.raises(ServerError):
+            with metrics.upstream("flaky"):
+                raise ServerError()
+    assert limits.limiter("flaky").state == "open"
+
+
+def test_route_sheds_with_retry_after(client, monkeypatch):
+    monkeypatch.setattr(limits, "_buckets", limits.LRUCache(max_items=10))
+    monkeypatch.setitem(limits.RATE_LIMITS, "chat", "0/0")
+    resp = client.post("/chat", json={"message": "hello"})
+    assert resp.status_code == 429
+    assert int(resp.headers["Retry-After"]) >= 1
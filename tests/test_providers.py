@@ -0,0 +1,20 @@
+import base64
+
+import pytest
+
+import providers
+
+
+def test_sarvam_base_url(monkeypatch, fake_upstream):
+    pytest.importorskip("sarvamai")
+    import tts
+    wav = b"RIFF....WAVEfmt "
+    url = fake_upstream(lambda path, headers, body: (200, {"request_id": "t", "audios": [base64.b64encode(wav).decode()]}))
+    monkeypatch.setenv("SARVAM_API_KEY", "test")
+    monkeypatch.setenv("SARVAM_BASE_URL", url)
+    monkeypatch.delitem(providers._instances, "sarvam", raising=False)
+
+    audio = tts.synthesize(providers.get("sarvam"), "नमस्ते", "anushka", "hi-IN", {})
+
+    assert audio == wav
+    assert fake_upstream.received[0][0] == "/text-to-speech"
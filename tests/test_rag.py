@@ -0,0 +1,33 @@
+import io
+
+import pytest
+
+
+@pytest.fixture
+def rag_upstream(monkeypatch, fake_upstream):
+    import rag
+    monkeypatch.setattr(rag, "RAG_BACKEND", "remote")
+    monkeypatch.setattr(rag, "RAG_API_URL", fake_upstream(lambda path, headers, body: (200, {"message": "Document uploaded"})))
+    return fake_upstream.received
+
+
+def test_upload_doc_remote_multipart(client, rag_upstream):
+    resp = client.post("/upload_doc", data={"file": (io.BytesIO(b"%PDF-1.4 hello"), "doc.pdf")},
+                       content_type="multipart/form-data")
+    assert resp.status_code // 100 == 2, resp.get_data(as_text=True)
+    path, headers, body = rag_upstream[0]
+    assert path == "/upload_doc"
+    assert headers["Content-Type"].startswith("multipart/form-data; boundary=")
+    assert b'filename="doc.pdf"' in body and b"%PDF-1.4 hello" in body
+
+
+def test_upload_doc_remote_raw_body(client, rag_upstream):
+    resp = client.post("/upload_doc", data=b"%PDF-1.4 raw", content_type="application/pdf",
+                       headers={"X-Filename": "raw.pdf"})
+    assert resp.status_code // 100 == 2, resp.get_data(as_text=True)
+    assert b"%PDF-1.4 raw" in rag_upstream[0][2]
+
+
+def test_normalize_question():
+    from rag import normalize_question
+    assert normalize_question("  What is  RAG?? ") == normalize_question("what is rag")
@@ -0,0 +1,79 @@
+import random
+import re
+
+import pytest
+
+import transcription
+from transcription import TranscriptNormalizer, clean_marathi_text, normalize_tokens
+
+WORDS = ["नमस्कार", "आज", "बैठक", "सुरू", "धन्यवाद", "meeting", "project", "okay", "AI", "team"]
+PUNCTUATION = [".", ",", "?", "!", "...", "..", '"', "“", "”"]
+SPACING = [" ", " ", "  ", "\n", "\t", " \n ", ""]
+
+
+def _legacy_clean(text):
+    """clean_marathi_text before the single-pass normalizer."""
+    text = re.sub(r'\.{2,}', '.', text)
+    text = re.sub(r'([.!?,"“”])([^\s])', r'\1 \2', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+
+def _legacy_pipeline(tokens):
+    """Join, clean in get_transcript, collapse whitespace, clean again in the route."""
+    text = _legacy_clean("".join(token["text"] for token in tokens))
+    return _legacy_clean(re.sub(r'\s+', ' ', text).strip())
+
+
+def _tokens(count, seed):
+    rng = random.Random(seed)
+    tokens = []
+    for _ in range(count):
+        word = rng.choice(WORDS)
+        if rng.random() < 0.3:
+            word += rng.choice(PUNCTUATION)
+        if rng.random() < 0.05:
+            word = rng.choice(PUNCTUATION) + word
+        word += rng.choice(SPACING)
+        # Soniox splits words into several tokens
+        cut = rng.randint(1, max(1, len(word) - 1))
+        tokens += [{"text": piece} for piece in (word[:cut], word[cut:]) if piece]
+    return tokens
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_legacy_pipeline(seed):
+    tokens = _tokens(500, seed)
+    assert normalize_tokens(tokens) == _legacy_pipeline(tokens)
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 7, 64])
+def test_block_boundaries_do_not_change_output(monkeypatch, block_size):
+    monkeypatch.setattr(TranscriptNormalizer, "BLOCK_SIZE", block_size)
+    monkeypatch.setattr(transcription, "TOKEN_BATCH_SIZE", 3)
+    for seed in range(5):
+        tokens = _tokens(300, seed)
+        assert normalize_tokens(tokens) == _legacy_pipeline(tokens)
+
+
+@pytest.mark.parametrize("text", [
+    "", "   ", "...", "a...b", "a. . .b", "hi,there!how?are\"you“ok”",
+    "नमस्कार..आज  \n\tबैठक", "end.", " leading and trailing ", "a b", "x!!!y",
+])
+def test_edge_cases(text):
+    expected = _legacy_pipeline([{"text": text}])
+    assert clean_marathi_text(text) == expected
+    assert normalize_tokens([{"text": ch} for ch in text]) == expected
+
+
+def test_matches_legacy_on_punctuation_runs():
+    # Dense punctuation and whitespace, where the old chain needed its second pass
+    rng = random.Random(0)
+    for _ in range(5000):
+        text = "".join(rng.choice('ab.!?,"“” \n\t') for _ in range(rng.randint(0, 12)))
+        assert clean_marathi_text(text) == _legacy_pipeline([{"text": text}]), repr(text)
+
+
+def test_idempotent():
+    text = normalize_tokens(_tokens(500, 99))
+    assert clean_marathi_text(text) == text
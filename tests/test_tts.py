@@ -0,0 +1,134 @@
+import io
+import time
+import threading
+import wave
+from types import SimpleNamespace
+
+import pytest
+
+import tts
+from tts import TTSError, split_text, stitch_wav
+
+
+def _wav(frames: bytes, rate=22050, channels=1) -> bytes:
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(frames)
+    return out.getvalue()
+
+
+def _frames(wav_bytes: bytes) -> bytes:
+    with wave.open(io.BytesIO(wav_bytes)) as w:
+        return w.readframes(w.getnframes())
+
+
+class FakeSarvam:
+    """Returns one WAV per call whose samples spell the chunk text."""
+
+    def __init__(self, gate=None):
+        self.calls = []
+        self.gate = gate
+        self.text_to_speech = SimpleNamespace(convert=self.convert)
+
+    def convert(self, text, **kwargs):
+        if self.gate is not None:
+            self.gate.wait(2)
+        self.calls.append(text)
+        return SimpleNamespace(audios=[_wav_of(text)])
+
+
+def _wav_of(text):
+    samples = text.encode("utf-8")
+    return _wav(samples + b"\0" * (len(samples) % 2))
+
+
+def test_split_text_keeps_sentences_together():
+    text = "One. Two! Three? Four."
+    assert split_text(text, max_chars=10) == ["One. Two!", "Three?", "Four."]
+    assert split_text(text, max_chars=100) == [text]
+
+
+def test_split_text_cuts_long_sentences_at_spaces():
+    assert split_text("aaaa bbbb cccc dddd", max_chars=9) == ["aaaa", "bbbb", "cccc dddd"]
+    assert split_text("x" * 25, max_chars=10) == ["x" * 10, "x" * 10, "x" * 5]
+
+
+def test_split_text_blank():
+    assert split_text("") == []
+    assert split_text(" \n\t " * 500) == []
+
+
+def test_stitch_wav_concatenates_audio():
+    parts = [b"\x01\x00" * 10, b"\x02\x00" * 5, b"\x03\x00" * 7]
+    stitched = stitch_wav([_wav(p) for p in parts])
+    assert _frames(stitched) == b"".join(parts)
+    with wave.open(io.BytesIO(stitched)) as w:
+        assert (w.getframerate(), w.getnchannels()) == (22050, 1)
+
+
+def test_stitch_wav_rejects_mixed_formats():
+    with pytest.raises(TTSError):
+        stitch_wav([_wav(b"\x00\x00", rate=22050), _wav(b"\x00\x00", rate=16000)])
+
+
+def test_stitch_wav_rejects_non_wav_and_empty():
+    with pytest.raises(TTSError):
+        stitch_wav([b"not a wav file"])
+    with pytest.raises(TTSError):
+        stitch_wav([])
+
+
+def test_parse_wav_unknown_data_size():
+    data = b"\x05\x00" * 8
+    header = tts.wav_header(tts.parse_wav(_wav(data))[0], None)
+    assert bytes(tts.parse_wav(header + data)[1]) == data
+
+
+# Several TTS_CHUNK_CHARS chunks
+LONG_TEXT = " ".join(f"This is sentence number {n}." for n in range(100))
+
+
+def test_synthesize_long_stitches_in_order():
+    sarvam = FakeSarvam()
+    text = LONG_TEXT
+    audio = tts.synthesize_long(sarvam, text, "anushka", "hi-IN", {})
+    chunks = split_text(text)
+    assert len(chunks) > 1
+    assert sorted(sarvam.calls) == sorted(chunks)
+    assert _frames(audio) == b"".join(_frames(_wav_of(c)) for c in chunks)
+
+
+def test_stream_long_rejects_blank_text():
+    with pytest.raises(TTSError):
+        tts.stream_long(FakeSarvam(), "   " * 1000, "anushka", "hi-IN", {}, key="blank")
+    assert "blank" not in tts._live
+
+
+def test_stream_long_shares_one_synthesis():
+    gate = threading.Event()
+    sarvam = FakeSarvam(gate)
+    completed = []
+    text = LONG_TEXT
+    first = tts.stream_long(sarvam, text, "anushka", "hi-IN", {}, on_complete=completed.append, key="shared")
+    second = tts.stream_long(sarvam, text, "anushka", "hi-IN", {}, on_complete=completed.append, key="shared")
+    gate.set()
+    a, b = b"".join(first), b"".join(second)
+    # on_complete runs on the worker that finished the last chunk
+    deadline = time.monotonic() + 2
+    while "shared" in tts._live and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert a == b
+    assert len(sarvam.calls) == len(split_text(text))
+    assert len(completed) == 1 and _frames(completed[0]) == _frames(tts.stitch_wav(
+        [_wav_of(c) for c in split_text(text)]))
+    assert "shared" not in tts._live
+
+
+def test_tts_route_rejects_blank_text(client):
+    for text in ("", "   ", " \n" * 2000):
+        resp = client.post("/tts", json={"text": text})
+        assert resp.status_code == 400, text
@@ -1,57 +1,204 @@
 import os
 import time
+import hashlib
 import requests
 from typing import Optional
+from itertools import islice
 from dotenv import load_dotenv
 import re
+from upstream import get_session, MultipartUpload, HashingReader, UPLOAD_CHUNK_SIZE
+from cache import TieredCache, content_key
+import metrics
 # Load environment variables from .env file
 load_dotenv()
 
-SONIOX_API_BASE_URL = "https://api.soniox.com"
+SONIOX_API_BASE_URL = os.getenv("SONIOX_API_BASE_URL", "https://api.soniox.com")
 SONIOX_API_KEY = os.getenv("SONIOX_API_KEY")
 
+# Polling: start fast, back off for long recordings, give up after the deadline
+POLL_INITIAL_INTERVAL = float(os.getenv("TRANSCRIBE_POLL_INITIAL", "1"))
+POLL_MAX_INTERVAL = float(os.getenv("TRANSCRIBE_POLL_MAX", "15"))
+POLL_BACKOFF = 1.5
+TRANSCRIBE_DEADLINE = float(os.getenv("TRANSCRIBE_DEADLINE", "1800"))
+
+# Everything that changes the transcript output; part of the cache key
+TRANSCRIPTION_CONFIG = {
+    "model": "stt-async-preview",
+    "language_hints": ['en', 'es', 'hi', 'mr'],
+    "enable_language_identification": True,
+    "enable_speaker_diarization": True,
+    "context": "",
+}
+
+# Transcript cache keyed by audio hash + config; on disk so it survives restarts
+# and is shared by all workers. Set TRANSCRIPT_CACHE_DIR="" to keep it in memory only.
+TRANSCRIPT_CACHE_DIR = os.getenv("TRANSCRIPT_CACHE_DIR", os.path.join("cache", "transcripts"))
+TRANSCRIPT_CACHE_TTL = float(os.getenv("TRANSCRIPT_CACHE_TTL", str(30 * 24 * 3600)))
+TRANSCRIPT_CACHE_SIZE = int(os.getenv("TRANSCRIPT_CACHE_SIZE", "256"))
+
+transcript_cache = TieredCache(
+    max_items=TRANSCRIPT_CACHE_SIZE,
+    directory=TRANSCRIPT_CACHE_DIR or None,
+    ttl=TRANSCRIPT_CACHE_TTL,
+)
+metrics.register_cache("transcripts", transcript_cache)
+
+
+# Transcript normalization in a single compiled pass. One pattern does the work of the
+# old chain of re.sub calls (collapse runs of dots, add a space after punctuation,
+# collapse whitespace): every match is a punctuation mark or dot run plus any whitespace
+# after it, or a whitespace run that isn't already a lone space, and is replaced by the
+# mark followed by exactly one space. Ordinary words are skipped at C speed.
+#
+# Add space between Marathi or English words that are joined together accidentally
+# NOTE: The original regex here was inserting spaces between EVERY pair of characters,
+# which would break words (e.g., "hello" -> "h e l l o"). I've fixed it to only insert
+# between script changes (Devanagari to Latin or vice versa) for true mixed-script fixes.
+# If you need full word splitting for no-space languages, adjust further.
+#text = re.sub(r'([अ-हक-ळऴवशषसज्ञ])([a-zA-Z])|([a-zA-Z])([अ-हक-ळऴवशषसज्ञ])', r'\1 \2', text)
+_PUNCTUATION = '.!?,"“”'
+_NORMALIZE_RE = re.compile(r'\.+\s*|[!?,"“”]\s*|[^\S ]\s*| \s+')
+_REPLACEMENTS = {mark: mark + " " for mark in _PUNCTUATION}
+TOKEN_BATCH_SIZE = 4096
+
+
+def _normalize_match(m) -> str:
+    return _REPLACEMENTS.get(m.group()[0], " ")
+
 
 def clean_marathi_text(text: str) -> str:
     """
     Cleans Marathi text by fixing missing spaces between words and removing unwanted dots.
+    Idempotent, so cleaning an already cleaned transcript is a no-op.
+    """
+    return _NORMALIZE_RE.sub(_normalize_match, text).strip()
+
+
+class TranscriptNormalizer:
     """
-    # Remove excessive dots or unnecessary characters
-    text = re.sub(r'\.{2,}', '.', text)
-    
-    # Add a space after punctuation (if missing)
-    text = re.sub(r'([.!?,"“”])([^\s])', r'\1 \2', text)
-    
-    # Add space between Marathi or English words that are joined together accidentally
-    # NOTE: The original regex here was inserting spaces between EVERY pair of characters,
-    # which would break words (e.g., "hello" -> "h e l l o"). I've fixed it to only insert
-    # between script changes (Devanagari to Latin or vice versa) for true mixed-script fixes.
-    # If you need full word splitting for no-space languages, adjust further.
-    #text = re.sub(r'([अ-हक-ळऴवशषसज्ञ])([a-zA-Z])|([a-zA-Z])([अ-हक-ळऴवशषसज्ञ])', r'\1 \2', text)
-    
-    # Remove double spaces (now safe after the above)
-    text = re.sub(r'\s+', ' ', text)
-    
-    # Trim spaces at start and end
-    text = text.strip()
-    
-    return text
+    Incremental clean_marathi_text: feed() text as tokens are joined, then finish().
+    Text is normalized in blocks cut after the last ordinary character, since a match
+    only ever spans punctuation and whitespace.
+    """
+
+    BLOCK_SIZE = 64 * 1024
+
+    def __init__(self):
+        self._raw = []
+        self._raw_len = 0
+        self._out = []
+
+    def feed(self, text: str):
+        self._raw.append(text)
+        self._raw_len += len(text)
+        if self._raw_len >= self.BLOCK_SIZE:
+            self._flush(final=False)
+
+    def _flush(self, final: bool):
+        buf = "".join(self._raw)
+        cut = len(buf)
+        if not final:
+            # Hold back trailing punctuation/whitespace; the next token may extend it
+            while cut and (buf[cut - 1] in _PUNCTUATION or buf[cut - 1].isspace()):
+                cut -= 1
+        if cut:
+            self._out.append(_NORMALIZE_RE.sub(_normalize_match, buf[:cut]))
+        rest = buf[cut:]
+        self._raw = [rest]
+        self._raw_len = len(rest)
+
+    def finish(self) -> str:
+        self._flush(final=True)
+        return "".join(self._out).strip()
+
+
+def normalize_tokens(tokens) -> str:
+    """Join Soniox tokens without adding spaces, cleaning the text as it is joined."""
+    normalizer = TranscriptNormalizer()
+    tokens = iter(tokens)
+    while True:
+        batch = list(islice(tokens, TOKEN_BATCH_SIZE))
+        if not batch:
+            return normalizer.finish()
+        normalizer.feed("".join(token["text"] for token in batch))
+
+
+def upload_stream(session: requests.Session, stream, filename: str,
+                  content_type: Optional[str] = None, size: Optional[int] = None) -> str:
+    """Stream a file-like object to Soniox in chunks and return file_id."""
+    body = MultipartUpload(stream, filename, content_type, size)
+    res = session.post(
+        f"{SONIOX_API_BASE_URL}/v1/files",
+        data=body if body.len is not None else iter(body),
+        headers={"Content-Type": body.content_type},
+    )
+    res.raise_for_status()
+    return res.json()["id"]
+
+
+def _hash_seekable(stream) -> Optional[str]:
+    """SHA-256 of a seekable stream (rewound afterwards), or None if it can't seek."""
+    seekable = getattr(stream, "seekable", None)
+    if seekable is None or not seekable():
+        return None
+    start = stream.tell()
+    h = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b""):
+        h.update(chunk)
+    stream.seek(start)
+    return h.hexdigest()
+
+
+def transcript_cache_key(audio_digest: str) -> str:
+    # "v2": transcripts are cached already normalized by TranscriptNormalizer
+    return content_key(audio_digest, TRANSCRIPTION_CONFIG, "v2")
+
+
+def delete_file(session: requests.Session, file_id: str):
+    """Best-effort removal of an uploaded file we no longer need."""
+    try:
+        session.delete(f"{SONIOX_API_BASE_URL}/v1/files/{file_id}")
+    except requests.RequestException:
+        pass
+
+
+def upload_for_transcription(session: requests.Session, stream, filename: str,
+                             content_type: Optional[str] = None, size: Optional[int] = None,
+                             use_cache: bool = True):
+    """
+    Upload audio unless its transcript is already cached.
+    Seekable streams are hashed before uploading, so a hit costs no upload at all;
+    other streams are hashed while they upload and the cache is checked afterwards.
+    Returns (cache_key, cached_transcript, file_id); exactly one of the last two is set.
+    """
+    digest = _hash_seekable(stream)
+    if digest is not None:
+        key = transcript_cache_key(digest)
+        cached = transcript_cache.get(key) if use_cache else None
+        if cached is not None:
+            return key, cached, None
+        return key, None, upload_stream(session, stream, filename, content_type, size)
+
+    reader = HashingReader(stream)
+    file_id = upload_stream(session, reader, filename, content_type, size)
+    key = transcript_cache_key(reader.hexdigest())
+    cached = transcript_cache.get(key) if use_cache else None
+    if cached is not None:
+        delete_file(session, file_id)
+        return key, cached, None
+    return key, None, file_id
+
 
 def upload_file(session: requests.Session, filepath: str) -> str:
     """Upload a local audio/video file to Soniox and return file_id."""
     with open(filepath, "rb") as f:
-        res = session.post(f"{SONIOX_API_BASE_URL}/v1/files", files={"file": f})
-    res.raise_for_status()
-    return res.json()["id"]
+        return upload_stream(session, f, os.path.basename(filepath), size=os.path.getsize(filepath))
 
 
 def create_transcription(session: requests.Session, audio_url: Optional[str], file_id: Optional[str]) -> str:
     """Create a transcription for a given file_id or audio_url, return transcription_id."""
     config = {
-        "model": "stt-async-preview",
-        "language_hints": ['en', 'es', 'hi', 'mr'],
-        "enable_language_identification": True,
-        "enable_speaker_diarization": True,
-        "context": "",
+        **TRANSCRIPTION_CONFIG,
         "client_reference_id": "FlaskApp",
         "audio_url": audio_url,
         "file_id": file_id
@@ -61,8 +208,17 @@ def create_transcription(session: requests.Session, audio_url: Optional[str], fi
     return res.json()["id"]
 
 
-def wait_for_completion(session: requests.Session, transcription_id: str):
-    """Poll Soniox API until transcription is completed."""
+def wait_for_completion(session: requests.Session, transcription_id: str,
+                        deadline: Optional[float] = None, on_poll=None):
+    """
+    Poll Soniox API until transcription is completed.
+    The interval grows from POLL_INITIAL_INTERVAL to POLL_MAX_INTERVAL; TimeoutError is
+    raised once `deadline` (a time.time() timestamp) would be passed.
+    `on_poll(status)` is called after every non-final poll.
+    """
+    if deadline is None:
+        deadline = time.time() + TRANSCRIBE_DEADLINE
+    interval = POLL_INITIAL_INTERVAL
     while True:
         res = session.get(f"{SONIOX_API_BASE_URL}/v1/transcriptions/{transcription_id}")
         res.raise_for_status()
@@ -71,38 +227,53 @@ def wait_for_completion(session: requests.Session, transcription_id: str):
             return
         elif status == "error":
             raise Exception(res.json().get("error_message", "Unknown error"))
-        time.sleep(1)
+        if on_poll:
+            on_poll(status)
+        if time.time() + interval > deadline:
+            raise TimeoutError(f"Transcription {transcription_id} did not finish before the deadline")
+        time.sleep(interval)
+        interval = min(interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
 
 
 def get_transcript(session: requests.Session, transcription_id: str) -> str:
     """Get the transcript text from Soniox and clean extra spaces."""
     res = session.get(f"{SONIOX_API_BASE_URL}/v1/transcriptions/{transcription_id}/transcript")
     res.raise_for_status()
-    tokens = res.json().get("tokens", [])
-    
-    # Join tokens properly without adding unnecessary spaces
-    text = "".join(token["text"] for token in tokens)
-    
-    # Clean up extra spaces for Marathi or other languages
-    text = clean_marathi_text(text)
-    
-    # Remove multiple spaces for English/other languages too
-    text = re.sub(r'\s+', ' ', text).strip()
-    
-    return text
-
+    return normalize_tokens(res.json().get("tokens", []))
 
 
-def transcribe_file(filepath: str) -> str:
-    """Main helper to transcribe a local audio/video file."""
+def soniox_session() -> requests.Session:
+    """Shared, authenticated Soniox session."""
     if not SONIOX_API_KEY:
         raise RuntimeError("Missing SONIOX_API_KEY in environment variables.")
+    return get_session("soniox", headers={"Authorization": f"Bearer {SONIOX_API_KEY}"})
+
 
-    session = requests.Session()
-    session.headers["Authorization"] = f"Bearer {SONIOX_API_KEY}"
+def transcribe_file(filepath: str) -> str:
+    """Main helper to transcribe a local audio/video file."""
+    session = soniox_session()
 
     file_id = upload_file(session, filepath)
     transcription_id = create_transcription(session, None, file_id)
     wait_for_completion(session, transcription_id)
     transcript = get_transcript(session, transcription_id)
     return transcript
+
+
+def transcribe_stream(stream, filename: str, content_type: Optional[str] = None,
+                      size: Optional[int] = None, use_cache: bool = True) -> str:
+    """
+    Transcribe an upload straight from its stream, without writing it to disk.
+    Identical audio with the same config is served from transcript_cache; pass
+    use_cache=False to force a fresh transcription (the result still refreshes the cache).
+    """
+    session = soniox_session()
+
+    key, cached, file_id = upload_for_transcription(session, stream, filename, content_type, size, use_cache)
+    if cached is not None:
+        return cached
+    transcription_id = create_transcription(session, None, file_id)
+    wait_for_completion(session, transcription_id)
+    transcript = get_transcript(session, transcription_id)
+    transcript_cache.set(key, transcript)
+    return transcript
@@ -0,0 +1,166 @@
+import os
+import time
+import uuid
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import ReturnDocument
+from mongodb import db
+import limits
+from transcription import (
+    soniox_session, create_transcription, wait_for_completion,
+    get_transcript, transcript_cache, TRANSCRIBE_DEADLINE,
+)
+
+jobs = db['transcription_jobs']
+
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", "4"))
+# A job is owned by one process while its lease is fresh; expired leases are picked
+# up again, so jobs survive a worker restart or crash.
+JOB_LEASE_SECONDS = int(os.getenv("TRANSCRIBE_JOB_LEASE", "60"))
+
+ACTIVE_STATES = ("queued", "processing")
+
+_executor = ThreadPoolExecutor(max_workers=TRANSCRIBE_WORKERS, thread_name_prefix="transcribe")
+# Jobs queued or running in this process; their leases are renewed by the sweeper
+_local_jobs = set()
+_sweeper_started = False
+_sweeper_lock = threading.Lock()
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _update(job_id: str, **fields):
+    fields["updated_at"] = _now()
+    jobs.update_one({"_id": job_id}, {"$set": fields})
+
+
+def _renew_lease(job_id: str, status: str = None):
+    fields = {"lease_until": time.time() + JOB_LEASE_SECONDS}
+    if status:
+        fields["upstream_status"] = status
+    _update(job_id, **fields)
+
+
+def _claim(job_id: str):
+    """Atomically take ownership of an active job whose lease has expired."""
+    return jobs.find_one_and_update(
+        {"_id": job_id, "status": {"$in": ACTIVE_STATES}, "lease_until": {"$lt": time.time()}},
+        {"$set": {"lease_until": time.time() + JOB_LEASE_SECONDS, "updated_at": _now()}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def _enqueue(job_id: str):
+    _local_jobs.add(job_id)
+    _executor.submit(_run_job, job_id)
+
+
+def submit_job(user_id: str, file_id: str = None, cache_key: str = None, cached_text: str = None) -> str:
+    """
+    Queue a transcription of a file already uploaded to Soniox and return the job id.
+    With `cached_text` the job is recorded as already completed and nothing is queued.
+    """
+    job_id = uuid.uuid4().hex
+    jobs.insert_one({
+        "_id": job_id,
+        "user_id": user_id,
+        "status": "completed" if cached_text is not None else "queued",
+        "file_id": file_id,
+        "cache_key": cache_key,
+        "transcription_id": None,
+        "text": cached_text,
+        "error": None,
+        "deadline": time.time() + TRANSCRIBE_DEADLINE,
+        "lease_until": time.time() + JOB_LEASE_SECONDS,
+        "created_at": _now(),
+        "updated_at": _now(),
+    })
+    if cached_text is None:
+        _enqueue(job_id)
+        start_sweeper()
+    return job_id
+
+
+def get_job(job_id: str, user_id: str):
+    """Return a user's job without the transcript body, or None."""
+    # Status polls after a restart are what revive the sweeper in a fresh worker
+    start_sweeper()
+    return jobs.find_one({"_id": job_id, "user_id": user_id}, {"text": 0})
+
+
+def get_job_result(job_id: str, user_id: str):
+    return jobs.find_one({"_id": job_id, "user_id": user_id}, {"status": 1, "text": 1, "error": 1})
+
+
+def _run_job(job_id: str):
+    """Drive one job through create -> poll -> fetch, recording progress in Mongo."""
+    job = jobs.find_one({"_id": job_id})
+    if not job or job["status"] not in ACTIVE_STATES:
+        _local_jobs.discard(job_id)
+        return
+    try:
+        session = soniox_session()
+        # The job counts against Soniox's concurrency limit for as long as it runs there
+        with limits.slot("soniox", timeout=max(job["deadline"] - time.time(), 0)):
+            transcription_id = job.get("transcription_id")
+            if not transcription_id:
+                transcription_id = create_transcription(session, None, job["file_id"])
+                _update(job_id, status="processing", transcription_id=transcription_id)
+
+            wait_for_completion(
+                session, transcription_id,
+                deadline=job["deadline"],
+                on_poll=lambda status: _renew_lease(job_id, status),
+            )
+            transcript = get_transcript(session, transcription_id)
+        if job.get("cache_key"):
+            transcript_cache.set(job["cache_key"], transcript)
+        _update(job_id, status="completed", text=transcript)
+    except Exception as e:
+        print(f"Transcription job {job_id} failed: {str(e)}")
+        _update(job_id, status="error", error=str(e))
+    finally:
+        _local_jobs.discard(job_id)
+
+
+def resume_jobs():
+    """Pick up active jobs whose owner stopped renewing the lease (e.g. a restarted worker)."""
+    stale = jobs.find(
+        {"status": {"$in": ACTIVE_STATES}, "lease_until": {"$lt": time.time()}},
+        {"_id": 1},
+    )
+    for job in stale:
+        if job["_id"] not in _local_jobs and _claim(job["_id"]):
+            _enqueue(job["_id"])
+
+
+def _renew_local_leases():
+    """Keep leases fresh for jobs still waiting in this process's queue."""
+    if _local_jobs:
+        jobs.update_many(
+            {"_id": {"$in": list(_local_jobs)}, "status": {"$in": ACTIVE_STATES}},
+            {"$set": {"lease_until": time.time() + JOB_LEASE_SECONDS}},
+        )
+
+
+def _sweep_forever():
+    while True:
+        try:
+            _renew_local_leases()
+            resume_jobs()
+        except Exception as e:
+            print("Transcription job sweep failed:", e)
+        time.sleep(JOB_LEASE_SECONDS / 3)
+
+
+def start_sweeper():
+    """Start the background thread that resumes orphaned jobs (once per process)."""
+    global _sweeper_started
+    with _sweeper_lock:
+        if _sweeper_started:
+            return
+        _sweeper_started = True
+    threading.Thread(target=_sweep_forever, name="transcribe-sweeper", daemon=True).start()
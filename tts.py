@@ -0,0 +1,327 @@
+import os
+import re
+import base64
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from cache import TieredCache, content_key
+import metrics
+
+# Everything except text/speaker/language that shapes the audio; part of the cache key
+TTS_DEFAULTS = {
+    "pitch": 0,
+    "pace": 1,
+    "loudness": 1,
+    "speech_sample_rate": 22050,
+    "enable_preprocessing": True,
+    "model": "bulbul:v2",
+}
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Long text is split on sentence boundaries into chunks of at most this many characters
+TTS_CHUNK_CHARS = int(os.getenv("TTS_CHUNK_CHARS", "500"))
+TTS_MAX_WORKERS = int(os.getenv("TTS_MAX_WORKERS", "8"))
+# Max simultaneous Sarvam calls across all requests in this process
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", "4"))
+
+_executor = ThreadPoolExecutor(max_workers=TTS_MAX_WORKERS, thread_name_prefix="tts")
+_sarvam_slots = threading.BoundedSemaphore(TTS_CONCURRENCY)
+
+# Parameters of long-form requests waiting to be streamed by key, shared by all workers
+TTS_PENDING_DIR = os.getenv("TTS_PENDING_DIR", os.path.join("cache", "tts_requests"))
+pending_requests = TieredCache(max_items=256, directory=TTS_PENDING_DIR or None, ttl=3600)
+
+_SENTENCE_BREAK_RE = re.compile(r'(?<=[.!?।॥])\s+|\n+')
+# Streamed WAVs don't know their final length; players accept the max value
+_UNKNOWN_SIZE = 0xFFFFFFFF
+
+
+class TTSError(Exception):
+    """Raised when synthesis or WAV stitching fails."""
+
+
+class AudioCache:
+    """
+    Content-addressed audio files in a directory, evicted least-recently-used by total bytes.
+    Files are written to a temp name and os.replace()d into place, so concurrent requests
+    (threads or processes) never see a half-written file or overwrite each other's audio.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = TTS_CACHE_MAX_BYTES,
+                 prefix: str = "tts-", suffix: str = ".wav"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def filename(self, key: str) -> str:
+        return f"{self.prefix}{key}{self.suffix}"
+
+    def is_cached_name(self, filename: str) -> bool:
+        return filename.startswith(self.prefix) and filename.endswith(self.suffix)
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached file name for key (marking it recently used), or None."""
+        path = os.path.join(self.directory, self.filename(key))
+        try:
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.filename(key)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": (self.hits / total) if total else 0.0}
+
+    def put(self, key: str, data: bytes) -> str:
+        """Store audio bytes under key and return the file name."""
+        name = self.filename(key)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp_", suffix=self.suffix)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, os.path.join(self.directory, name))
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.evict()
+        return name
+
+    def evict(self):
+        """Drop the least recently used files until the directory fits in max_bytes."""
+        with self._lock:
+            entries = []
+            total = 0
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not self.is_cached_name(entry.name):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            for _, size, path in entries:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+                if total <= self.max_bytes:
+                    return
+
+
+def tts_cache_key(text: str, speaker: str, language: str, params: dict) -> str:
+    return content_key(text, speaker, language, params)
+
+
+def decode_audio(audio) -> bytes:
+    """Sarvam returns base64 strings; handle raw bytes too."""
+    if isinstance(audio, str):
+        return base64.b64decode(audio)
+    return audio
+
+
+def synthesize(sarvam_client, text: str, speaker: str, language: str, params: dict) -> Optional[bytes]:
+    """Run one Sarvam text-to-speech call and return WAV bytes (None if nothing was generated)."""
+    with metrics.upstream("sarvam"):
+        response = sarvam_client.text_to_speech.convert(
+            text=text,
+            language_code=language,
+            speaker=speaker,
+            **params
+        )
+    if hasattr(response, 'audios') and response.audios:
+        return decode_audio(response.audios[0])
+    return None
+
+
+def split_text(text: str, max_chars: int = TTS_CHUNK_CHARS) -> List[str]:
+    """Split text on sentence boundaries into chunks of at most max_chars (overlong sentences are cut at spaces)."""
+    chunks = []
+    current = ""
+    for sentence in _SENTENCE_BREAK_RE.split(text.strip()):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        while len(sentence) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            cut = sentence.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            chunks.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def parse_wav(data: bytes):
+    """Return (fmt chunk body, PCM data) of a WAV file without decoding any audio."""
+    view = memoryview(data)
+    if bytes(view[:4]) != b"RIFF" or bytes(view[8:12]) != b"WAVE":
+        raise TTSError("Segment is not a WAV file")
+    pos = 12
+    fmt = None
+    while pos + 8 <= len(view):
+        chunk_id = bytes(view[pos:pos + 4])
+        size = int.from_bytes(view[pos + 4:pos + 8], "little")
+        body_start = pos + 8
+        if chunk_id == b"fmt ":
+            fmt = bytes(view[body_start:body_start + size])
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise TTSError("WAV data chunk before fmt chunk")
+            # Streaming encoders may leave the size unset; the data then runs to the end
+            end = body_start + size
+            if size in (0, _UNKNOWN_SIZE) or end > len(view):
+                end = len(view)
+            return fmt, view[body_start:end]
+        pos = body_start + size + (size & 1)
+    raise TTSError("WAV has no data chunk")
+
+
+def wav_header(fmt: bytes, data_len: Optional[int]) -> bytes:
+    """RIFF/WAVE header for `data_len` bytes of audio (None for a stream of unknown length)."""
+    if data_len is None:
+        riff_len = data_len = _UNKNOWN_SIZE
+    else:
+        riff_len = 4 + 8 + len(fmt) + 8 + data_len
+    return b"".join([
+        b"RIFF", riff_len.to_bytes(4, "little"), b"WAVE",
+        b"fmt ", len(fmt).to_bytes(4, "little"), fmt,
+        b"data", data_len.to_bytes(4, "little"),
+    ])
+
+
+def stitch_wav(segments: List[bytes]) -> bytes:
+    """Concatenate WAV segments of the same format by rewriting the header; audio is not re-encoded."""
+    if not segments:
+        raise TTSError("No WAV segments to stitch")
+    parsed = [parse_wav(segment) for segment in segments]
+    fmt = parsed[0][0]
+    if any(segment_fmt != fmt for segment_fmt, _ in parsed):
+        raise TTSError("WAV segments have different formats")
+    total = sum(len(data) for _, data in parsed)
+    return b"".join([wav_header(fmt, total)] + [data for _, data in parsed])
+
+
+def _synthesize_chunk(sarvam_client, text: str, speaker: str, language: str, params: dict) -> bytes:
+    with _sarvam_slots:
+        audio = synthesize(sarvam_client, text, speaker, language, params)
+    if not audio:
+        raise TTSError("No audio generated")
+    return audio
+
+
+def _submit_chunks(sarvam_client, text: str, speaker: str, language: str, params: dict):
+    chunks = split_text(text)
+    if not chunks:
+        raise TTSError("No text to synthesize")
+    return [
+        _executor.submit(_synthesize_chunk, sarvam_client, chunk, speaker, language, params)
+        for chunk in chunks
+    ]
+
+
+def synthesize_long(sarvam_client, text: str, speaker: str, language: str, params: dict) -> bytes:
+    """Synthesize sentence chunks in parallel (capped by TTS_CONCURRENCY) and stitch one WAV."""
+    futures = _submit_chunks(sarvam_client, text, speaker, language, params)
+    try:
+        return stitch_wav([future.result() for future in futures])
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+class _Synthesis:
+    """One in-progress long-form synthesis, shared by every stream of the same key."""
+
+    def __init__(self, futures):
+        self.futures = futures
+        self.remaining = len(futures)
+        self.consumers = 0
+
+
+# key -> _Synthesis; re-entrant because cancelling a future runs its done-callbacks inline
+_live = {}
+_live_lock = threading.RLock()
+
+
+def stream_long(sarvam_client, text: str, speaker: str, language: str, params: dict,
+                on_complete=None, key: Optional[str] = None):
+    """
+    Yield one WAV as its chunks finish (in order): the header as soon as the first chunk
+    is ready, then each chunk's audio data. `on_complete(wav_bytes)` receives the stitched
+    file once every chunk is done. Streams with the same `key` (concurrent GETs, <audio>
+    re-requests) share one synthesis; it is cancelled only when its last stream goes away.
+    """
+    with _live_lock:
+        synthesis = _live.get(key) if key is not None else None
+        if synthesis is None:
+            synthesis = _Synthesis(_submit_chunks(sarvam_client, text, speaker, language, params))
+            if key is not None:
+                _live[key] = synthesis
+            for future in synthesis.futures:
+                future.add_done_callback(lambda _, s=synthesis: _chunk_done(key, s, on_complete))
+        synthesis.consumers += 1
+    return _consume(key, synthesis)
+
+
+def _chunk_done(key, synthesis: _Synthesis, on_complete):
+    with _live_lock:
+        synthesis.remaining -= 1
+        if synthesis.remaining:
+            return
+    try:
+        if on_complete is not None and not any(f.cancelled() or f.exception() for f in synthesis.futures):
+            on_complete(stitch_wav([f.result() for f in synthesis.futures]))
+    except Exception as e:
+        print(f"Storing synthesized audio failed: {str(e)}")
+    finally:
+        # Dropped only after on_complete cached the audio, so later GETs find it there
+        with _live_lock:
+            if key is not None and _live.get(key) is synthesis:
+                del _live[key]
+
+
+def _consume(key, synthesis: _Synthesis):
+    try:
+        fmt = None
+        for future in synthesis.futures:
+            segment = future.result()
+            segment_fmt, data = parse_wav(segment)
+            if fmt is None:
+                fmt = segment_fmt
+                yield wav_header(fmt, None)
+            elif segment_fmt != fmt:
+                raise TTSError("WAV segments have different formats")
+            yield bytes(data)
+    finally:
+        with _live_lock:
+            synthesis.consumers -= 1
+            if synthesis.consumers == 0 and not all(f.done() for f in synthesis.futures):
+                # Nobody is listening any more: drop it so a new request starts fresh
+                if key is not None and _live.get(key) is synthesis:
+                    del _live[key]
+                for future in synthesis.futures:
+                    future.cancel()
@@ -0,0 +1,163 @@
+import io
+import os
+import uuid
+import random
+import hashlib
+import threading
+import time
+from typing import Optional
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv()
+
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "60"))
+# Keep-alive connections kept per upstream host
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "20"))
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "3"))
+UPSTREAM_BACKOFF = float(os.getenv("UPSTREAM_BACKOFF", "0.5"))
+
+DEFAULT_TIMEOUT = (UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT)
+# Read size for streamed request bodies (file uploads)
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+
+class JitteredRetry(Retry):
+    """urllib3 Retry with full jitter, so workers don't retry a struggling provider in lockstep."""
+
+    def get_backoff_time(self) -> float:
+        backoff = super().get_backoff_time()
+        return random.uniform(0, backoff) if backoff else 0
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies DEFAULT_TIMEOUT when a call doesn't pass its own."""
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = DEFAULT_TIMEOUT
+        return super().send(request, **kwargs)
+
+
+# Status retries only apply to idempotent methods (GET/PUT/DELETE/...); POSTs are
+# retried only when the connection could not be established at all.
+_retry = JitteredRetry(
+    total=UPSTREAM_RETRIES,
+    connect=UPSTREAM_RETRIES,
+    read=UPSTREAM_RETRIES,
+    status=UPSTREAM_RETRIES,
+    backoff_factor=UPSTREAM_BACKOFF,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+
+# One adapter (and so one set of per-host pools) shared by every provider session
+_adapter = TimeoutHTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=UPSTREAM_POOL_SIZE,
+    max_retries=_retry,
+)
+
+class InstrumentedSession(requests.Session):
+    """Session that records latency, status and response size of every call under its provider name."""
+
+    def __init__(self, provider: str):
+        super().__init__()
+        self.provider = provider
+
+    def request(self, method, url, *args, **kwargs):
+        metrics.upstream_in_flight.inc(self.provider)
+        started = time.perf_counter()
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except requests.exceptions.RequestException:
+            metrics.record_upstream_response(self.provider, time.perf_counter() - started, "error")
+            raise
+        finally:
+            metrics.upstream_in_flight.dec(self.provider)
+        length = response.headers.get("Content-Length")
+        metrics.record_upstream_response(self.provider, time.perf_counter() - started, response.status_code,
+                                         int(length) if length and length.isdigit() else None)
+        return response
+
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+def get_session(name: str = "default", headers: dict = None) -> requests.Session:
+    """
+    Return the process-wide session for a provider (e.g. "openrouter", "soniox", "rag").
+    Sessions share one pooled keep-alive adapter; `headers` are set on the provider's
+    session only, so credentials never leak to another host.
+    """
+    with _lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = InstrumentedSession(name)
+            session.mount("https://", _adapter)
+            session.mount("http://", _adapter)
+            _sessions[name] = session
+        if headers:
+            session.headers.update(headers)
+        return session
+
+
+class MultipartUpload:
+    """
+    File-like multipart/form-data body that reads the payload lazily in chunks, so an
+    upload is forwarded upstream without ever holding the whole file in memory.
+    With a known `size` requests sends a Content-Length; otherwise iterate it for chunked transfer.
+    """
+
+    def __init__(self, fileobj, filename: str, content_type: Optional[str] = None,
+                 size: Optional[int] = None, field: str = "file"):
+        boundary = uuid.uuid4().hex
+        head = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type or 'application/octet-stream'}\r\n\r\n"
+        ).encode("utf-8")
+        tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        self._parts = [io.BytesIO(head), fileobj, io.BytesIO(tail)]
+        self.len = len(head) + size + len(tail) if size is not None else None
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+
+    def read(self, n: int = -1) -> bytes:
+        out = bytearray()
+        while self._parts and (n < 0 or len(out) < n):
+            chunk = self._parts[0].read(-1 if n < 0 else n - len(out))
+            if not chunk:
+                self._parts.pop(0)
+                continue
+            out += chunk
+        return bytes(out)
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+class HashingReader:
+    """Wraps a stream and hashes the bytes as they are read through it."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._hash = hashlib.sha256()
+
+    def read(self, n: int = -1) -> bytes:
+        chunk = self._stream.read(n)
+        self._hash.update(chunk)
+        return chunk
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
@@ -0,0 +1,185 @@
+import os
+import time
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+import httplib2
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from cache import LRUCache, SingleFlight
+from mongodb import db
+import metrics
+
+YOUTUBE_CACHE_TTL = int(os.getenv("YOUTUBE_CACHE_TTL", "900"))
+# Search results are shared by all workers through Mongo, so a query costs one
+# search.list call (100 quota units) per TTL for the whole deployment
+shared_cache = db['youtube_cache']
+leases = db['leases']
+# Random topics requested within the last TTL are re-fetched when their entry is 80% through
+# its TTL, by whichever process holds the refresher lease; idle topics are left to expire
+_REFRESH_AFTER = YOUTUBE_CACHE_TTL * 0.8
+_REFRESH_CHECK = max(YOUTUBE_CACHE_TTL / 10, 5)
+# requested_at is written at most this often per topic and process
+_TOUCH_INTERVAL = 60
+_LEASE = "youtube-refresher"
+_holder = f"{socket.gethostname()}:{os.getpid()}"
+
+RANDOM_TOPICS = ["music", "tech", "sports", "news", "funny", "gaming", "AI", "education", "space"]
+_RANDOM_KEYS = {" ".join(topic.lower().split()) for topic in RANDOM_TOPICS}
+
+_cache = LRUCache(max_items=512, ttl=YOUTUBE_CACHE_TTL)
+metrics.register_cache("youtube", _cache)
+_inflight = SingleFlight()
+# httplib2.Http isn't thread-safe, so each thread gets its own connection object
+_local = threading.local()
+_refresher_started = False
+_refresher_lock = threading.Lock()
+_indexes_ready = False
+_touched = {}
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def _http() -> httplib2.Http:
+    http = getattr(_local, "http", None)
+    if http is None:
+        http = _local.http = httplib2.Http(timeout=10)
+    return http
+
+
+def _fetch(youtube, query: str) -> list:
+    request_api = youtube.search().list(
+        q=query,
+        part="snippet",
+        maxResults=10,
+        type="video"
+    )
+    with metrics.upstream("youtube"):
+        return request_api.execute(http=_http()).get("items", [])
+
+
+def search_videos(youtube, query: str, refresh: bool = False) -> list:
+    """
+    Return raw search items for a query, cached for YOUTUBE_CACHE_TTL by normalized query
+    in this process and in Mongo for all workers. Concurrent identical misses share a
+    single upstream call.
+    """
+    key = normalize_query(query)
+    if not refresh:
+        _touch(key)
+        items = _cache.get(key)
+        if items is not None:
+            return items
+
+    return _inflight.do(key, _fetch_and_store, youtube, query, key, refresh)
+
+
+def _fetch_and_store(youtube, query: str, key: str, refresh: bool = False) -> list:
+    if not refresh:
+        doc = _shared_get(key)
+        if doc is not None:
+            _cache.set(key, doc["items"])
+            return doc["items"]
+    items = _fetch(youtube, query)
+    _cache.set(key, items)
+    _shared_set(key, items)
+    return items
+
+
+def _ensure_indexes():
+    global _indexes_ready
+    if not _indexes_ready:
+        _indexes_ready = True
+        try:
+            shared_cache.create_index("expires_at", expireAfterSeconds=0, name="expires_at_ttl")
+        except PyMongoError as e:
+            print("Could not create YouTube cache TTL index:", e)
+
+
+def _shared_get(key: str):
+    try:
+        return shared_cache.find_one({"_id": key, "fetched_at": {"$gt": time.time() - YOUTUBE_CACHE_TTL}},
+                                     {"items": 1})
+    except PyMongoError as e:
+        print("YouTube shared cache read failed:", e)
+        return None
+
+
+def _shared_set(key: str, items: list):
+    _ensure_indexes()
+    try:
+        shared_cache.update_one({"_id": key}, {"$set": {
+            "items": items,
+            "fetched_at": time.time(),
+            "expires_at": datetime.now(timezone.utc) + timedelta(seconds=YOUTUBE_CACHE_TTL),
+        }}, upsert=True)
+    except PyMongoError as e:
+        print("YouTube shared cache write failed:", e)
+
+
+def _touch(key: str):
+    """Record that a random topic is in use, so the refresher keeps it warm."""
+    if key not in _RANDOM_KEYS:
+        return
+    now = time.time()
+    if now - _touched.get(key, 0) < _TOUCH_INTERVAL:
+        return
+    _touched[key] = now
+    try:
+        shared_cache.update_one({"_id": key}, {"$set": {"requested_at": now}}, upsert=True)
+    except PyMongoError as e:
+        print("YouTube shared cache write failed:", e)
+
+
+def _hold_lease() -> bool:
+    """Take or renew the deployment-wide refresher lease; False if another process holds it."""
+    now = time.time()
+    try:
+        leases.find_one_and_update(
+            {"_id": _LEASE, "$or": [{"until": {"$lt": now}}, {"holder": _holder}]},
+            {"$set": {"holder": _holder, "until": now + _REFRESH_CHECK * 3}},
+            upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        return True
+    except DuplicateKeyError:
+        # The lease document exists and is held by someone else
+        return False
+
+
+def _refresh_due(youtube):
+    now = time.time()
+    due = shared_cache.find({
+        "_id": {"$in": list(_RANDOM_KEYS)},
+        "requested_at": {"$gt": now - YOUTUBE_CACHE_TTL},
+        "$or": [{"fetched_at": {"$lt": now - _REFRESH_AFTER}}, {"fetched_at": {"$exists": False}}],
+    }, {"_id": 1})
+    for doc in due:
+        try:
+            search_videos(youtube, doc["_id"], refresh=True)
+        except Exception as e:
+            print(f"YouTube prefetch for '{doc['_id']}' failed:", e)
+
+
+def _refresh_forever(youtube):
+    while True:
+        try:
+            if _hold_lease():
+                _refresh_due(youtube)
+        except Exception as e:
+            print("YouTube refresh failed:", e)
+        time.sleep(_REFRESH_CHECK)
+
+
+def start_refresher(youtube):
+    """
+    Start this process's refresher thread (once). Only the holder of the Mongo lease
+    refreshes, so there is one active refresher per deployment.
+    """
+    global _refresher_started
+    with _refresher_lock:
+        if _refresher_started:
+            return
+        _refresher_started = True
+    threading.Thread(target=_refresh_forever, args=(youtube,), name="youtube-refresher", daemon=True).start()